@@ -0,0 +1,74 @@
+"""
+Latency of reading a completed job's branch responses from S3.
+
+Compares the old Response_api path, which listed <job_id>/output/ and then
+fetched the primary and secondary responses one after the other, with
+assemble_final_response, which issues both GETs concurrently and treats
+NoSuchKey as not ready. S3 is moto's in-process stand-in, with --latency
+seconds added to every request.
+
+    python benchmarks/final_response_fetch.py [--latency 0.05] [--rounds 20]
+"""
+import argparse
+import json
+import os
+import statistics
+import sys
+import time
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'Response_api'))
+
+import boto3  # noqa: E402
+from moto import mock_aws  # noqa: E402
+from final_response import OUTPUT_BUCKET, assemble_final_response  # noqa: E402
+
+
+def list_then_get_sequentially(s3_client, job_id, bucket_name=OUTPUT_BUCKET):
+    """The fetch path as it was: a listing to check existence, then two GETs in turn."""
+    listing = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=f"{job_id}/output/")
+    if listing.get('KeyCount', 0) == 0:
+        return None
+    final_templates = [
+        json.loads(s3_client.get_object(Bucket=bucket_name, Key=f"{job_id}/output/{branch}_response.json")['Body'].read())
+        for branch in ("primary", "secondary")
+    ]
+    return json.dumps(final_templates, separators=(',', ':')).encode('utf-8')
+
+
+def measure(name, fetch, s3_client, job_id, rounds):
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        body = fetch(s3_client, job_id)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    print(f"{name:<24} median: {statistics.median(timings) * 1000:6.1f} ms  max: {timings[-1] * 1000:6.1f} ms")
+    return body
+
+
+@mock_aws
+def main(latency, rounds):
+    s3_client = boto3.client('s3')
+    # Every request waits before moto answers it, as a round trip to S3 would
+    s3_client.meta.events.register('before-send.s3.*', lambda **kwargs: time.sleep(latency))
+    s3_client.create_bucket(Bucket=OUTPUT_BUCKET)
+    job_id = "benchmark-job"
+    for branch in ("primary", "secondary"):
+        template = {f"{branch}_field_{index}": f"value {index}" for index in range(200)}
+        s3_client.put_object(Bucket=OUTPUT_BUCKET, Key=f"{job_id}/output/{branch}_response.json", Body=json.dumps(template))
+
+    print(f"{latency * 1000:.0f} ms per S3 request, {rounds} rounds")
+    before = measure("list, then GET each", list_then_get_sequentially, s3_client, job_id, rounds)
+    after = measure("concurrent GETs", assemble_final_response, s3_client, job_id, rounds)
+    assert before == after, "both fetch paths should return the same body"
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--latency', type=float, default=0.05, help="seconds added to every S3 request")
+    parser.add_argument('--rounds', type=int, default=20)
+    args = parser.parse_args()
+    main(args.latency, args.rounds)
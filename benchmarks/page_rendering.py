@@ -0,0 +1,121 @@
+"""
+PDF parses and wall time for OCRing one 100-page scanned PDF.
+
+Compares the old Konzeprimary page loop, which reopened the PDF for every
+page (plus once more to count them), with the PageScheduler that opens each
+document once and streams rendered pages to the OCR workers. Both render
+pages with the current render policy. Textract is replaced by a stub engine
+that sleeps for --ocr-latency seconds per page.
+
+    python benchmarks/page_rendering.py [--pages 100] [--workers 10] [--ocr-latency 0.05]
+"""
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.update({
+    'OCR_CACHE_BACKEND': 'none',
+    'JOB_STATE_BACKEND': 'memory',
+    'STAGE_QUEUE_BACKEND': 'memory',
+    'ASYNC_TEXTRACT_MIN_PAGES': '0',
+})
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src', 'Konzeprimary'))
+
+import fitz  # noqa: E402
+import main  # noqa: E402
+
+
+class StubEngine:
+    name = "stub"
+
+    def __init__(self, latency):
+        self.latency = latency
+
+    def page_text(self, img_bytes):
+        time.sleep(self.latency)
+        return f"{len(img_bytes)} bytes", self.name
+
+
+class ParseCounter:
+    """Counts fitz.open calls while installed."""
+
+    def __init__(self):
+        self.count = 0
+        self.open = fitz.open
+
+    def __call__(self, *args, **kwargs):
+        self.count += 1
+        return self.open(*args, **kwargs)
+
+
+def scanned_pdf(path, page_total):
+    """Every page is a full-page grey scan image with a page number and no usable text layer."""
+    scan = fitz.Pixmap(fitz.csGRAY, fitz.IRect(0, 0, 1240, 1754), False)
+    scan.set_rect(scan.irect, (230,))
+    scan.set_rect(fitz.IRect(120, 160, 1120, 1600), (40,))
+    document = fitz.open()
+    for page_number in range(page_total):
+        page = document.new_page()
+        page.insert_image(page.rect, pixmap=scan)
+        page.insert_text((72, 72), f"{page_number}")
+    document.save(path)
+
+
+def reopen_per_page(local_path, engine, workers):
+    """The page loop as it was: every page reopens and reparses the PDF."""
+
+    def process_page(page_number):
+        pdf_document = fitz.open(local_path)
+        img_bytes = main.render_page_image(pdf_document.load_page(page_number))
+        return page_number, engine.page_text(img_bytes)[0]
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pdf_document = fitz.open(local_path)
+        futures = [executor.submit(process_page, page_number) for page_number in range(len(pdf_document))]
+        results = sorted(future.result() for future in as_completed(futures))
+    return "".join(text + " " for _, text in results)
+
+
+def page_scheduler(local_path, engine, workers):
+    scheduler = main.PageScheduler(engine, workers)
+    for _, aggregated_text, _, error in scheduler.run([(local_path, None, None)]):
+        if error is not None:
+            raise error
+        return aggregated_text
+
+
+def measure(name, run, local_path, engine, workers):
+    counter = ParseCounter()
+    fitz.open = counter
+    try:
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):  # The render policy logs every page
+            text = run(local_path, engine, workers)
+        elapsed = time.perf_counter() - start
+    finally:
+        fitz.open = counter.open
+    print(f"{name:<16} parses: {counter.count:>4}  wall time: {elapsed:6.2f}s")
+    return text
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--pages', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=10)
+    parser.add_argument('--ocr-latency', type=float, default=0.05, help="seconds the stub engine spends per page")
+    args = parser.parse_args()
+
+    engine = StubEngine(args.ocr_latency)
+    with tempfile.TemporaryDirectory() as directory:
+        local_path = os.path.join(directory, "synthetic.pdf")
+        scanned_pdf(local_path, args.pages)
+        print(f"{args.pages}-page scanned PDF, {args.workers} OCR workers, {args.ocr_latency * 1000:.0f} ms per OCR call")
+        before = measure("reopen per page", reopen_per_page, local_path, engine, args.workers)
+        after = measure("page scheduler", page_scheduler, local_path, engine, args.workers)
+    assert before == after, "both page loops should produce the same text"
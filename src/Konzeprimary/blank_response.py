@@ -0,0 +1,114 @@
+"""
+Response written for the secondary applicant when the job has no secondary
+documents, the same one Konzesecondary writes for an empty folder.
+"""
+
+BLANK_SECONDARY_RESPONSE = {
+    "applicant_info": {
+        "applicant_type": "secondary",
+        "firstname": "",
+        "middlename": "",
+        "lastname": "",
+        "gender": "",
+        "dateofbirth": ""
+    },
+    "contact_information_info": {
+        "address": {
+            "address": "",
+            "city": "",
+            "zipcode": "",
+            "state": "",
+            "country": ""
+        }
+    },
+    "passport_info": {
+        "passport_number": "",
+        "given_name": "",
+        "surname": "",
+        "dateofbirth": "",
+        "gender": "",
+        "place_of_birth": "",
+        "place_of_issue": "",
+        "date_of_issue": "",
+        "date_of_expiry": ""
+    },
+    "academics_info": [
+        {
+            "qualification": "",
+            "course_name": "",
+            "institution_name": "",
+            "institution_country": "",
+            "passing_month": "",
+            "passing_year": "",
+            "grade": "",
+            "total_marks": "",
+            "obtained_marks": ""
+        }
+    ],
+    "transcript_certificate_info": [
+        {
+            "qualification": "",
+            "institution_name": "",
+            "institution_country": "",
+            "course_name": "",
+            "passing_month": "",
+            "passing_year": "",
+            "grade": "",
+            "total_marks": "",
+            "obtained_marks": ""
+        }
+    ],
+    "insurance_info": {
+        "insurance_type": "",
+        "provider_name": "",
+        "policy_no": "",
+        "policy_type": "",
+        "policy_startdate": "",
+        "policy_enddate": "",
+        "member_info": [
+            {
+                "member_name": ""
+            }
+        ]
+    },
+    "english_test_info": {
+        "test_type": "",
+        "test_date": "",
+        "Valid_Until_date": "",
+        "registration_id": "",
+        "name": "",
+        "centre_number": "",
+        "country_of_residence": "",
+        "gender": "",
+        "overall_result": "",
+        "result": {
+            "listening": "",
+            "reading": "",
+            "writing": "",
+            "speaking": ""
+        }
+    },
+    "australian_qualification_info": {
+        "provider": "",
+        "course": "",
+        "course_level": "",
+        "course_startdate": "",
+        "course_enddate": "",
+        "initial_tuition_fee": "",
+        "initial_non_tuition_fee": "",
+        "total_tuition_fee": "",
+        "given_name": "",
+        "oshc_provided_by_provider": ""
+    },
+    "employment_history": [
+        {
+            "position": "",
+            "employer_name": "",
+            "country": "",
+            "joining-month": "",
+            "joining-year": "",
+            "resignation-month": "",
+            "resignation-year": ""
+        }
+    ]
+}
@@ -0,0 +1,122 @@
+import boto3
+import os
+import concurrent.futures
+from langchain.vectorstores import FAISS
+from langchain.text_splitter import RecursiveCharacterTextSplitter
+from langchain_core.documents import Document
+from bedrock_embeddings import batched_embeddings_from_env
+from embedding_cache import embedding_cache_from_env
+from chunk_store import save_chunk_store
+from rate_limit import rate_limited_from_env, BOTOCORE_NO_RETRIES
+from stage_queue import stage_queue_from_env
+from job_state import job_state_from_env, IN_PROGRESS, VECTOR_GENERATED
+
+# Clients
+s3 = boto3.client('s3')
+job_state = job_state_from_env()
+
+extraction_queue = stage_queue_from_env(os.getenv('PRIMARY_EXTRACTION_QUEUE_URL'), os.getenv('PRIMARY_EXTRACTION_FUNCTION_ARN'))
+
+# "mmap" also writes the pickle-free chunk store read by the extraction stage
+index_format = os.getenv('INDEX_FORMAT', 'pickle').lower()
+
+# Bedrock calls take a token from the shared per-model limiter; the proxy is their only retry layer
+bedrock_runtime = rate_limited_from_env(
+    boto3.client(
+        service_name="bedrock-runtime",
+        region_name="ap-south-1",
+        config=BOTOCORE_NO_RETRIES,
+    ),
+    'bedrock',
+)
+
+embedding_model_id = "cohere.embed-english-v3"
+
+# Same embedding stack as primary_Embeddings: batched Bedrock calls behind the chunk cache
+embeddings = embedding_cache_from_env(
+    s3,
+    batched_embeddings_from_env(bedrock_runtime, embedding_model_id),
+    embedding_model_id,
+)
+
+# Same splitter settings as primary_Embeddings so both paths build identical indexes
+text_splitter = RecursiveCharacterTextSplitter(chunk_size=1200, chunk_overlap=50)
+
+
+def is_transcript(text_filename, text):
+    """
+    Mirror of the primary_Embeddings routing: a file goes to the transcript
+    index when its name or its content mentions a transcript.
+    """
+    return 'transcript' in text_filename.lower() or 'transcript' in text.lower()
+
+
+def save_and_upload_index(vector, bucket_name, job_id, local_dir, index_name):
+    vector.save_local(folder_path=local_dir, index_name=index_name)
+    for extension in ('faiss', 'pkl'):
+        local_path = os.path.join(local_dir, f"{index_name}.{extension}")
+        s3.upload_file(local_path, bucket_name, f"{job_id}/embeddings/primary/{index_name}.{extension}")
+        os.remove(local_path)
+    if index_format == 'mmap':
+        for extension, local_path in save_chunk_store(vector, local_dir, index_name).items():
+            s3.upload_file(local_path, bucket_name, f"{job_id}/embeddings/primary/{index_name}.{extension}")
+            os.remove(local_path)
+    print(f"Uploaded {index_name} embeddings")
+
+
+def run_fused_pipeline(documents, job_id, student):
+    """
+    Chunk and embed OCR output as it is produced, then build the primary FAISS
+    indexes and hand off straight to primary_Extraction.
+
+    Args:
+        documents (iterable): (text_filename, text) pairs, yielded as each PDF
+            finishes OCR
+        job_id (str): Job identifier
+        student (str): Folder path passed on to the extraction stage
+
+    Returns:
+        bool: True if an index was built and extraction was triggered
+    """
+    bucket_name = "konze-processing-bucket"
+    # index name -> (chunks, futures of their vectors)
+    groups = {"index": ([], []), "transcript_index": ([], [])}
+
+    # Embedding of one document overlaps with OCR of the next
+    with concurrent.futures.ThreadPoolExecutor(max_workers=2) as embed_executor:
+        for text_filename, text in documents:
+            chunks = text_splitter.split_documents([Document(page_content=text, metadata={"source": text_filename})])
+            if not chunks:
+                continue
+            index_name = "transcript_index" if is_transcript(text_filename, text) else "index"
+            groups[index_name][0].extend(chunks)
+            groups[index_name][1].append(
+                embed_executor.submit(embeddings.embed_documents, [chunk.page_content for chunk in chunks])
+            )
+
+        local_dir = f"/tmp/{job_id}/primaryembed"
+        os.makedirs(local_dir, exist_ok=True)
+        for index_name, (chunks, futures) in groups.items():
+            if not chunks:
+                continue
+            vectors = [vector for future in futures for vector in future.result()]
+            vector = FAISS.from_embeddings(
+                list(zip((chunk.page_content for chunk in chunks), vectors)),
+                embeddings,
+                metadatas=[chunk.metadata for chunk in chunks],
+            )
+            save_and_upload_index(vector, bucket_name, job_id, local_dir, index_name)
+
+    if not groups["index"][0]:
+        print("No documents found or processed.")
+        return False
+
+    # Set job status; never moves a job back once extraction has completed
+    if not job_state.set_status(job_id, VECTOR_GENERATED, stage="primary_embeddings", expected=(IN_PROGRESS, VECTOR_GENERATED)):
+        print(f"Job {job_id} status not set to {VECTOR_GENERATED}, it is missing or already further along")
+
+    extraction_queue.send({
+        "job_id": job_id,
+        "student": student
+    })
+    return True
@@ -3,58 +3,317 @@ import boto3
 import json
 import os
 import fitz
-from concurrent.futures import ThreadPoolExecutor, as_completed
+from concurrent.futures import ThreadPoolExecutor
 from botocore.exceptions import ClientError
 from urllib.parse import urlparse
-import logging
+import itertools
+import queue
+import threading
+import time
+from botocore.config import Config
+from ocr_cache import ocr_cache_from_env, page_key
+from render_policy import render_page_image
+from ocr_engine import ocr_engine_from_env
+from blank_response import BLANK_SECONDARY_RESPONSE
+from textract_async import detect_document_text_async
+from rate_limit import rate_limited_from_env, BOTOCORE_NO_RETRIES
+from job_state import job_state_from_env
+from completion_callback import notify_job_completed
+from final_response import write_final_response_safely
+from stage_queue import stage_queue_from_env, consume
+from s3_download import make_s3_client, download_files_from_s3, read_files_from_s3
 
 # Initialize boto3 clients
-lambda_client = boto3.client('lambda')
-s3_client = boto3.client('s3')
-textract = boto3.client('textract')
-
-secondary_lambda_arn = os.getenv('PRIMARY_EMBEDDING_FUNCTION_ARN')
-
-def invoke_secondary_lambda_async(payload):
-    response = lambda_client.invoke(
-        FunctionName=secondary_lambda_arn,
-        InvocationType='Event',  # Asynchronous invocation
-        Payload=json.dumps(payload)
-    )
-    return response
-
-def process_page(page_number, local_path, textract_client):
+job_state = job_state_from_env()
+# Download workers share this client, so its pool is sized to match them
+s3_download_workers = int(os.getenv('S3_DOWNLOAD_WORKERS', '16'))
+# In-memory mode: listed bytes being read or waiting for OCR at any one time
+s3_read_max_bytes = int(os.getenv('S3_READ_MAX_MB_IN_FLIGHT', '256')) * 1024 * 1024
+s3_client = make_s3_client(max_pool_connections=s3_download_workers + 4)
+# Textract workers for the whole job, sized to the account's DetectDocumentText TPS
+textract_workers = int(os.getenv('TEXTRACT_MAX_WORKERS', '10'))
+# Rendered pages waiting for a worker; bounds the page images held in memory when Textract lags behind
+ocr_queue_max_pages = int(os.getenv('OCR_QUEUE_MAX_PAGES', str(2 * textract_workers)))
+# Every Textract call takes a token from the shared limiter and is retried when throttled
+textract = rate_limited_from_env(
+    boto3.client('textract', config=Config(max_pool_connections=textract_workers).merge(BOTOCORE_NO_RETRIES)),
+    'textract',
+)
+
+# Documents with at least this many pages go through one asynchronous Textract job (0 = never)
+async_textract_min_pages = int(os.getenv('ASYNC_TEXTRACT_MIN_PAGES', '0'))
+async_textract_poll_seconds = float(os.getenv('ASYNC_TEXTRACT_POLL_SECONDS', '5'))
+async_textract_timeout_seconds = float(os.getenv('ASYNC_TEXTRACT_TIMEOUT_SECONDS', '400'))
+# Invocation time kept back for uploads and hand-off after the last asynchronous job
+async_textract_reserve_seconds = float(os.getenv('ASYNC_TEXTRACT_RESERVE_SECONDS', '60'))
+
+# Textract, or a local engine selected by OCR_ENGINE, with optional failover on throttling
+ocr_engine = ocr_engine_from_env(textract)
+
+# Content-addressed cache of Textract page text, None when OCR_CACHE_BACKEND is "none"
+ocr_cache = ocr_cache_from_env(s3_client)
+
+# Pages whose embedded text layer has at least this many characters skip Textract
+min_text_layer_chars = int(os.getenv('MIN_TEXT_LAYER_CHARS', '200'))
+
+primary_embedding_queue = stage_queue_from_env(os.getenv('PRIMARY_EMBEDDING_QUEUE_URL'), os.getenv('PRIMARY_EMBEDDING_FUNCTION_ARN'))
+secondary_embedding_queue = stage_queue_from_env(os.getenv('SECONDARY_EMBEDDING_QUEUE_URL'), os.getenv('SECONDARY_EMBEDDING_FUNCTION_ARN'))
+
+# OCR the primary/ and secondary/ folders in one pass through the same page pool (Request_api then skips Konzesecondary)
+unified_mode = os.getenv('UNIFIED_OCR', 'false').lower() == 'true'
+
+# Read PDFs and write text straight from/to S3 instead of staging them in /tmp
+in_memory_mode = os.getenv('OCR_IN_MEMORY', 'false').lower() == 'true'
+
+# Chunk and embed in this function instead of staging text files for primary_Embeddings
+fused_mode = os.getenv('FUSED_PIPELINE', 'false').lower() == 'true'
+if fused_mode:
+    # Only pay for the LangChain/FAISS imports when the fused mode is on
+    from fused_pipeline import run_fused_pipeline
+
+def extract_text_layer(page):
+    """
+    Return the page's embedded text joined the same way as the Textract LINE
+    output, or None when the text layer is too sparse to trust (scanned pages).
+    """
+    lines = (line.strip() for line in page.get_text().splitlines())
+    page_text = " ".join(line for line in lines if line)
+    if len(page_text) < min_text_layer_chars:
+        return None
+    return page_text
+
+def render_pages(pdf_document, page_counts):
+    """
+    Walk the pages of an already opened document, one at a time, yielding
+    (page_number, page_text, img_bytes). Born-digital pages come back with their
+    native text and no image; everything else is rasterised for Textract by
+    the render policy.
+    PyMuPDF documents are not thread safe, so this stays on the calling thread
+    and only the Textract calls are handed to the worker pool.
+    """
+    for page_number in range(len(pdf_document)):
+        page = pdf_document.load_page(page_number)
+        page_text = extract_text_layer(page)
+        if page_text is not None:
+            page_counts["text_layer"] += 1
+            yield page_number, page_text, None
+            continue
+        page_counts["textract"] += 1
+        yield page_number, None, render_page_image(page)
+
+def open_pdf(local_path, pdf_bytes=None):
+    """
+    Open a PDF from memory when its bytes are given, otherwise from disk.
+    """
+    if pdf_bytes is not None:
+        return fitz.open(stream=pdf_bytes, filetype="pdf")
+    return fitz.open(local_path)
+
+def process_page(page_number, img_bytes, engine):
     ("process page statrted")
-    pdf_document = fitz.open(local_path)
-    page = pdf_document.load_page(page_number)
-    pix = page.get_pixmap()
-    img_bytes = pix.tobytes("png")
-    
-    response = textract_client.detect_document_text(
-        Document={'Bytes': img_bytes}
-    )
+    if ocr_cache is not None:
+        cached_text = ocr_cache.get(page_key(img_bytes, engine.name))
+        if cached_text is not None:
+            return page_number, cached_text
 
-    page_text = " ".join(item['Text'] for item in response['Blocks'] if item['BlockType'] == 'LINE')
+    page_text, engine_name = engine.page_text(img_bytes)
+    if ocr_cache is not None:
+        # Keyed by the engine that actually read the page, which differs after a failover
+        ocr_cache.put(page_key(img_bytes, engine_name), page_text)
 
     return page_number, page_text  # Return page number with the result
 
-def process_pdf(local_path, textract_client, job_id):
-    aggregated_text = ""
-    confidence_scores = []
-    print("local path process pdf",local_path)
-
-    with ThreadPoolExecutor() as executor:
-        pdf_document = fitz.open(local_path)
-        futures = {executor.submit(process_page, page_number, local_path, textract_client): page_number for page_number in range(len(pdf_document))}
-
-        # Collect results and sort by page number
-        results = sorted((future.result() for future in as_completed(futures)), key=lambda x: x[0])
-        for page_number, text in results:  # Unpack the sorted results
-            aggregated_text += text + " "  # Append text in sequence with a space after each block
-            
-    output_directory = f"/tmp/{job_id}_output/konzeprimary"
-    
+class PageScheduler:
+    """
+    One bounded pool of OCR workers shared by every PDF in the job.
+
+    Documents are rendered in the order pdf_files yields them, which for
+    pdf_sources is largest object first, so that long documents start early
+    and do not dominate the makespan. The queue only holds max_queued_pages
+    rendered pages, so it cannot reorder documents itself; it orders the pages
+    it holds by the page count of their document, largest first, and within
+    a document by page number. Each document's text is reassembled in page
+    order once its last page finishes.
+
+    When source_bucket is given, documents of at least async_textract_min_pages
+    pages are queued as one asynchronous Textract job on the PDF already in S3
+    instead of page by page. deadline, a time.monotonic() value, is when those
+    jobs must be finished by; it keeps the wait inside the invocation.
+    """
+
+    def __init__(self, engine, max_workers, source_bucket=None, max_queued_pages=0, deadline=None):
+        self.engine = engine
+        self.max_workers = max_workers
+        self.source_bucket = source_bucket
+        self.deadline = deadline
+        # Full queue blocks the producer, so at most max_queued_pages rendered images wait in memory
+        self.pages = queue.PriorityQueue(maxsize=max_queued_pages)
+        self.completed = queue.Queue()
+        self.sequence = itertools.count()
+        self.lock = threading.Lock()
+
+    def _finish_page(self, doc, page_number=None, page_text=None, error=None, count=1):
+        with self.lock:
+            if page_number is not None:
+                doc["texts"][page_number] = page_text
+            if error is not None and doc["error"] is None:
+                doc["error"] = error
+            doc["remaining"] -= count
+            done = doc["remaining"] == 0
+        if done:
+            self.completed.put(doc)
+
+    def _work(self):
+        while True:
+            _, _, doc, page_number, img_bytes = self.pages.get()
+            if doc is None:
+                return
+            if isinstance(page_number, list):
+                self._run_async_document(doc, page_number)
+                continue
+            try:
+                _, page_text = process_page(page_number, img_bytes, self.engine)
+            except Exception as e:
+                self._finish_page(doc, page_number, error=e)
+            else:
+                self._finish_page(doc, page_number, page_text)
+
+    def _run_async_document(self, doc, page_numbers):
+        timeout_seconds = async_textract_timeout_seconds
+        if self.deadline is not None:
+            timeout_seconds = min(timeout_seconds, self.deadline - time.monotonic())
+        try:
+            page_texts = detect_document_text_async(
+                textract, self.source_bucket, doc["s3_key"], len(doc["texts"]),
+                poll_seconds=async_textract_poll_seconds,
+                timeout_seconds=timeout_seconds,
+            )
+        except Exception as e:
+            for page_number in page_numbers:
+                self._finish_page(doc, page_number, error=e)
+            return
+        for page_number in page_numbers:
+            self._finish_page(doc, page_number, page_texts[page_number])
+
+    def _use_async_textract(self, page_total):
+        if self.engine.name != "textract":
+            return False
+        return self.source_bucket is not None and async_textract_min_pages and page_total >= async_textract_min_pages
+
+    def _submit_document(self, local_path, pdf_bytes=None, s3_key=None):
+        # remaining starts at 1: the producer holds the document open until every page is queued
+        doc = {"path": local_path, "s3_key": s3_key, "texts": [], "remaining": 1, "error": None,
+               "page_counts": {"text_layer": 0, "textract": 0}}
+        # Pages counted into remaining but not yet finished or queued for a worker
+        unhanded = 0
+        try:
+            with open_pdf(local_path, pdf_bytes) as pdf_document:
+                page_total = len(pdf_document)
+                with self.lock:
+                    doc["texts"] = [""] * page_total
+                    doc["remaining"] += page_total
+                unhanded = page_total
+                if self._use_async_textract(page_total):
+                    # Only the text layer is read here; Textract rasterises the pages itself
+                    ocr_page_numbers = []
+                    for page_number in range(page_total):
+                        page_text = extract_text_layer(pdf_document.load_page(page_number))
+                        if page_text is not None:
+                            doc["page_counts"]["text_layer"] += 1
+                            unhanded -= 1
+                            self._finish_page(doc, page_number, page_text)
+                        else:
+                            doc["page_counts"]["textract"] += 1
+                            ocr_page_numbers.append(page_number)
+                    if ocr_page_numbers:
+                        self.pages.put((-page_total, next(self.sequence), doc, ocr_page_numbers, None))
+                        unhanded -= len(ocr_page_numbers)
+                else:
+                    for page_number, page_text, img_bytes in render_pages(pdf_document, doc["page_counts"]):
+                        unhanded -= 1
+                        if page_text is not None:
+                            self._finish_page(doc, page_number, page_text)
+                        else:
+                            self.pages.put((-page_total, next(self.sequence), doc, page_number, img_bytes))
+        except Exception as e:
+            # Release the producer's hold together with the pages that will never reach a worker
+            self._finish_page(doc, error=e, count=1 + unhanded)
+        else:
+            self._finish_page(doc)
+
+    def _submit(self, pdf_files):
+        # PyMuPDF is not thread safe, so this single producer thread does all parsing and rendering
+        document_count = 0
+        try:
+            for local_path, pdf_bytes, s3_key in pdf_files:
+                document_count += 1
+                self._submit_document(local_path, pdf_bytes, s3_key)
+        except Exception as e:
+            print(f"Error listing PDF files: {e}")
+        finally:
+            self.completed.put(document_count)
+
+    def run(self, pdf_files):
+        """
+        Schedule every page of pdf_files, an iterable of (path, pdf_bytes,
+        s3_key) as produced by pdf_sources, and yield (local_path, aggregated_text,
+        page_counts, error) for each document as soon as all its pages are done.
+        """
+        workers = [threading.Thread(target=self._work, daemon=True) for _ in range(self.max_workers)]
+        for worker in workers:
+            worker.start()
+        threading.Thread(target=self._submit, args=(pdf_files,), daemon=True).start()
+
+        try:
+            document_count = None
+            finished = 0
+            while document_count is None or finished < document_count:
+                item = self.completed.get()
+                if isinstance(item, int):
+                    document_count = item
+                    continue
+                finished += 1
+                # Text in page order with a space after each block; pages of a failed document may have none
+                aggregated_text = None if item["error"] else "".join(text + " " for text in item["texts"])
+                yield item["path"], aggregated_text, item["page_counts"], item["error"]
+        finally:
+            # Sentinels sort after every real page, so workers drain the queue before exiting
+            for _ in workers:
+                self.pages.put((float('inf'), next(self.sequence), None, None, None))
+
+def ocr_job(pdf_files, engine, page_counts, source_bucket=None, deadline=None):
+    """
+    Run OCR for every PDF of the job through one PageScheduler and yield
+    (local_path, aggregated_text) per document as it completes. Failed
+    documents are logged and skipped. source_bucket is the bucket the PDFs
+    came from, needed for asynchronous Textract, and deadline bounds its jobs.
+    """
+    scheduler = PageScheduler(engine, textract_workers, source_bucket, ocr_queue_max_pages, deadline)
+    for local_path, aggregated_text, pdf_page_counts, error in scheduler.run(pdf_files):
+        if error is not None:
+            print(f"Error processing PDF file {local_path}: {error}")
+            continue
+        print(f"{os.path.basename(local_path)}: {pdf_page_counts['text_layer']} pages from text layer, {pdf_page_counts['textract']} pages via Textract")
+        for source, count in pdf_page_counts.items():
+            page_counts[source] += count
+        yield local_path, aggregated_text
+
+def document_branch(local_path):
+    """
+    "primary" or "secondary": in unified mode, the folder a PDF was listed under.
+    """
+    if not unified_mode:
+        return "primary"
+    return os.path.basename(os.path.dirname(local_path))
+
+def save_text_file(local_path, aggregated_text, job_id, branch="primary"):
     text_filename = os.path.splitext(os.path.basename(local_path))[0] + '.txt'
+    s3_upload_path = f"{job_id}/textfiles/{branch}/{text_filename}"
+    if in_memory_mode:
+        upload_text_to_s3(aggregated_text, 'konze-processing-bucket', s3_upload_path)
+        return
+
+    output_directory = f"/tmp/{job_id}_output/konze{branch}"
     text_file_path = os.path.join(output_directory, text_filename)
 
         # Write extracted text to file
@@ -62,46 +321,58 @@ def process_pdf(local_path, textract_client, job_id):
         text_file.write(aggregated_text)
 
         # Upload the text file to S3
-    s3_upload_path = f"{job_id}/textfiles/primary/{text_filename}"
     upload_file_to_s3(text_file_path, 'konze-processing-bucket', s3_upload_path)
 
-    
-    return aggregated_text
+def ocr_documents(pdf_files, job_id, page_counts, upload_executor, uploads, source_bucket=None, branch_counts=None, deadline=None):
+    """
+    Yield (text_filename, text) for each primary PDF as soon as its OCR
+    finishes. The text of every PDF is written to S3 on upload_executor, off
+    the critical path; its futures are appended to uploads. Secondary PDFs
+    (unified mode) are only written and counted in branch_counts.
+    """
+    for pdf_file, aggregated_text in ocr_job(pdf_files, ocr_engine, page_counts, source_bucket, deadline):
+        branch = document_branch(pdf_file)
+        if branch_counts is not None:
+            branch_counts[branch] += 1
+        uploads.append(upload_executor.submit(save_text_file, pdf_file, aggregated_text, job_id, branch))
+        if branch != "primary":
+            continue
+        text_filename = os.path.splitext(os.path.basename(pdf_file))[0] + '.txt'
+        yield text_filename, aggregated_text
+
+def pdf_sources(bucket_name, folder_path, local_dir, subfolders=("",)):
+    """
+    Yield (local_path, pdf_bytes, s3_key) for every PDF directly inside one of
+    the subfolders of folder_path, largest first, as soon as it arrives.
+    pdf_bytes is None when the file was downloaded to local_dir instead of
+    read into memory.
+    """
+    folder_path = folder_path.rstrip('/')
+
+    def is_wanted_pdf(relative_key):
+        # Filtered on the listing, so nothing else is downloaded or read
+        return os.path.dirname(relative_key) in subfolders and relative_key.endswith('.pdf')
+
+    if in_memory_mode:
+        # PDFs are read into memory as each one arrives, nothing is written to /tmp
+        for relative_key, pdf_bytes in read_files_from_s3(s3_client, bucket_name, folder_path, max_workers=s3_download_workers, max_bytes_in_flight=s3_read_max_bytes, keep=is_wanted_pdf):
+            yield relative_key, pdf_bytes, f"{folder_path}/{relative_key}"
+    else:
+        # PDFs are handed over as soon as each one lands, while the rest keep downloading
+        for local_file_path in download_files_from_s3(s3_client, bucket_name, folder_path, local_dir, max_workers=s3_download_workers, keep=is_wanted_pdf):
+            yield local_file_path, None, f"{folder_path}/{os.path.relpath(local_file_path, local_dir)}"
+
+def write_blank_secondary_response(job_id):
+    s3_path = f"{job_id}/output/secondary_response.json"
+    upload_text_to_s3(json.dumps(BLANK_SECONDARY_RESPONSE, indent=4), 'konze-processing-bucket', s3_path)
 
 def upload_file_to_s3(file_path, bucket_name, s3_path):
     s3_client.upload_file(file_path, bucket_name, s3_path)
     print(f"Uploaded {file_path} to s3://{bucket_name}/{s3_path}")
 
-def list_files_in_s3(bucket_name, folder_path):
-    s3_client = boto3.client('s3')
-    response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=folder_path)
-    return [obj['Key'] for obj in response.get('Contents', [])]
-
-
-def download_files_from_s3(bucket_name, folder_path, local_dir):
-    s3_client = boto3.client('s3')
-    files = list_files_in_s3(bucket_name, folder_path)
-
-    for file_key in files:
-        local_file_path = os.path.join(local_dir, os.path.relpath(file_key, folder_path))
-        local_file_dir = os.path.dirname(local_file_path)
-        
-        # Ensure the directory exists
-        if not os.path.exists(local_file_dir):
-            os.makedirs(local_file_dir)
-
-        logging.info(f"Downloading {file_key} to {local_file_path}")
-
-        try:
-            s3_client.download_file(bucket_name, file_key, local_file_path)
-            logging.info(f"Downloaded {file_key} to {local_file_path}")
-        except OSError as e:
-            logging.error(f"Failed to download {file_key} to {local_file_path}: {e}")
-            # Handle the error appropriately, e.g., retry, skip, etc.
-        except Exception as e:
-            logging.error(f"Unexpected error occurred while downloading {file_key} to {local_file_path}: {e}")
-            # Handle other potential exceptions
-
+def upload_text_to_s3(text, bucket_name, s3_path):
+    s3_client.put_object(Bucket=bucket_name, Key=s3_path, Body=text.encode('utf-8'))
+    print(f"Uploaded {len(text)} characters to s3://{bucket_name}/{s3_path}")
 
 def list_files_in_directory(directory):
     try:
@@ -141,7 +412,7 @@ def clear_directory_files(directory):
             os.remove(file_path)
             print(f"Deleted file: {file_path}")
 
-def lambda_handler(event, context):
+def process_job(event, context):
     job_id = event['job_id']
     links = event.get('links', [])
     print("links", links)
@@ -149,54 +420,103 @@ def lambda_handler(event, context):
     bucket_name = parsed_url.netloc.split('.')[0]
     folder_path = parsed_url.path.lstrip('/')
 
-    folder_path = os.path.join(folder_path.rstrip('/'), 'primary')
+    base_folder = folder_path.rstrip('/')
+    folder_path = os.path.join(base_folder, 'primary')
     # folder_path = folder_path.rstrip('/')
     print("bucket", bucket_name)
     print("folder", folder_path)
     
-    local_dir = f"/tmp/{job_id}/konzeprimary"
-    clear_directory_files(local_dir)
-    print("Temporary directory:", local_dir)
-    os.makedirs(local_dir, exist_ok=True)
-    
-    output_directory = f"/tmp/{job_id}_output/konzeprimary"
-    clear_directory_files(output_directory)
-    print("Output directory:", output_directory)
-    
-    os.makedirs(output_directory, exist_ok=True)
-    
-    download_files_from_s3(bucket_name, folder_path, local_dir)
-    
-    pdf_files = [
-        os.path.join(local_dir, pdf_file) 
-        for pdf_file in os.listdir(local_dir) 
-        if pdf_file.endswith('.pdf')
-    ]
+    if unified_mode:
+        branches = ("primary", "secondary")
+        local_dir = f"/tmp/{job_id}/konzeunified"
+        local_dirs = [os.path.join(local_dir, branch) for branch in branches]
+    else:
+        branches = ("primary",)
+        local_dir = f"/tmp/{job_id}/konzeprimary"
+        local_dirs = [local_dir]
+    output_directories = [f"/tmp/{job_id}_output/konze{branch}" for branch in branches]
+
+    if not in_memory_mode:
+        for directory in local_dirs:
+            clear_directory_files(directory)
+            print("Temporary directory:", directory)
+            os.makedirs(directory, exist_ok=True)
+
+        for directory in output_directories:
+            clear_directory_files(directory)
+            print("Output directory:", directory)
+            os.makedirs(directory, exist_ok=True)
+
+    if unified_mode:
+        pdf_files = pdf_sources(bucket_name, base_folder, local_dir, branches)
+    else:
+        pdf_files = pdf_sources(bucket_name, folder_path, local_dir)
     
-    print("pdf files ", pdf_files)
+
+    # Asynchronous Textract jobs must finish while this invocation can still use their text
+    deadline = None
+    if context is not None:
+        deadline = time.monotonic() + context.get_remaining_time_in_millis() / 1000 - async_textract_reserve_seconds
 
     aggregated_text = ""
     overall_confidences = []
+    page_counts = {"text_layer": 0, "textract": 0}
+    branch_counts = {branch: 0 for branch in branches}
+    if ocr_cache is not None:
+        ocr_cache.reset_stats()
     
-    for pdf_file in pdf_files:
-        try:
-            avg_confidence = process_pdf(pdf_file, textract, job_id)
-            print("text created successfully")
-
-        except Exception as e:
-            print(f"Error processing PDF file {pdf_file}: {e}")
-            continue
-
+    if fused_mode:
+        uploads = []
+        with ThreadPoolExecutor(max_workers=4) as upload_executor:
+            documents = ocr_documents(pdf_files, job_id, page_counts, upload_executor, uploads, bucket_name, branch_counts, deadline)
+            run_fused_pipeline(documents, job_id, folder_path)
+
+        for upload in uploads:
+            if upload.exception() is not None:
+                print(f"Error uploading text file: {upload.exception()}")
+    else:
+        for pdf_file, aggregated_text in ocr_job(pdf_files, ocr_engine, page_counts, bucket_name, deadline):
+            branch = document_branch(pdf_file)
+            branch_counts[branch] += 1
+            try:
+                save_text_file(pdf_file, aggregated_text, job_id, branch)
+                print("text created successfully")
+
+            except Exception as e:
+                print(f"Error processing PDF file {pdf_file}: {e}")
+                continue
+
+    print(f"Pages from text layer: {page_counts['text_layer']}, pages via Textract: {page_counts['textract']}")
+    print("Documents per folder", branch_counts)
+    if ocr_cache is not None:
+        print("OCR cache", ocr_cache.stats())
+
+
+    if not in_memory_mode:
+        for directory in local_dirs + output_directories:
+            clear_directory_files(directory)
 
-    clear_directory_files(local_dir)
-    clear_directory_files(output_directory)
-    
     payload = {
         "job_id": job_id,
         "folder_path" : folder_path
     }
 
-    invoke_secondary_lambda_async(payload)
+    if not fused_mode:
+        primary_embedding_queue.send(payload)
+
+    if unified_mode:
+        if branch_counts["secondary"]:
+            secondary_embedding_queue.send({
+                "job_id": job_id,
+                "folder_path": os.path.join(base_folder, 'secondary')
+            })
+        else:
+            # No secondary applicant: write the blank response the secondary chain would otherwise produce
+            write_blank_secondary_response(job_id)
+            if job_state.complete_branch(job_id, "secondary"):
+                print(f"Job {job_id} completed")
+                write_final_response_safely(s3_client, job_id)
+                notify_job_completed(job_state, job_id)
 
     return {
         "statusCode": 200,
@@ -208,3 +528,9 @@ def lambda_handler(event, context):
         },
         "body": json.dumps("in progress"),
     }
+
+def lambda_handler(event, context):
+    # Jobs arrive in batches from the intake queue, or as a single direct invoke
+    if 'Records' in event:
+        return consume(event['Records'], process_job, context)
+    return process_job(event, context)
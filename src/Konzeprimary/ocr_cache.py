@@ -0,0 +1,206 @@
+import collections
+import hashlib
+import os
+import threading
+import time
+from datetime import datetime, timezone
+
+
+def page_key(img_bytes, namespace="textract"):
+    """
+    Content address of a rendered page. The namespace keeps text produced by
+    different OCR engines apart even when the page image is identical.
+    """
+    digest = hashlib.sha256()
+    digest.update(namespace.encode("utf-8"))
+    digest.update(b"\0")
+    digest.update(img_bytes)
+    return digest.hexdigest()
+
+
+class LocalOcrCache:
+    """
+    Page text stored as one file per key under a local directory.
+
+    Entries older than ttl_seconds are treated as misses and removed. When
+    max_bytes is set, the least recently written entries are evicted after
+    each write until the directory fits again. The entries and their sizes
+    are indexed once, when the cache is created, and kept up to date on
+    every write and removal, so a write never has to walk the directory.
+    """
+
+    def __init__(self, directory, max_bytes=None, ttl_seconds=None):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        # path -> size, least recently written first
+        self.entries = collections.OrderedDict()
+        self.total_bytes = 0
+        if max_bytes:
+            self._index()
+
+    def _index(self):
+        entries = []
+        for root, _, files in os.walk(self.directory):
+            for name in files:
+                if not name.endswith('.txt'):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(entries):
+            self.entries[path] = size
+            self.total_bytes += size
+
+    def _path(self, key):
+        return os.path.join(self.directory, key[:2], f"{key}.txt")
+
+    def _forget(self, path):
+        # Caller holds self.lock
+        self.total_bytes -= self.entries.pop(path, 0)
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            if self.ttl_seconds and time.time() - os.path.getmtime(path) > self.ttl_seconds:
+                os.remove(path)
+                with self.lock:
+                    self._forget(path)
+                return None
+            with open(path, 'r', encoding='utf-8') as cache_file:
+                return cache_file.read()
+        except FileNotFoundError:
+            return None
+
+    def put(self, key, text):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as cache_file:
+            cache_file.write(text)
+        size = os.path.getsize(tmp_path)
+        os.replace(tmp_path, path)  # Readers never see a partially written entry
+        if self.max_bytes:
+            with self.lock:
+                self._forget(path)
+                self.entries[path] = size
+                self.total_bytes += size
+                self._evict()
+
+    def _evict(self):
+        # Caller holds self.lock
+        while self.total_bytes > self.max_bytes and self.entries:
+            path, size = self.entries.popitem(last=False)
+            self.total_bytes -= size
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+class S3OcrCache:
+    """
+    Page text stored as one object per key under an S3 prefix, shared by every
+    Lambda container. Entries older than ttl_seconds are treated as misses
+    and deleted, and the page's next put writes a fresh one. The bucket is
+    not part of this stack, so entries that are never read again are only
+    removed by an expiration lifecycle rule on the prefix, if the bucket has
+    one.
+    """
+
+    def __init__(self, s3_client, bucket_name, prefix, ttl_seconds=None):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.ttl_seconds = ttl_seconds
+
+    def _key(self, key):
+        return f"{self.prefix}{key[:2]}/{key}.txt"
+
+    def get(self, key):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=self._key(key))
+        except self.s3_client.exceptions.NoSuchKey:
+            return None
+        if self.ttl_seconds:
+            age = datetime.now(timezone.utc) - response['LastModified']
+            if age.total_seconds() > self.ttl_seconds:
+                response['Body'].close()
+                self.s3_client.delete_object(Bucket=self.bucket_name, Key=self._key(key))
+                return None
+        return response['Body'].read().decode('utf-8')
+
+    def put(self, key, text):
+        self.s3_client.put_object(Bucket=self.bucket_name, Key=self._key(key), Body=text.encode('utf-8'))
+
+
+class OcrCache:
+    """
+    Hit/miss accounting in front of a cache backend. Backend errors are logged
+    and treated as misses so a cache outage never fails a page.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        try:
+            text = self.backend.get(key)
+        except Exception as e:
+            print(f"OCR cache read failed for {key}: {e}")
+            text = None
+        with self.lock:
+            if text is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return text
+
+    def put(self, key, text):
+        try:
+            self.backend.put(key, text)
+        except Exception as e:
+            print(f"OCR cache write failed for {key}: {e}")
+
+    def stats(self):
+        with self.lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    def reset_stats(self):
+        with self.lock:
+            self.hits = 0
+            self.misses = 0
+
+
+def ocr_cache_from_env(s3_client):
+    """
+    Build the cache selected by OCR_CACHE_BACKEND ("s3", "local" or "none").
+    Returns None when caching is disabled.
+    """
+    backend_name = os.getenv('OCR_CACHE_BACKEND', 'none').lower()
+    ttl_seconds = int(os.getenv('OCR_CACHE_TTL_SECONDS', '0')) or None
+
+    if backend_name == 's3':
+        backend = S3OcrCache(
+            s3_client,
+            os.getenv('OCR_CACHE_BUCKET', 'konze-processing-bucket'),
+            os.getenv('OCR_CACHE_PREFIX', 'ocr-cache/'),
+            ttl_seconds=ttl_seconds,
+        )
+    elif backend_name == 'local':
+        backend = LocalOcrCache(
+            os.getenv('OCR_CACHE_DIR', '/tmp/ocr-cache'),
+            max_bytes=int(os.getenv('OCR_CACHE_MAX_BYTES', '0')) or None,
+            ttl_seconds=ttl_seconds,
+        )
+    else:
+        return None
+    return OcrCache(backend)
@@ -0,0 +1,125 @@
+"""
+OCR engines for rendered page images.
+
+Every engine turns one page image into the text that process_page has
+always produced: the LINE texts of the page, in reading order, joined with
+single spaces. page_text returns (text, engine_name) so callers can keep
+results from different engines apart, e.g. in the OCR cache.
+"""
+import os
+import subprocess
+import threading
+from rate_limit import is_throttling_error
+
+
+class TextractEngine:
+    name = "textract"
+
+    def __init__(self, textract_client):
+        self.client = textract_client
+
+    def page_text(self, img_bytes):
+        response = self.client.detect_document_text(Document={'Bytes': img_bytes})
+        page_text = " ".join(item['Text'] for item in response['Blocks'] if item['BlockType'] == 'LINE')
+        return page_text, self.name
+
+
+class TesseractEngine:
+    """
+    Local CPU OCR through the tesseract binary. Each page runs in its own
+    tesseract process, so calls from the worker threads use every core;
+    max_processes caps how many run at once. (A multiprocessing pool is not
+    an option on Lambda, which has no /dev/shm.)
+    """
+
+    name = "tesseract"
+
+    def __init__(self, command="tesseract", language="eng", max_processes=None, timeout_seconds=120):
+        self.command = command
+        self.language = language
+        self.slots = threading.BoundedSemaphore(max_processes or os.cpu_count() or 1)
+        self.timeout_seconds = timeout_seconds
+
+    def page_text(self, img_bytes):
+        with self.slots:
+            result = subprocess.run(
+                [self.command, "stdin", "stdout", "-l", self.language, "tsv"],
+                input=img_bytes,
+                capture_output=True,
+                timeout=self.timeout_seconds,
+                check=True,
+            )
+        return " ".join(tsv_lines(result.stdout.decode('utf-8'))), self.name
+
+
+def tsv_lines(tsv):
+    """
+    Group the words of tesseract's TSV output into lines, in output order.
+    """
+    lines = {}
+    rows = tsv.splitlines()
+    for row in rows[1:]:  # Skip the header
+        columns = row.split('\t')
+        if len(columns) < 12 or columns[0] != '5':  # Level 5 rows are words
+            continue
+        word = columns[11].strip()
+        if word:
+            # (page, block, paragraph, line) identifies the line a word belongs to
+            lines.setdefault(tuple(columns[1:5]), []).append(word)
+    return [" ".join(words) for words in lines.values()]
+
+
+class FailoverEngine:
+    """
+    Use the primary engine and fall back to the secondary one for pages the
+    primary rejects with a throttling error. The primary should not retry
+    throttles itself, or the fallback only starts after its retries run out.
+    """
+
+    def __init__(self, primary, fallback):
+        self.primary = primary
+        self.fallback = fallback
+        self.name = primary.name
+        self.lock = threading.Lock()
+        self.failovers = 0
+
+    def page_text(self, img_bytes):
+        try:
+            return self.primary.page_text(img_bytes)
+        except Exception as e:
+            if not is_throttling_error(e):
+                raise
+            with self.lock:
+                self.failovers += 1
+            print(f"{self.primary.name} throttled, using {self.fallback.name} for this page")
+            return self.fallback.page_text(img_bytes)
+
+
+def _engine(engine_name, textract_client):
+    if engine_name == "textract":
+        return TextractEngine(textract_client)
+    if engine_name == "tesseract":
+        return TesseractEngine(
+            command=os.getenv('TESSERACT_CMD', 'tesseract'),
+            language=os.getenv('TESSERACT_LANG', 'eng'),
+            max_processes=int(os.getenv('TESSERACT_MAX_PROCESSES', '0')) or None,
+        )
+    raise ValueError(f"Unknown OCR engine: {engine_name}")
+
+
+def ocr_engine_from_env(textract_client):
+    """
+    Build the engine selected by OCR_ENGINE ("textract" or "tesseract"), with
+    OCR_FAILOVER_ENGINE ("tesseract" or "none") used when it throttles.
+    textract_client is the RateLimitedClient around Textract; with a failover
+    engine the primary gets a single attempt per page, so a throttled page
+    moves to the fallback at once instead of after the proxy's retries.
+    """
+    engine_name = os.getenv('OCR_ENGINE', 'textract').lower()
+    failover_name = os.getenv('OCR_FAILOVER_ENGINE', 'none').lower()
+    if failover_name == 'none' or failover_name == engine_name:
+        return _engine(engine_name, textract_client)
+    return FailoverEngine(
+        _engine(engine_name, textract_client.with_max_attempts(1)),
+        _engine(failover_name, textract_client),
+    )
@@ -0,0 +1,75 @@
+"""
+Asynchronous Textract text detection for whole PDFs.
+
+Large scanned bundles are submitted once with StartDocumentTextDetection
+instead of page by page, so Textract does the paging on its side and the
+Lambda only waits for the job and reads the result back.
+"""
+import time
+
+
+class AsyncTextractError(Exception):
+    pass
+
+
+def start_text_detection(textract_client, bucket_name, key):
+    response = textract_client.start_document_text_detection(
+        DocumentLocation={'S3Object': {'Bucket': bucket_name, 'Name': key}}
+    )
+    return response['JobId']
+
+
+def wait_for_job(textract_client, job_id, poll_seconds=5, timeout_seconds=500):
+    """
+    Poll until the job leaves IN_PROGRESS and return the first result page.
+    Raises AsyncTextractError when the job fails or does not finish in time.
+    """
+    deadline = time.monotonic() + timeout_seconds
+    while True:
+        response = textract_client.get_document_text_detection(JobId=job_id)
+        status = response['JobStatus']
+        if status in ('SUCCEEDED', 'PARTIAL_SUCCESS'):
+            if status == 'PARTIAL_SUCCESS':
+                print(f"Textract job {job_id} partially succeeded: {response.get('Warnings')}")
+            return response
+        if status == 'FAILED':
+            raise AsyncTextractError(f"Textract job {job_id} failed: {response.get('StatusMessage')}")
+        if time.monotonic() + poll_seconds > deadline:
+            raise AsyncTextractError(f"Textract job {job_id} did not finish within {timeout_seconds}s")
+        time.sleep(poll_seconds)
+
+
+def collect_page_texts(textract_client, job_id, first_response, page_total):
+    """
+    Follow NextToken through every GetDocumentTextDetection page and join the
+    LINE blocks of each PDF page with spaces, like detect_document_text output.
+    Returns a list indexed by zero-based page number.
+    """
+    page_lines = [[] for _ in range(page_total)]
+    response = first_response
+    while True:
+        for block in response['Blocks']:
+            if block['BlockType'] == 'LINE' and 1 <= block.get('Page', 1) <= page_total:
+                page_lines[block.get('Page', 1) - 1].append(block['Text'])
+        next_token = response.get('NextToken')
+        if not next_token:
+            break
+        response = textract_client.get_document_text_detection(JobId=job_id, NextToken=next_token)
+    return [" ".join(lines) for lines in page_lines]
+
+
+def detect_document_text_async(textract_client, bucket_name, key, page_total, poll_seconds=5, timeout_seconds=500):
+    """
+    OCR a PDF stored in S3 with one asynchronous Textract job and return the
+    text of each page in order. No job is started when timeout_seconds does
+    not cover a single poll, since its result could not be waited for.
+    """
+    if timeout_seconds < poll_seconds:
+        raise AsyncTextractError(f"Only {max(timeout_seconds, 0):.0f}s left, not starting a Textract job for s3://{bucket_name}/{key}")
+    start_time = time.perf_counter()
+    job_id = start_text_detection(textract_client, bucket_name, key)
+    print(f"Started Textract job {job_id} for s3://{bucket_name}/{key} ({page_total} pages)")
+    first_response = wait_for_job(textract_client, job_id, poll_seconds, timeout_seconds)
+    page_texts = collect_page_texts(textract_client, job_id, first_response, page_total)
+    print(f"Textract job {job_id} finished in {time.perf_counter() - start_time:.1f}s")
+    return page_texts
@@ -6,14 +6,40 @@ import fitz
 from concurrent.futures import ThreadPoolExecutor, as_completed
 from botocore.exceptions import ClientError
 from urllib.parse import urlparse
-import logging
+import itertools
+from ocr_cache import ocr_cache_from_env, page_key
+from render_policy import render_page_image
+from ocr_engine import ocr_engine_from_env
+from rate_limit import rate_limited_from_env, BOTOCORE_NO_RETRIES
+from job_state import job_state_from_env
+from completion_callback import notify_job_completed
+from final_response import write_final_response_safely
+from stage_queue import stage_queue_from_env, consume
+from s3_download import make_s3_client, download_files_from_s3, read_files_from_s3
 
 # Initialize boto3 clients
-lambda_client = boto3.client('lambda')
-s3_client = boto3.client('s3')
-textract = boto3.client('textract')
+job_state = job_state_from_env()
+# Download workers share this client, so its pool is sized to match them
+s3_download_workers = int(os.getenv('S3_DOWNLOAD_WORKERS', '16'))
+# In-memory mode: listed bytes being read or waiting for OCR at any one time
+s3_read_max_bytes = int(os.getenv('S3_READ_MAX_MB_IN_FLIGHT', '256')) * 1024 * 1024
+s3_client = make_s3_client(max_pool_connections=s3_download_workers + 4)
+# Every Textract call takes a token from the shared limiter and is retried when throttled
+textract = rate_limited_from_env(boto3.client('textract', config=BOTOCORE_NO_RETRIES), 'textract')
 
-secondary_lambda_arn = os.getenv('SECONDARY_EMBEDDING_FUNCTION_ARN')
+# Textract, or a local engine selected by OCR_ENGINE, with optional failover on throttling
+ocr_engine = ocr_engine_from_env(textract)
+
+# Content-addressed cache of Textract page text, None when OCR_CACHE_BACKEND is "none"
+ocr_cache = ocr_cache_from_env(s3_client)
+
+# Pages whose embedded text layer has at least this many characters skip Textract
+min_text_layer_chars = int(os.getenv('MIN_TEXT_LAYER_CHARS', '200'))
+
+secondary_embedding_queue = stage_queue_from_env(os.getenv('SECONDARY_EMBEDDING_QUEUE_URL'), os.getenv('SECONDARY_EMBEDDING_FUNCTION_ARN'))
+
+# Read PDFs and write text straight from/to S3 instead of staging them in /tmp
+in_memory_mode = os.getenv('OCR_IN_MEMORY', 'false').lower() == 'true'
 
 json_data = {
     "applicant_info": {
@@ -127,57 +153,99 @@ json_data = {
 
 
 
-def invoke_secondary_lambda_async(payload):
-    response = lambda_client.invoke(
-        FunctionName=secondary_lambda_arn,
-        InvocationType='Event',  # Asynchronous invocation
-        Payload=json.dumps(payload)
-    )
-    return response
-
-def process_page(page_number, local_path, textract_client):
+def extract_text_layer(page):
+    """
+    Return the page's embedded text joined the same way as the Textract LINE
+    output, or None when the text layer is too sparse to trust (scanned pages).
+    """
+    lines = (line.strip() for line in page.get_text().splitlines())
+    page_text = " ".join(line for line in lines if line)
+    if len(page_text) < min_text_layer_chars:
+        return None
+    return page_text
+
+def render_pages(pdf_document, page_counts):
+    """
+    Walk the pages of an already opened document, one at a time, yielding
+    (page_number, page_text, img_bytes). Born-digital pages come back with their
+    native text and no image; everything else is rasterised for Textract by
+    the render policy.
+    PyMuPDF documents are not thread safe, so this stays on the calling thread
+    and only the Textract calls are handed to the worker pool.
+    """
+    for page_number in range(len(pdf_document)):
+        page = pdf_document.load_page(page_number)
+        page_text = extract_text_layer(page)
+        if page_text is not None:
+            page_counts["text_layer"] += 1
+            yield page_number, page_text, None
+            continue
+        page_counts["textract"] += 1
+        yield page_number, None, render_page_image(page)
+
+def open_pdf(local_path, pdf_bytes=None):
+    """
+    Open a PDF from memory when its bytes are given, otherwise from disk.
+    """
+    if pdf_bytes is not None:
+        return fitz.open(stream=pdf_bytes, filetype="pdf")
+    return fitz.open(local_path)
+
+def process_page(page_number, img_bytes, engine):
     ("process page statrted")
-    pdf_document = fitz.open(local_path)
-    page = pdf_document.load_page(page_number)
-    pix = page.get_pixmap()
-    img_bytes = pix.tobytes("png")
-    
-    response = textract_client.detect_document_text(
-        Document={'Bytes': img_bytes}
-    )
+    if ocr_cache is not None:
+        cached_text = ocr_cache.get(page_key(img_bytes, engine.name))
+        if cached_text is not None:
+            return page_number, cached_text
 
-    page_text = " ".join(item['Text'] for item in response['Blocks'] if item['BlockType'] == 'LINE')
+    page_text, engine_name = engine.page_text(img_bytes)
+    if ocr_cache is not None:
+        # Keyed by the engine that actually read the page, which differs after a failover
+        ocr_cache.put(page_key(img_bytes, engine_name), page_text)
 
     return page_number, page_text  # Return page number with the result
 
-def process_pdf(local_path, textract_client, job_id):
-    aggregated_text = ""
+def process_pdf(local_path, engine, job_id, page_counts=None, pdf_bytes=None):
     confidence_scores = []
     print("local path process pdf",local_path)
 
-    with ThreadPoolExecutor() as executor:
-        pdf_document = fitz.open(local_path)
-        futures = {executor.submit(process_page, page_number, local_path, textract_client): page_number for page_number in range(len(pdf_document))}
+    pdf_page_counts = {"text_layer": 0, "textract": 0}
+    results = []
+    # Parse the PDF once and stream each rendered page to the Textract workers
+    with open_pdf(local_path, pdf_bytes) as pdf_document, ThreadPoolExecutor() as executor:
+        futures = {}
+        for page_number, page_text, img_bytes in render_pages(pdf_document, pdf_page_counts):
+            if page_text is not None:
+                results.append((page_number, page_text))
+            else:
+                futures[executor.submit(process_page, page_number, img_bytes, engine)] = page_number
 
         # Collect results and sort by page number
-        results = sorted((future.result() for future in as_completed(futures)), key=lambda x: x[0])
-        for page_number, text in results:  # Unpack the sorted results
-            aggregated_text += text + " "  # Append text in sequence with a space after each block
+        results.extend(future.result() for future in as_completed(futures))
+        results.sort(key=lambda x: x[0])
+        aggregated_text = "".join(text + " " for page_number, text in results)  # Text in page order with a space after each block
             
-    output_directory = f"/tmp/{job_id}_output/konzesecondary"
     print("threadpool k baad")
     
     text_filename = os.path.splitext(os.path.basename(local_path))[0] + '.txt'
-    text_file_path = os.path.join(output_directory, text_filename)
+    s3_upload_path = f"{job_id}/textfiles/secondary/{text_filename}"
+    if in_memory_mode:
+        upload_text_to_s3(aggregated_text, 'konze-processing-bucket', s3_upload_path)
+    else:
+        output_directory = f"/tmp/{job_id}_output/konzesecondary"
+        text_file_path = os.path.join(output_directory, text_filename)
 
         # Write extracted text to file
-    with open(text_file_path, 'w') as text_file:
-        text_file.write(aggregated_text)
+        with open(text_file_path, 'w') as text_file:
+            text_file.write(aggregated_text)
 
         # Upload the text file to S3
-    s3_upload_path = f"{job_id}/textfiles/secondary/{text_filename}"
-    upload_file_to_s3(text_file_path, 'konze-processing-bucket', s3_upload_path)
+        upload_file_to_s3(text_file_path, 'konze-processing-bucket', s3_upload_path)
 
+    print(f"{os.path.basename(local_path)}: {pdf_page_counts['text_layer']} pages from text layer, {pdf_page_counts['textract']} pages via Textract")
+    if page_counts is not None:
+        for path, count in pdf_page_counts.items():
+            page_counts[path] += count
     
     return aggregated_text
 
@@ -185,157 +253,9 @@ def upload_file_to_s3(file_path, bucket_name, s3_path):
     s3_client.upload_file(file_path, bucket_name, s3_path)
     print(f"Uploaded {file_path} to s3://{bucket_name}/{s3_path}")
 
-
-def list_files_in_s3(bucket_name, folder_path):
-    s3_client = boto3.client('s3')
-    response = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=folder_path)
-    return [obj['Key'] for obj in response.get('Contents', [])]
-
-
-def download_files_from_s3(bucket_name, folder_path, local_dir):
-    files = list_files_in_s3(bucket_name, folder_path)
-    
-    # if not files:
-    #     json_data = {
-    #         "applicant_info": {
-    #             "applicant_type": "",
-    #             "firstname": "",
-    #             "middlename": "",
-    #             "lastname": "",
-    #             "gender": "",
-    #             "dateofbirth": ""
-    #         },
-    #         "contact_information_info": {
-    #             "address": {
-    #                 "address": "",
-    #                 "city": "",
-    #                 "zipcode": "",
-    #                 "state": "",
-    #                 "country": ""
-    #             }
-    #         },
-    #         "passport_info": {
-    #             "passport_number": "",
-    #             "given_name": "",
-    #             "surname": "",
-    #             "dateofbirth": "",
-    #             "gender": "",
-    #             "place_of_birth": "",
-    #             "place_of_issue": "",
-    #             "date_of_issue": "",
-    #             "date_of_expiry": ""
-    #         },
-    #         "academics_info": [
-    #             {
-    #                 "qualification": "",
-    #                 "course_name": "",
-    #                 "institution_name": "",
-    #                 "institution_country": "",
-    #                 "passing_month": "",
-    #                 "passing_year": "",
-    #                 "grade": "",
-    #                 "total_marks": "",
-    #                 "obtained_marks": ""
-    #             }
-    #         ],
-    #         "transcript_certificate_info": [
-    #             {
-    #                 "qualification": "",
-    #                 "institution_name": "",
-    #                 "institution_country": "",
-    #                 "course_name": "",
-    #                 "passing_month": "",
-    #                 "passing_year": "",
-    #                 "grade": "",
-    #                 "total_marks": "",
-    #                 "obtained_marks": ""
-    #             }
-    #         ],
-    #         "insurance_info": {
-    #             "insurance_type": "",
-    #             "provider_name": "",
-    #             "policy_no": "",
-    #             "policy_type": "",
-    #             "policy_startdate": "",
-    #             "policy_enddate": "",
-    #             "member_info": [
-    #                 {
-    #                     "member_name": ""
-    #                 }
-    #             ]
-    #         },
-    #         "english_test_info": {
-    #             "test_type": "",
-    #             "test_date": "",
-    #             "Valid_Until_date": "",
-    #             "registration_id": "",
-    #             "name": "",
-    #             "centre_number": "",
-    #             "country_of_residence": "",
-    #             "gender": "",
-    #             "overall_result": "",
-    #             "result": {
-    #                 "listening": "",
-    #                 "reading": "",
-    #                 "writing": "",
-    #                 "speaking": ""
-    #             }
-    #         },
-    #         "australian_qualification_info": {
-    #             "provider": "",
-    #             "course": "",
-    #             "course_level": "",
-    #             "course_startdate": "",
-    #             "course_enddate": "",
-    #             "initial_tuition_fee": "",
-    #             "initial_non_tuition_fee": "",
-    #             "total_tuition_fee": "",
-    #             "given_name": "",
-    #             "oshc_provided_by_provider": ""
-    #         },
-    #         "employment_history": [
-    #             {
-    #                 "position": "",
-    #                 "employer_name": "",
-    #                 "country": "",
-    #                 "joining-month": "",
-    #                 "joining-year": "",
-    #                 "resignation-month": "",
-    #                 "resignation-year": ""
-    #             }
-    #         ]
-    #     }
-    #     local_file_path = f"/tmp/{job_id}/konzesecondary/secondary_response.json"
-    #     with open(file_path, 'w') as json_file:
-    #         json.dump(json_data, json_file, indent=4)
-            
-    #     s3_path = f"{job_id}/output/secondary_response.json"
-    #     s3_client.upload_file(local_file_path, bucket_name, s3_path)
-    #     print(f"Successfully uploaded Final_response.json to s3://{bucket_name}/{s3_path}")
-
-    #     return
-
-    for file_key in files:
-        local_file_path = os.path.join(local_dir, os.path.relpath(file_key, folder_path))
-        local_file_dir = os.path.dirname(local_file_path)
-        
-        # Ensure the directory exists
-        if not os.path.exists(local_file_dir):
-            os.makedirs(local_file_dir)
-
-        logging.info(f"Downloading {file_key} to {local_file_path}")
-
-        try:
-            s3_client.download_file(bucket_name, file_key, local_file_path)
-            logging.info(f"Downloaded {file_key} to {local_file_path}")
-        except OSError as e:
-            logging.error(f"Failed to download {file_key} to {local_file_path}: {e}")
-            # Handle the error appropriately, e.g., retry, skip, etc.
-        except Exception as e:
-            logging.error(f"Unexpected error occurred while downloading {file_key} to {local_file_path}: {e}")
-            # Handle other potential exceptions
-            
-
+def upload_text_to_s3(text, bucket_name, s3_path):
+    s3_client.put_object(Bucket=bucket_name, Key=s3_path, Body=text.encode('utf-8'))
+    print(f"Uploaded {len(text)} characters to s3://{bucket_name}/{s3_path}")
 
 
 def list_files_in_directory(directory):
@@ -376,7 +296,7 @@ def clear_directory_files(directory):
             os.remove(file_path)
             print(f"Deleted file: {file_path}")
 
-def lambda_handler(event, context):
+def process_job(event, context):
     job_id = event['job_id']
     links = event.get('links', [])
     print("links", links)
@@ -389,23 +309,30 @@ def lambda_handler(event, context):
     print("folder", folder_path)
     
     local_dir = f"/tmp/{job_id}/konzesecondary"
-    clear_directory_files(local_dir)
-    print("Temporary directory:", local_dir)
-    os.makedirs(local_dir, exist_ok=True)
-    
     output_directory = f"/tmp/{job_id}_output/konzesecondary"
-    clear_directory_files(output_directory)
-    print("Output directory:", output_directory)
-    
-    os.makedirs(output_directory, exist_ok=True)
-    
-    download_files_from_s3(bucket_name, folder_path, local_dir)
-    
-    pdf_files = [
-        os.path.join(local_dir, pdf_file) 
-        for pdf_file in os.listdir(local_dir) 
-        if pdf_file.endswith('.pdf')
-    ]
+    def is_wanted_pdf(relative_key):
+        # Only PDFs directly inside the folder, filtered on the listing so nothing else is fetched
+        return os.path.dirname(relative_key) == '' and relative_key.endswith('.pdf')
+
+    if in_memory_mode:
+        # PDFs are read into memory as each one arrives, nothing is written to /tmp
+        pdf_files = (
+            (relative_key, pdf_bytes)
+            for relative_key, pdf_bytes in read_files_from_s3(s3_client, bucket_name, folder_path, max_workers=s3_download_workers, max_bytes_in_flight=s3_read_max_bytes, keep=is_wanted_pdf)
+        )
+    else:
+        clear_directory_files(local_dir)
+        print("Temporary directory:", local_dir)
+        os.makedirs(local_dir, exist_ok=True)
+
+        clear_directory_files(output_directory)
+        print("Output directory:", output_directory)
+
+        os.makedirs(output_directory, exist_ok=True)
+
+        # PDFs are handed over as soon as each one lands, while the rest keep downloading
+        downloaded_files = download_files_from_s3(s3_client, bucket_name, folder_path, local_dir, max_workers=s3_download_workers, keep=is_wanted_pdf)
+        pdf_files = ((local_file_path, None) for local_file_path in downloaded_files)
     
     # pdf_files = [
     #     os.path.join(local_dir, pdf_file)
@@ -419,10 +346,12 @@ def lambda_handler(event, context):
     #     if pdf_file.endswith('.pdf') and 'transcript' in pdf_file.lower()
     # ]
     
-    print("PDF files (excluding transcripts):", pdf_files)
     # print("Transcript PDF files:", transcript_pdf_files)
+
+    # Wait for the first PDF only to tell whether the folder has any at all
+    first_pdf_file = next(pdf_files, None)
     
-    if not pdf_files:
+    if first_pdf_file is None:
         json_data = {
             "applicant_info": {
                 "applicant_type": "secondary",
@@ -532,40 +461,58 @@ def lambda_handler(event, context):
                 }
             ]
         }
-        local_file_path = f"/tmp/{job_id}/konzesecondary/secondary_response.json"
-        with open(local_file_path, 'w') as json_file:
-            json.dump(json_data, json_file, indent=4)
-            
         s3_path = f"{job_id}/output/secondary_response.json"
         bucket_name_1 ="konze-processing-bucket"
-        s3_client.upload_file(local_file_path, bucket_name_1, s3_path)
+        if in_memory_mode:
+            upload_text_to_s3(json.dumps(json_data, indent=4), bucket_name_1, s3_path)
+        else:
+            local_file_path = f"/tmp/{job_id}/konzesecondary/secondary_response.json"
+            with open(local_file_path, 'w') as json_file:
+                json.dump(json_data, json_file, indent=4)
+
+            s3_client.upload_file(local_file_path, bucket_name_1, s3_path)
         print(f"Successfully uploaded Final_response.json to s3://{bucket_name}/{s3_path}")
+
+        # There is nothing to embed or extract, so the secondary branch is done here
+        if job_state.complete_branch(job_id, "secondary"):
+            print(f"Job {job_id} completed")
+            write_final_response_safely(s3_client, job_id)
+            notify_job_completed(job_state, job_id)
         
     else:
 
         aggregated_text = ""
         overall_confidences = []
+        page_counts = {"text_layer": 0, "textract": 0}
+        if ocr_cache is not None:
+            ocr_cache.reset_stats()
         
-        for pdf_file in pdf_files:
+        for pdf_file, pdf_bytes in itertools.chain([first_pdf_file], pdf_files):
             try:
-                avg_confidence = process_pdf(pdf_file, textract, job_id)
+                avg_confidence = process_pdf(pdf_file, ocr_engine, job_id, page_counts, pdf_bytes)
                 print("text created successfully")
 
             except Exception as e:
                 print(f"Error processing PDF file {pdf_file}: {e}")
                 continue
 
+        print(f"Pages from text layer: {page_counts['text_layer']}, pages via Textract: {page_counts['textract']}")
+        if ocr_cache is not None:
+            print("OCR cache", ocr_cache.stats())
+
 
-    clear_directory_files(local_dir)
-    clear_directory_files(output_directory)
+    if not in_memory_mode:
+        clear_directory_files(local_dir)
+        clear_directory_files(output_directory)
     
     payload = {
         "job_id": job_id,
         "folder_path" : folder_path
     }
     print("payload",payload)
-    invoke_secondary_lambda_async(payload)
-    print("pay load executed")
+    if first_pdf_file is not None:
+        secondary_embedding_queue.send(payload)
+        print("pay load executed")
 
     return {
         "statusCode": 200,
@@ -577,3 +524,9 @@ def lambda_handler(event, context):
         },
         "body": json.dumps("in progress"),
     }
+
+def lambda_handler(event, context):
+    # Jobs arrive in batches from the intake queue, or as a single direct invoke
+    if 'Records' in event:
+        return consume(event['Records'], process_job, context)
+    return process_job(event, context)
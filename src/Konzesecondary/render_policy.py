@@ -0,0 +1,115 @@
+"""
+How a PDF page is rasterised before it is sent to Textract.
+
+The DPI is picked per page: scanned pages are rendered at the resolution of
+the scan they contain (rendering above it adds bytes, not detail), pages
+with small print are rendered at the maximum DPI, everything else at the
+target DPI. Pages are rendered in grayscale. Scans are encoded as JPEG and
+vector pages as PNG, which keeps the text edges sharp and compresses well.
+The result always fits Textract's synchronous limits of 5 MB and 10000 px
+per side.
+"""
+import os
+import time
+import fitz
+
+TEXTRACT_MAX_BYTES = 5 * 1024 * 1024
+TEXTRACT_MAX_PIXELS = 10000
+
+target_dpi = int(os.getenv('RENDER_TARGET_DPI', '150'))
+min_dpi = int(os.getenv('RENDER_MIN_DPI', '100'))
+max_dpi = int(os.getenv('RENDER_MAX_DPI', '300'))
+# "auto" picks JPEG for scans and PNG for everything else
+image_format = os.getenv('RENDER_FORMAT', 'auto').lower()
+jpeg_quality = int(os.getenv('RENDER_JPEG_QUALITY', '85'))
+grayscale = os.getenv('RENDER_GRAYSCALE', 'true').lower() == 'true'
+# Text below this size (in points) is rendered at max_dpi
+small_print_points = float(os.getenv('RENDER_SMALL_PRINT_POINTS', '8'))
+
+# A page is treated as a scan when one image covers at least this share of it
+SCAN_COVERAGE = 0.8
+
+
+def scan_dpi(page):
+    """
+    Effective resolution of the image covering the page when the page is a
+    scan, otherwise None.
+    """
+    page_area = abs(page.rect)
+    if not page_area:
+        return None
+    for image in page.get_images(full=True):
+        longest_side_px = max(image[2], image[3])
+        for bbox in page.get_image_rects(image[0]):
+            if abs(bbox) >= SCAN_COVERAGE * page_area:
+                # Longest side against longest side, so rotated scans measure the same
+                return longest_side_px / (max(bbox.width, bbox.height) / 72)
+    return None
+
+
+def smallest_font_size(page):
+    sizes = [
+        span["size"]
+        for block in page.get_text("dict")["blocks"]
+        for line in block.get("lines", [])
+        for span in line["spans"]
+        if span["text"].strip()
+    ]
+    return min(sizes) if sizes else None
+
+
+def clamp_dpi(page, dpi):
+    """
+    Keep the DPI within [min_dpi, max_dpi] and the rendered image within
+    Textract's pixel limit.
+    """
+    dpi = max(min_dpi, min(max_dpi, dpi))
+    longest_side_inches = max(page.rect.width, page.rect.height) / 72
+    if longest_side_inches:
+        dpi = min(dpi, TEXTRACT_MAX_PIXELS / longest_side_inches)
+    return dpi
+
+
+def choose_render(page):
+    """
+    Return (dpi, format) for a page.
+    """
+    native_dpi = scan_dpi(page)
+    if native_dpi is not None:
+        dpi, fmt = native_dpi, "jpeg"
+    else:
+        font_size = smallest_font_size(page)
+        dpi = max_dpi if font_size is not None and font_size < small_print_points else target_dpi
+        fmt = "png"
+    if image_format != "auto":
+        fmt = image_format
+    return clamp_dpi(page, dpi), fmt
+
+
+def encode(pix, fmt):
+    if fmt == "jpeg":
+        return pix.tobytes("jpeg", jpg_quality=jpeg_quality)
+    return pix.tobytes("png")
+
+
+def render_page_image(page):
+    """
+    Rasterise a page for Textract and return the encoded image bytes. When
+    the image is over the 5 MB limit it is rendered again at a DPI scaled
+    down by the excess.
+    """
+    dpi, fmt = choose_render(page)
+    colorspace = fitz.csGRAY if grayscale else fitz.csRGB
+
+    start_time = time.perf_counter()
+    while True:
+        pix = page.get_pixmap(dpi=int(dpi), colorspace=colorspace)
+        img_bytes = encode(pix, fmt)
+        if len(img_bytes) <= TEXTRACT_MAX_BYTES or dpi <= 36:
+            break
+        # Encoded size grows with the pixel count, i.e. with the square of the DPI
+        dpi = max(36, dpi * (TEXTRACT_MAX_BYTES / len(img_bytes)) ** 0.5 * 0.9)
+    encode_seconds = time.perf_counter() - start_time
+
+    print(f"Page {page.number + 1}: {fmt} {pix.width}x{pix.height} at {int(dpi)} dpi, {len(img_bytes)} bytes, rendered in {encode_seconds * 1000:.0f} ms")
+    return img_bytes
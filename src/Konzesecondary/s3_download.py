@@ -0,0 +1,130 @@
+import collections
+import os
+import logging
+import boto3
+from concurrent.futures import ThreadPoolExecutor
+from botocore.config import Config
+
+
+def make_s3_client(max_pool_connections):
+    """
+    One S3 client for the whole function, with a connection pool large enough
+    for every download worker to hold its own connection.
+    """
+    return boto3.client('s3', config=Config(max_pool_connections=max_pool_connections))
+
+
+def folder_prefix(folder_path):
+    # Without the trailing slash, "student/John" would also match "student/Johnny/..."
+    return folder_path.rstrip('/') + '/'
+
+
+def list_objects_in_s3(s3_client, bucket_name, folder_path):
+    """
+    Yield (key, size) for every object inside folder_path, following
+    list_objects_v2 pagination past the 1000-key page limit.
+    """
+    paginator = s3_client.get_paginator('list_objects_v2')
+    for page in paginator.paginate(Bucket=bucket_name, Prefix=folder_prefix(folder_path)):
+        for obj in page.get('Contents', []):
+            if not obj['Key'].endswith('/'):
+                yield obj['Key'], obj['Size']
+
+
+def list_files_in_s3(s3_client, bucket_name, folder_path):
+    for file_key, _ in list_objects_in_s3(s3_client, bucket_name, folder_path):
+        yield file_key
+
+
+def _wanted_objects(s3_client, bucket_name, folder_path, keep):
+    """
+    (key, relative_key, size) for the objects inside folder_path that keep,
+    called with the key relative to folder_path, accepts, largest first.
+    """
+    prefix = folder_prefix(folder_path)
+    objects = [
+        (file_key, file_key[len(prefix):], size)
+        for file_key, size in list_objects_in_s3(s3_client, bucket_name, folder_path)
+    ]
+    return largest_first([obj for obj in objects if keep is None or keep(obj[1])])
+
+
+def largest_first(objects):
+    """
+    Listing entries, whose last field is the object size, largest first.
+    The callers fetch and yield in this order so the biggest documents, which
+    take the longest to OCR, start first instead of whenever their listing
+    page or download happens to come in.
+    """
+    return sorted(objects, key=lambda obj: obj[-1], reverse=True)
+
+
+def _download_file(s3_client, bucket_name, file_key, local_file_path):
+    os.makedirs(os.path.dirname(local_file_path), exist_ok=True)
+    logging.info(f"Downloading {file_key} to {local_file_path}")
+    s3_client.download_file(bucket_name, file_key, local_file_path)
+    logging.info(f"Downloaded {file_key} to {local_file_path}")
+    return local_file_path
+
+
+def download_files_from_s3(s3_client, bucket_name, folder_path, local_dir, max_workers=16, keep=None):
+    """
+    Download everything inside folder_path into local_dir on a bounded thread
+    pool, largest object first, yielding each local path in that order as soon
+    as its download completes, so the caller can start work before the whole
+    folder has been copied. When keep is given, only the objects whose key
+    relative to folder_path it accepts are downloaded. Failed downloads are
+    logged and skipped.
+    """
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = []
+        for file_key, relative_key, _ in _wanted_objects(s3_client, bucket_name, folder_path, keep):
+            local_file_path = os.path.join(local_dir, relative_key)
+            futures.append((executor.submit(_download_file, s3_client, bucket_name, file_key, local_file_path), file_key))
+
+        for future, file_key in futures:
+            try:
+                yield future.result()
+            except Exception as e:
+                logging.error(f"Failed to download {file_key}: {e}")
+
+
+def _read_object(s3_client, bucket_name, file_key):
+    return s3_client.get_object(Bucket=bucket_name, Key=file_key)['Body'].read()
+
+
+def read_files_from_s3(s3_client, bucket_name, folder_path, max_workers=16, max_bytes_in_flight=256 * 1024 * 1024, keep=None):
+    """
+    In-memory counterpart of download_files_from_s3: fetch everything inside
+    folder_path that keep accepts on a bounded thread pool, largest object
+    first, and yield (relative_key, data) in that order as each object
+    arrives, without touching local storage. Failed reads are logged and
+    skipped.
+
+    Objects are only requested while the listed sizes of those being read or
+    waiting to be yielded stay within max_bytes_in_flight, so a folder larger
+    than the function's memory is streamed rather than loaded at once. An
+    object bigger than the budget is read on its own.
+    """
+    objects = iter(_wanted_objects(s3_client, bucket_name, folder_path, keep))
+    next_object = next(objects, None)
+    pending = collections.deque()  # (future, relative_key, size) in request order
+    bytes_in_flight = 0
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while next_object is not None or pending:
+            while next_object is not None and len(pending) < max_workers and (
+                    not pending or bytes_in_flight + next_object[2] <= max_bytes_in_flight):
+                file_key, relative_key, size = next_object
+                pending.append((executor.submit(_read_object, s3_client, bucket_name, file_key), relative_key, size))
+                bytes_in_flight += size
+                next_object = next(objects, None)
+
+            future, relative_key, size = pending.popleft()
+            try:
+                data = future.result()
+            except Exception as e:
+                logging.error(f"Failed to read {relative_key}: {e}")
+                continue
+            finally:
+                bytes_in_flight -= size
+            yield relative_key, data
@@ -1,35 +1,92 @@
 import json
-import boto3
 import uuid
 import os
 from urllib.parse import urlparse
+from job_state import job_state_from_env, IN_PROGRESS, SUBMISSION_FAILED
+from stage_queue import stage_queue_from_env
+from completion_callback import callback_url_error
 
-ssm_client = boto3.client('ssm')
-lambda_client = boto3.client('lambda')
-primary_lambda_arn = os.getenv('PRIMARY_FUNCTION_ARN')
-secondary_lambda_arn = os.getenv('SECONDARY_FUNCTION_ARN')
-print("@",secondary_lambda_arn)
+job_state = job_state_from_env()
+# Jobs are handed to the OCR functions through their stage queues, which they drain at a capped concurrency
+primary_queue = stage_queue_from_env(os.getenv('PRIMARY_INTAKE_QUEUE_URL'), os.getenv('PRIMARY_FUNCTION_ARN'))
+secondary_queue = stage_queue_from_env(os.getenv('SECONDARY_INTAKE_QUEUE_URL'), os.getenv('SECONDARY_FUNCTION_ARN'))
+max_batch_links = int(os.getenv('MAX_BATCH_LINKS', '200'))
+# Konzeprimary OCRs the secondary folder too, so Konzesecondary is not invoked
+unified_ocr = os.getenv('UNIFIED_OCR', 'false').lower() == 'true'
 
 
-def invoke_secondary_lambda_async(payload):
-    response = lambda_client.invoke(
-        FunctionName=secondary_lambda_arn,
-        InvocationType='Event',  # Asynchronous invocation
-        Payload=json.dumps(payload)
-    )
-    return response
+def api_response(status_code, body):
+    return {
+        "statusCode": status_code,
+        "headers": {
+            "Content-Type": "application/json",
+            "Access-Control-Allow-Headers": "*",
+            "Access-Control-Allow-Origin": "*",
+            "Access-Control-Allow-Methods": "*",
+        },
+        "body": json.dumps(body),
+    }
 
-def invoke_primary_lambda_async(payload):
-    response = lambda_client.invoke(
-        FunctionName=primary_lambda_arn,
-        InvocationType='Event',  # Asynchronous invocation
-        Payload=json.dumps(payload)
-    )
-    return response
+def submit_batch(links, callback_url):
+    """
+    Create one job per folder link, with the job records written in bulk,
+    and queue them for the OCR functions. Returns the job ids in link order
+    and, per job that could not be written or queued, its link, id and
+    error. Those jobs are marked SUBMISSION_FAILED.
+    """
+    links = [link.replace('+', ' ') for link in links]
+    job_ids = [str(uuid.uuid4()) for _ in links]
+    unwritten = set(job_state.create_many(job_ids, IN_PROGRESS, callback_url=callback_url))
+    errors = {job_id: "job record could not be written" for job_id in unwritten}
+
+    payloads = [
+        {
+            "job_id": job_id,
+            "folder_path": urlparse(link).path.lstrip('/'),
+            "links": link,
+        }
+        for job_id, link in zip(job_ids, links)
+        if job_id not in errors
+    ]
+    queues = [primary_queue] if unified_ocr else [primary_queue, secondary_queue]
+    for queue in queues:
+        # A job one OCR function never gets cannot complete, so the next queue skips it
+        payloads = [payload for payload in payloads if payload["job_id"] not in errors]
+        for index in queue.send_many(payloads):
+            errors[payloads[index]["job_id"]] = "job could not be queued"
+    for job_id in errors.keys() - unwritten:
+        job_state.set_status(job_id, SUBMISSION_FAILED, stage="request")
+    print(f"Queued {len(job_ids) - len(errors)} of {len(job_ids)} jobs, primary queue depth: {primary_queue.depth()}")
+    failed = [
+        {"link": link, "job_id": job_id, "error": errors[job_id]}
+        for job_id, link in zip(job_ids, links)
+        if job_id in errors
+    ]
+    return job_ids, failed
 
 def lambda_handler(event, context):
     print("event",event)
     body_dict = json.loads(event['body'])
+
+    # Optional webhook, POSTed {"job_id", "status"} once both branches have finished
+    callback_url = body_dict.get('callback_url')
+    if callback_url:
+        error = callback_url_error(callback_url) if isinstance(callback_url, str) else "callback_url must be a string"
+        if error is not None:
+            return api_response(400, {"error": error})
+
+    # Batch submission: {"links": [...]} creates one job per folder link
+    if 'links' in body_dict:
+        links = body_dict['links']
+        if not isinstance(links, list) or not links or not all(isinstance(link, str) and link for link in links):
+            return api_response(400, {"error": "links must be a non-empty list of folder links"})
+        if len(links) > max_batch_links:
+            return api_response(400, {"error": f"At most {max_batch_links} links can be submitted at once"})
+        if not job_state.batch_writes:
+            return api_response(400, {"error": "Batch submission needs the dynamodb job state backend"})
+        job_ids, failed = submit_batch(links, callback_url)
+        return api_response(200, {"job_ids": job_ids, "failed": failed})
+
     link = body_dict.get('link', '').replace('+', ' ')
     print(link)  
     
@@ -42,14 +99,8 @@ def lambda_handler(event, context):
     print("folder",folder_path)
     # body_dict = json.loads(event['body'])
     job_id = str(uuid.uuid4())
-    parameter_name = job_id
     print(f"Links received: {link}")
-    ssm_client.put_parameter(
-        Name=parameter_name,
-        Value="In Progress",
-        Type='String',  
-        Overwrite=True
-    )
+    job_state.create(job_id, IN_PROGRESS, callback_url=callback_url)
 
     payload = {
         "job_id": job_id,
@@ -59,18 +110,10 @@ def lambda_handler(event, context):
 
     print("2",payload)
     
-    # Invoke the secondary Lambda function asynchronously
-    invoke_primary_lambda_async(payload)
-    invoke_secondary_lambda_async(payload)
+    # Queue the job for the OCR functions
+    primary_queue.send(payload)
+    if not unified_ocr:
+        secondary_queue.send(payload)
     
     # Return the response immediately
-    return {
-        "statusCode": 200,
-        "headers": {
-            "Content-Type": "application/json",
-            "Access-Control-Allow-Headers": "*",
-            "Access-Control-Allow-Origin": "*",
-            "Access-Control-Allow-Methods": "*",
-        },
-        "body": json.dumps(job_id),
-    }
+    return api_response(200, job_id)
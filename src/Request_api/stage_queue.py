@@ -0,0 +1,245 @@
+"""
+Hand-off between pipeline stages.
+
+Each stage passes the payload for the next one to that stage's queue
+instead of invoking its function with InvocationType='Event'. Backends:
+
+    sqs     one SQS queue per stage, drained by the stage's function through
+            an event source mapping whose MaximumConcurrency caps the stage;
+            messages that fail maxReceiveCount times move to its
+            dead-letter queue
+    memory  in-process queue with the same receive counts and dead-letter
+            behaviour, for local runs
+    lambda  the legacy fire-and-forget Event invoke
+
+STAGE_QUEUE_BACKEND selects the backend; stage_queue_from_env builds it.
+Consumers hand the records of a batch to consume, which reports the failed
+ones back so only those are redelivered, and sends the ones it had no time
+for back to their queue.
+"""
+import collections
+import itertools
+import json
+import os
+import threading
+import time
+import boto3
+
+# SendMessageBatch takes at most ten entries
+SQS_BATCH_SIZE = 10
+
+
+class SqsStageQueue:
+
+    def __init__(self, sqs_client, queue_url, max_attempts=3):
+        self.client = sqs_client
+        self.queue_url = queue_url
+        self.max_attempts = max_attempts
+
+    def send(self, payload):
+        if self.send_many([payload]):
+            raise RuntimeError(f"Message could not be sent to {self.queue_url}")
+
+    def send_many(self, payloads):
+        """
+        Send one message per payload, ten per request, resending the entries
+        SQS reports as failed. Returns the indexes of the payloads that could
+        not be sent.
+        """
+        unsent = []
+        for start in range(0, len(payloads), SQS_BATCH_SIZE):
+            entries = [
+                {'Id': str(index), 'MessageBody': json.dumps(payload)}
+                for index, payload in enumerate(payloads[start:start + SQS_BATCH_SIZE], start)
+            ]
+            for attempt in range(1, self.max_attempts + 1):
+                try:
+                    response = self.client.send_message_batch(QueueUrl=self.queue_url, Entries=entries)
+                except Exception as e:
+                    print(f"Sending to {self.queue_url} failed (attempt {attempt}/{self.max_attempts}): {e}")
+                    continue
+                failed_ids = {failure['Id'] for failure in response.get('Failed', [])}
+                entries = [entry for entry in entries if entry['Id'] in failed_ids]
+                if not entries:
+                    break
+            if entries:
+                print(f"{len(entries)} messages could not be sent to {self.queue_url}")
+                unsent.extend(int(entry['Id']) for entry in entries)
+        return unsent
+
+    def depth(self):
+        response = self.client.get_queue_attributes(
+            QueueUrl=self.queue_url,
+            AttributeNames=['ApproximateNumberOfMessages', 'ApproximateNumberOfMessagesNotVisible'],
+        )
+        attributes = response['Attributes']
+        return int(attributes['ApproximateNumberOfMessages']) + int(attributes['ApproximateNumberOfMessagesNotVisible'])
+
+
+class LambdaStageQueue:
+    """
+    Legacy hand-off: every payload is an asynchronous invoke of the stage's
+    function. There is no backpressure and no depth to report.
+    """
+
+    def __init__(self, lambda_client, function_arn):
+        self.client = lambda_client
+        self.function_arn = function_arn
+
+    def send(self, payload):
+        self.client.invoke(
+            FunctionName=self.function_arn,
+            InvocationType='Event',  # Asynchronous invocation
+            Payload=json.dumps(payload)
+        )
+
+    def send_many(self, payloads):
+        unsent = []
+        for index, payload in enumerate(payloads):
+            try:
+                self.send(payload)
+            except Exception as e:
+                print(f"Invoking {self.function_arn} failed: {e}")
+                unsent.append(index)
+        return unsent
+
+    def depth(self):
+        return None
+
+
+class InMemoryStageQueue:
+    """
+    Local stand-in for an SQS stage queue. receive returns records shaped
+    like the ones Lambda gets from SQS. A received message stays in flight
+    until it is deleted or released. After max_receive_count failed
+    receives it moves to dead_letters.
+    """
+
+    def __init__(self, max_receive_count=3):
+        self.max_receive_count = max_receive_count
+        self.ready = collections.deque()
+        self.in_flight = {}
+        self.receive_counts = {}
+        self.dead_letters = []
+        self.ids = itertools.count(1)
+        self.lock = threading.Lock()
+
+    def send(self, payload):
+        self.send_many([payload])
+
+    def send_many(self, payloads):
+        with self.lock:
+            for payload in payloads:
+                self.ready.append((str(next(self.ids)), json.dumps(payload)))
+        return []
+
+    def receive(self, max_messages=SQS_BATCH_SIZE):
+        records = []
+        with self.lock:
+            while self.ready and len(records) < max_messages:
+                message_id, body = self.ready.popleft()
+                self.receive_counts[message_id] = self.receive_counts.get(message_id, 0) + 1
+                self.in_flight[message_id] = body
+                records.append({
+                    'messageId': message_id,
+                    'body': body,
+                    'attributes': {'ApproximateReceiveCount': str(self.receive_counts[message_id])},
+                })
+        return records
+
+    def delete(self, message_id):
+        with self.lock:
+            self.in_flight.pop(message_id)
+            self.receive_counts.pop(message_id)
+
+    def release(self, message_id):
+        with self.lock:
+            body = self.in_flight.pop(message_id)
+            if self.receive_counts[message_id] >= self.max_receive_count:
+                self.dead_letters.append((message_id, body, self.receive_counts.pop(message_id)))
+            else:
+                self.ready.append((message_id, body))
+
+    def drain(self, handler, context=None, batch_size=SQS_BATCH_SIZE):
+        """
+        Feed batches to handler through consume until the queue is empty, as
+        the SQS event source would, deleting successes and releasing failures.
+        """
+        while True:
+            records = self.receive(batch_size)
+            if not records:
+                return
+            failed_ids = {failure['itemIdentifier'] for failure in consume(records, handler, context, source=self)['batchItemFailures']}
+            for record in records:
+                if record['messageId'] in failed_ids:
+                    self.release(record['messageId'])
+                else:
+                    self.delete(record['messageId'])
+
+    def depth(self):
+        with self.lock:
+            return len(self.ready) + len(self.in_flight)
+
+
+def consume(records, handler, context=None, reserve_seconds=30, source=None):
+    """
+    Run handler(payload, context) for each SQS record of a batch, in order,
+    and return the failed records as batchItemFailures. Records that there
+    is no time left for, less than reserve_seconds before the invocation
+    times out, are not run: they are sent back to source, the queue they
+    came from, as new messages, so being skipped does not count towards
+    their maxReceiveCount. If that fails they are reported as failed.
+    """
+    failures = []
+    skipped = []
+    for record in records:
+        receive_count = int(record.get('attributes', {}).get('ApproximateReceiveCount', '1'))
+        if context is not None and context.get_remaining_time_in_millis() < reserve_seconds * 1000:
+            skipped.append(record)
+            continue
+        try:
+            if receive_count > 1:
+                print(f"Retrying message {record['messageId']} (receive {receive_count})")
+            start_time = time.perf_counter()
+            handler(json.loads(record['body']), context)
+            print(f"Processed message {record['messageId']} in {time.perf_counter() - start_time:.1f}s")
+        except Exception as e:
+            print(f"Error processing message {record['messageId']} (receive {receive_count}): {e}")
+            failures.append({"itemIdentifier": record['messageId']})
+    if skipped:
+        print(f"No time left for {len(skipped)} messages, returning them to the queue")
+        try:
+            unsent = (source or source_queue(skipped[0])).send_many([json.loads(record['body']) for record in skipped])
+        except Exception as e:
+            print(f"Could not requeue skipped messages, leaving them to be redelivered: {e}")
+            unsent = range(len(skipped))
+        failures.extend({"itemIdentifier": skipped[index]['messageId']} for index in unsent)
+    return {"batchItemFailures": failures}
+
+
+def source_queue(record):
+    """
+    The SqsStageQueue an SQS event record was received from, addressed by
+    the queue URL derived from its eventSourceARN.
+    """
+    _, _, _, region, account_id, queue_name = record['eventSourceARN'].split(':')
+    return SqsStageQueue(boto3.client('sqs'), f"https://sqs.{region}.amazonaws.com/{account_id}/{queue_name}")
+
+
+_memory_queues = {}
+_memory_queues_lock = threading.Lock()
+
+
+def stage_queue_from_env(queue_url, function_arn):
+    """
+    Build the hand-off to one stage for the backend selected by
+    STAGE_QUEUE_BACKEND ("lambda", "sqs" or "memory"). queue_url is used by
+    sqs and names the queue for memory; function_arn is used by lambda.
+    """
+    backend_name = os.getenv('STAGE_QUEUE_BACKEND', 'lambda').lower()
+    if backend_name == 'sqs':
+        return SqsStageQueue(boto3.client('sqs'), queue_url)
+    if backend_name == 'memory':
+        with _memory_queues_lock:
+            return _memory_queues.setdefault(queue_url or function_arn, InMemoryStageQueue())
+    return LambdaStageQueue(boto3.client('lambda'), function_arn)
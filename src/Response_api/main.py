@@ -1,88 +1,152 @@
 import json
 import boto3
+import hashlib
 import os
+import threading
+import time
+from collections import OrderedDict
+from job_state import job_state_from_env, EXTRACTION_COMPLETED
+from final_response import OUTPUT_BUCKET, final_response_key, write_final_response
 
 # Initialize AWS clients
-ssm_client = boto3.client('ssm')
+job_state = job_state_from_env()
 s3_client = boto3.client('s3')
 
+# Upper bound for wait_seconds; API Gateway gives up on integrations after 29 seconds
+long_poll_max_seconds = float(os.getenv('LONG_POLL_MAX_SECONDS', '25'))
+
+# Final responses of completed jobs never change, so warm containers keep the most recent ones
+final_response_cache_size = int(os.getenv('FINAL_RESPONSE_CACHE_SIZE', '128'))
+final_response_cache = OrderedDict()  # job_id -> (etag, body)
+final_response_cache_lock = threading.Lock()
+
+
+def wait_for_job(job_id, wait_seconds, context=None):
+    """
+    Read the job state, re-reading with growing pauses until the job has
+    completed or wait_seconds have passed, and return the last state read.
+    """
+    wait_seconds = max(0.0, min(wait_seconds, long_poll_max_seconds))
+    if context is not None:
+        # Leave enough of the invocation to fetch and return the results
+        wait_seconds = min(wait_seconds, context.get_remaining_time_in_millis() / 1000 - 5)
+    deadline = time.monotonic() + wait_seconds
+    interval = 0.5
+    while True:
+        state = job_state.get(job_id)
+        remaining = deadline - time.monotonic()
+        if state is None or state['status'] == EXTRACTION_COMPLETED or remaining <= 0:
+            return state
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, 4.0)
+
+
+def cached_final_response(job_id):
+    """
+    Return (etag, body) for the final response of a job, or None if it is not
+    cached in this container.
+    """
+    with final_response_cache_lock:
+        entry = final_response_cache.get(job_id)
+        if entry is not None:
+            final_response_cache.move_to_end(job_id)
+        return entry
+
+
+def load_final_response(job_id):
+    """
+    Fetch the final response of a completed job and cache it. Jobs completed
+    before final_response.json existed, or whose write failed, are assembled
+    from the branch responses and written back once. Returns None while a
+    branch response is still missing.
+    """
+    try:
+        body = s3_client.get_object(Bucket=OUTPUT_BUCKET, Key=final_response_key(job_id))['Body'].read()
+    except s3_client.exceptions.NoSuchKey:
+        body = write_final_response(s3_client, job_id)
+        if body is None:
+            return None
+    entry = ('"%s"' % hashlib.md5(body).hexdigest(), body)
+    with final_response_cache_lock:
+        final_response_cache[job_id] = entry
+        final_response_cache.move_to_end(job_id)
+        while len(final_response_cache) > final_response_cache_size:
+            final_response_cache.popitem(last=False)
+    return entry
+
+
+def etag_matches(etag, if_none_match):
+    if not if_none_match:
+        return False
+    tags = [tag.strip() for tag in if_none_match.split(',')]
+    # If-None-Match uses weak comparison, so W/"x" matches "x"
+    return '*' in tags or etag in (tag[2:] if tag.startswith('W/') else tag for tag in tags)
+
+
+def header(event, name):
+    headers = event.get('headers') or {}
+    return next((value for key, value in headers.items() if key.lower() == name), None)
+
+
+def request_options(event):
+    """
+    The job id and options of a request: from the path and query string for
+    GET /responseapi/{job_id}, from the JSON body for POST /responseapi.
+    """
+    if event.get('httpMethod') == 'GET':
+        options = dict(event.get('queryStringParameters') or {})
+        options['job_id'] = (event.get('pathParameters') or {}).get('job_id')
+        # Query string values are strings; only an explicit true-ish value turns pretty on
+        options['pretty'] = options.get('pretty', '').lower() in ('1', 'true', 'yes')
+        return options
+    return json.loads(event['body'])
+
+
+def final_response_result(event, body_dict, etag, body):
+    # Conditional requests only make sense for the safe GET route; POST always gets the body
+    if event.get('httpMethod') == 'GET' and etag_matches(etag, header(event, 'if-none-match')):
+        return {'statusCode': 304, 'headers': {'ETag': etag}, 'body': ''}
+    data = body.decode('utf-8')
+    if body_dict.get('pretty'):
+        data = json.dumps(json.loads(data), indent=4)
+    return {
+        'statusCode': 200,
+        'headers': {'Content-Type': 'application/json', 'ETag': etag},
+        'body': data,
+    }
+
 def lambda_handler(event, context):
     try:
-        # Parse the incoming event body
-        body_content = event['body']
-        body_dict = json.loads(body_content)
+        # Parse the request: path and query string for GET, the JSON body for POST
+        body_dict = request_options(event)
 
         # Extract job_id from the parsed dictionary
         job_id = body_dict.get('job_id')
         print(f"Extracted job_id: {job_id}")
-        
-        bucket_name = "konze-processing-bucket"
-        output_folder_s3_key = f"{job_id}/output/"
-        
-        group1 = None  # Variable to store primary_response.json content
-        group2 = None  # Variable to store secondary_response.json content
-        appended_data = []
-        
-        primary_s3_key = f"{job_id}/output/primary_response.json"
-        secondary_s3_key = f"{job_id}/output/secondary_response.json"
-        
-        # Retrieve job status from SSM Parameter Store
-        parameter_name = job_id
-        response = ssm_client.get_parameter(Name=parameter_name)
-
-        if 'Parameter' in response and 'Value' in response['Parameter']:
-            parameter_value = response['Parameter']['Value']
-            print(f"Parameter value retrieved: {parameter_value}")
-
-            # Check if the value is "Extraction completed"
-            if parameter_value == "Extraction completed":
-                # List objects in the output folder for the given job_id
-                objects_in_folder = s3_client.list_objects_v2(Bucket=bucket_name, Prefix=output_folder_s3_key)
-                # Get the list of object keys in the output folder
-                files_in_output = [obj['Key'] for obj in objects_in_folder.get('Contents', [])]
-
-                # Check if both required files are present
-                required_files = ['primary_response.json', 'secondary_response.json']
-                missing_files = [file for file in required_files if f"{output_folder_s3_key}{file}" not in files_in_output]
-
-                if missing_files:
-                    print(f"Missing files: {', '.join(missing_files)}")
-                    return {
-                        'statusCode': 202,  # HTTP status code for accepted, indicating retry logic
-                        'body': json.dumps({
-                            'status': 'retry',
-                            'message': "The required files are not ready yet. Please try again in a few minutes."
-                        })
-                    }
-                
-                # Both files are present, proceed with fetching them
-                try:
-                    # Download the primary_response.json file
-                    primary_s3_response = s3_client.get_object(Bucket=bucket_name, Key=primary_s3_key)
-                    primary_file_content = primary_s3_response['Body'].read().decode('utf-8')
-                    group1 = json.loads(primary_file_content)  # Store the content in group1
-                    print(f"Retrieved primary JSON data: {group1}")
-                except s3_client.exceptions.NoSuchKey:
-                    print(f"Primary response file not found: {primary_s3_key}")
-                    group1 = None  # If file not found, set group1 to None
-
-                try:
-                    # Download the secondary_response.json file
-                    secondary_s3_response = s3_client.get_object(Bucket=bucket_name, Key=secondary_s3_key)
-                    secondary_file_content = secondary_s3_response['Body'].read().decode('utf-8')
-                    group2 = json.loads(secondary_file_content)  # Store the content in group2
-                    print(f"Retrieved secondary JSON data: {group2}")
-                except s3_client.exceptions.NoSuchKey:
-                    print(f"Secondary response file not found: {secondary_s3_key}")
-                    group2 = None  # If file not found, set group2 to None
-                    
-                final_templates = [group1, group2]
-                data = json.dumps(final_templates, indent=4)
-
-                # Return only final_templates as the JSON response
+
+        # Only completed jobs are cached, so a hit needs no status check
+        entry = cached_final_response(job_id)
+        if entry is not None:
+            print(f"Serving cached final response for job {job_id}")
+            return final_response_result(event, body_dict, *entry)
+
+        # Retrieve job status from the job state store, waiting up to wait_seconds for it to complete
+        state = wait_for_job(job_id, float(body_dict.get('wait_seconds', 0)), context)
+
+        if state is not None:
+            parameter_value = state['status']
+            print(f"Job status retrieved: {parameter_value}, stage timestamps: {state['timestamps']}")
+
+            # The status only reaches "Extraction completed" once both branches have written their output
+            if parameter_value == EXTRACTION_COMPLETED:
+                entry = load_final_response(job_id)
+                if entry is not None:
+                    return final_response_result(event, body_dict, *entry)
                 return {
-                    'statusCode': 200,
-                    'body': data  # Return the formatted final_templates JSON directly
+                    "statusCode": 202,
+                    "body": json.dumps({
+                        "message": "Extraction completed but the results are not available yet. Please try again later."
+                    })
                 }
 
             else:
@@ -94,10 +158,10 @@ def lambda_handler(event, context):
                     })
                 }
         else:
-            print("Parameter value not found.")
+            print("Job status not found.")
             return {
                 "statusCode": 500,
-                "body": json.dumps({"error": "Parameter not found in SSM."})
+                "body": json.dumps({"error": "Job not found in the job state store."})
             }
 
     except Exception as e:
@@ -0,0 +1,158 @@
+"""
+Pickle-free on-disk format for the FAISS indexes, loadable through mmap.
+
+For an index called <name> the store is four files:
+
+    <name>.flat     the vectors as a FAISS flat index (faiss.write_index)
+    <name>.chunks   UTF-8 JSON records {"page_content", "metadata"}, back to back
+    <name>.offsets  little-endian uint64 offsets into .chunks (count + 1 entries)
+    <name>.json     {"count", "dim", "distance_strategy", "normalize_L2"}
+
+Opening a store maps the files instead of unpickling a docstore or copying the
+vectors; both vectors and chunk text are only paged in as searches touch them.
+"""
+import os
+import json
+import mmap
+import struct
+import argparse
+from collections.abc import Mapping
+import numpy as np
+import faiss
+from langchain.vectorstores import FAISS
+from langchain_community.docstore.base import Docstore
+from langchain_community.vectorstores.utils import DistanceStrategy
+from langchain_core.documents import Document
+
+CHUNK_STORE_EXTENSIONS = ('flat', 'chunks', 'offsets', 'json')
+
+
+def chunk_store_paths(folder_path, index_name="index"):
+    return {extension: os.path.join(folder_path, f"{index_name}.{extension}") for extension in CHUNK_STORE_EXTENSIONS}
+
+
+def _map_file(path):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return b""  # mmap cannot map an empty file
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class MmapDocstore(Docstore):
+    """
+    Read-only docstore over the .chunks/.offsets pair. Ids are row numbers in
+    the vector file.
+    """
+
+    def __init__(self, chunks_path, offsets_path):
+        self.chunks = _map_file(chunks_path)
+        self.offsets = _map_file(offsets_path)
+        self.count = max(len(self.offsets) // 8 - 1, 0)
+
+    def search(self, search):
+        row = int(search)
+        if not 0 <= row < self.count:
+            return f"ID {search} not found."
+        start, end = struct.unpack_from('<QQ', self.offsets, row * 8)
+        return Document(**json.loads(self.chunks[start:end]))
+
+
+class RowIds(Mapping):
+    """
+    index_to_docstore_id for a chunk store: FAISS row i maps to docstore id i.
+    """
+
+    def __init__(self, count):
+        self.count = count
+
+    def __getitem__(self, row):
+        if not 0 <= row < self.count:
+            raise KeyError(row)
+        return row
+
+    def __iter__(self):
+        return iter(range(self.count))
+
+    def __len__(self):
+        return self.count
+
+
+def _flat_index(distance_strategy, dim):
+    if distance_strategy == DistanceStrategy.MAX_INNER_PRODUCT:
+        return faiss.IndexFlatIP(dim)
+    return faiss.IndexFlatL2(dim)
+
+
+def save_chunk_store(vector, folder_path, index_name="index"):
+    """
+    Write a LangChain FAISS vector store in the chunk store format and return
+    the paths of the written files, keyed by extension.
+    """
+    paths = chunk_store_paths(folder_path, index_name)
+    count = vector.index.ntotal
+    dim = vector.index.d
+
+    distance_strategy = DistanceStrategy(vector.distance_strategy)
+
+    flat_index = _flat_index(distance_strategy, dim)
+    if count:
+        flat_index.add(np.ascontiguousarray(vector.index.reconstruct_n(0, count), dtype='float32'))
+    faiss.write_index(flat_index, paths['flat'])
+
+    offsets = [0]
+    with open(paths['chunks'], 'wb') as chunks_file:
+        for row in range(count):
+            doc = vector.docstore.search(vector.index_to_docstore_id[row])
+            record = json.dumps({"page_content": doc.page_content, "metadata": doc.metadata}).encode('utf-8')
+            chunks_file.write(record)
+            offsets.append(offsets[-1] + len(record))
+    np.asarray(offsets, dtype='<u8').tofile(paths['offsets'])
+
+    with open(paths['json'], 'w') as meta_file:
+        json.dump({
+            "count": count,
+            "dim": dim,
+            "distance_strategy": distance_strategy.value,
+            "normalize_L2": vector._normalize_L2,
+        }, meta_file)
+    return paths
+
+
+def load_chunk_store(folder_path, embeddings, index_name="index"):
+    """
+    Open a chunk store as a LangChain FAISS vector store. The flat index is
+    memory-mapped rather than read, so opening does not copy the vectors and
+    costs the same for any store size.
+    """
+    paths = chunk_store_paths(folder_path, index_name)
+    with open(paths['json']) as meta_file:
+        meta = json.load(meta_file)
+    # IO_FLAG_MMAP_IFC points the flat index's codes at the mapped file instead of reading them
+    index = faiss.read_index(paths['flat'], faiss.IO_FLAG_MMAP_IFC)
+
+    return FAISS(
+        embeddings,
+        index,
+        MmapDocstore(paths['chunks'], paths['offsets']),
+        RowIds(meta['count']),
+        normalize_L2=meta.get('normalize_L2', False),
+        distance_strategy=DistanceStrategy(meta['distance_strategy']),
+    )
+
+
+def convert_faiss_pickle(folder_path, embeddings=None, index_name="index"):
+    """
+    Convert an existing <index_name>.faiss/<index_name>.pkl pair written by
+    FAISS.save_local into a chunk store in the same folder.
+    """
+    vector = FAISS.load_local(folder_path, embeddings, index_name=index_name, allow_dangerous_deserialization=True)
+    return save_chunk_store(vector, folder_path, index_name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a FAISS .faiss/.pkl pair into a chunk store")
+    parser.add_argument("folder_path")
+    parser.add_argument("--index-name", default="index")
+    args = parser.parse_args()
+    for extension, path in convert_faiss_pickle(args.folder_path, index_name=args.index_name).items():
+        print(f"Wrote {path}")
@@ -0,0 +1,303 @@
+"""
+Client-side rate limiting for the Textract and Bedrock clients.
+
+rate_limited_from_env wraps a boto3 client so that every call draws a
+token from a bucket for its operation (and model, for Bedrock) before it
+goes out, and throttled or transiently failing calls are retried with
+jittered exponential backoff. Buckets live in process by default. With
+RATE_LIMIT_BACKEND=dynamodb their state is kept in a DynamoDB table, so
+every Lambda container draws from the same quota.
+
+The proxy is the only limiter and retry layer for these clients: create
+them with BOTOCORE_NO_RETRIES so botocore does not retry underneath it, and
+use is_throttling_error wherever a throttle has to be recognised.
+"""
+import os
+import random
+import threading
+import time
+import boto3
+from botocore.config import Config
+from botocore.exceptions import ClientError, ConnectionError, HTTPClientError
+
+THROTTLING_CODES = (
+    'ThrottlingException',
+    'ProvisionedThroughputExceededException',
+    'TooManyRequestsException',
+    'LimitExceededException',
+)
+
+# Server-side failures that botocore would otherwise have retried
+TRANSIENT_CODES = (
+    'InternalServerError',
+    'InternalServerException',
+    'InternalFailure',
+    'ServiceUnavailable',
+    'ServiceUnavailableException',
+    'ModelNotReadyException',
+)
+
+# Client config that turns off botocore's own retries for clients wrapped by the proxy
+BOTOCORE_NO_RETRIES = Config(retries={'total_max_attempts': 1})
+
+
+def is_throttling_error(error):
+    """
+    True for a throttling ClientError, also when a library such as LangChain
+    has re-raised it wrapped in another exception.
+    """
+    if isinstance(error, ClientError):
+        return error.response.get('Error', {}).get('Code') in THROTTLING_CODES
+    return any(code in str(error) for code in THROTTLING_CODES)
+
+
+def is_retryable_error(error):
+    if is_throttling_error(error):
+        return True
+    if isinstance(error, ClientError):
+        status = error.response.get('ResponseMetadata', {}).get('HTTPStatusCode', 0)
+        return error.response.get('Error', {}).get('Code') in TRANSIENT_CODES or status >= 500
+    return isinstance(error, (ConnectionError, HTTPClientError))
+
+
+class TokenBucket:
+    """
+    In-process token bucket: rate tokens per second, holding at most
+    capacity. acquire() blocks until a token is available.
+    """
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+                self.updated_at = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
+
+
+class InMemoryTokenStore:
+    """
+    Local stand-in for DynamoDBTokenStore with the same compare-and-set
+    semantics, shared by every bucket in the process.
+    """
+
+    def __init__(self):
+        self.items = {}
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            return self.items.get(key)
+
+    def compare_and_set(self, key, expected_updated_at, tokens, updated_at):
+        with self.lock:
+            current = self.items.get(key)
+            if (current[1] if current else None) != expected_updated_at:
+                return False
+            self.items[key] = (tokens, updated_at)
+            return True
+
+
+def _number(value):
+    # Fixed-point, so the value read back compares equal in the write condition
+    return f"{value:.6f}"
+
+
+class DynamoDBTokenStore:
+    """
+    Bucket state as one item per key: {"bucket": key, "tokens": N,
+    "updated_at": N}. Writes are conditional on updated_at being unchanged,
+    so concurrent containers never spend the same token twice.
+    """
+
+    def __init__(self, dynamodb_client, table_name):
+        self.client = dynamodb_client
+        self.table_name = table_name
+
+    def get(self, key):
+        response = self.client.get_item(
+            TableName=self.table_name,
+            Key={'bucket': {'S': key}},
+            ConsistentRead=True,
+        )
+        item = response.get('Item')
+        if item is None:
+            return None
+        return float(item['tokens']['N']), float(item['updated_at']['N'])
+
+    def compare_and_set(self, key, expected_updated_at, tokens, updated_at):
+        if expected_updated_at is None:
+            condition = {'ConditionExpression': 'attribute_not_exists(#bucket)',
+                         'ExpressionAttributeNames': {'#bucket': 'bucket'}}
+        else:
+            condition = {'ConditionExpression': 'updated_at = :expected',
+                         'ExpressionAttributeValues': {':expected': {'N': _number(expected_updated_at)}}}
+        try:
+            self.client.put_item(
+                TableName=self.table_name,
+                Item={
+                    'bucket': {'S': key},
+                    'tokens': {'N': _number(tokens)},
+                    'updated_at': {'N': _number(updated_at)},
+                },
+                **condition,
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                return False
+            raise
+        return True
+
+
+class SharedTokenBucket:
+    """
+    Token bucket whose state lives in a token store. If the store is
+    unreachable the bucket falls back to an in-process one, so a store
+    outage slows nothing down beyond the local limit.
+    """
+
+    def __init__(self, store, key, rate, capacity=None):
+        self.store = store
+        self.key = key
+        self.rate = rate
+        self.capacity = capacity or max(1.0, rate)
+        self.fallback = TokenBucket(rate, capacity)
+
+    def acquire(self):
+        while True:
+            try:
+                now = time.time()
+                state = self.store.get(self.key)
+                if state is None:
+                    tokens, expected_updated_at = self.capacity, None
+                else:
+                    tokens = min(self.capacity, state[0] + (now - state[1]) * self.rate)
+                    expected_updated_at = state[1]
+                if tokens >= 1:
+                    if self.store.compare_and_set(self.key, expected_updated_at, tokens - 1, now):
+                        return
+                    continue  # Another caller took a token first; re-read
+            except Exception as e:
+                print(f"Rate limit store unavailable for {self.key}, limiting locally: {e}")
+                self.fallback.acquire()
+                return
+            time.sleep((1 - tokens) / self.rate)
+
+
+class RateLimitedClient:
+    """
+    Proxy around a boto3 client. Calls to the client's API operations take a
+    token from the bucket for (operation, modelId) and are retried with full
+    jitter on throttling and transient failures, at most max_attempts times
+    in all. Everything else (exceptions, meta, paginators) is passed through
+    untouched.
+    """
+
+    def __init__(self, client, bucket_factory, max_attempts=5, base_backoff=1.0, max_backoff=20.0):
+        self._client = client
+        self._bucket_factory = bucket_factory
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self._operations = set(client.meta.method_to_api_mapping)
+        self.max_attempts = max_attempts
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+    def with_max_attempts(self, max_attempts):
+        """
+        A proxy over the same client and buckets that makes at most
+        max_attempts attempts, for callers with their own fallback.
+        """
+        proxy = RateLimitedClient(self._client, self._bucket_factory, max_attempts, self.base_backoff, self.max_backoff)
+        proxy._buckets = self._buckets
+        proxy._lock = self._lock
+        return proxy
+
+    def _bucket(self, key):
+        with self._lock:
+            if key not in self._buckets:
+                self._buckets[key] = self._bucket_factory(key)
+            return self._buckets[key]
+
+    def _call(self, operation, method, *args, **kwargs):
+        key = f"{operation}:{kwargs['modelId']}" if 'modelId' in kwargs else operation
+        bucket = self._bucket(key)
+        for attempt in range(1, self.max_attempts + 1):
+            if bucket is not None:
+                bucket.acquire()
+            try:
+                return method(*args, **kwargs)
+            except Exception as e:
+                if not is_retryable_error(e) or attempt == self.max_attempts:
+                    raise
+                delay = random.uniform(0, min(self.max_backoff, self.base_backoff * 2 ** (attempt - 1)))
+                reason = "throttled" if is_throttling_error(e) else f"failed ({e})"
+                print(f"{key} {reason} (attempt {attempt}/{self.max_attempts}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        if name not in self._operations:
+            return attribute
+
+        def call(*args, **kwargs):
+            return self._call(name, attribute, *args, **kwargs)
+        return call
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def _store_from_env():
+    """
+    The process-wide token store selected by RATE_LIMIT_BACKEND: "dynamodb",
+    "memory" (the local stand-in) or "local" (None: plain in-process buckets).
+    """
+    global _store
+    backend_name = os.getenv('RATE_LIMIT_BACKEND', 'local').lower()
+    if backend_name not in ('dynamodb', 'memory'):
+        return None
+    with _store_lock:
+        if _store is None:
+            if backend_name == 'dynamodb':
+                _store = DynamoDBTokenStore(boto3.client('dynamodb'), os.getenv('RATE_LIMIT_TABLE', 'konze-rate-limits'))
+            else:
+                _store = InMemoryTokenStore()
+        return _store
+
+
+def rate_limited_from_env(client, api_name):
+    """
+    Wrap client with the limits for api_name ("textract" or "bedrock"):
+    RATE_LIMIT_<API>_PER_SECOND tokens per second for each operation (0 = no
+    limit, retries only), RATE_LIMIT_MAX_ATTEMPTS and RATE_LIMIT_BACKOFF_SECONDS.
+    client should be created with config=BOTOCORE_NO_RETRIES.
+    """
+    rate = float(os.getenv(f'RATE_LIMIT_{api_name.upper()}_PER_SECOND', '0'))
+    store = _store_from_env()
+
+    def bucket_factory(key):
+        if not rate:
+            return None
+        if store is not None:
+            return SharedTokenBucket(store, f"{api_name}:{key}", rate)
+        return TokenBucket(rate)
+
+    return RateLimitedClient(
+        client,
+        bucket_factory,
+        max_attempts=int(os.getenv('RATE_LIMIT_MAX_ATTEMPTS', '5')),
+        base_backoff=float(os.getenv('RATE_LIMIT_BACKOFF_SECONDS', '1')),
+    )
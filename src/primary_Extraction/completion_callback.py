@@ -0,0 +1,89 @@
+import ipaddress
+import json
+import os
+import socket
+import time
+import urllib.request
+from urllib.parse import urlparse
+from job_state import EXTRACTION_COMPLETED
+
+callback_timeout_seconds = float(os.getenv('CALLBACK_TIMEOUT_SECONDS', '5'))
+callback_max_attempts = int(os.getenv('CALLBACK_MAX_ATTEMPTS', '3'))
+# Comma-separated host names callbacks may go to; empty allows any host with only public addresses
+callback_allowed_hosts = {host.strip().lower() for host in os.getenv('CALLBACK_ALLOWED_HOSTS', '').split(',') if host.strip()}
+
+
+class _NoRedirects(urllib.request.HTTPRedirectHandler):
+    # A redirect could point the POST at a host callback_url_error never checked
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+_opener = urllib.request.build_opener(_NoRedirects)
+
+
+def callback_url_error(url):
+    """
+    Return why url cannot receive callbacks, or None if it can. It must be
+    http(s), and its host must be in CALLBACK_ALLOWED_HOSTS when that is set,
+    or otherwise resolve only to public addresses: private, loopback,
+    link-local (e.g. the instance metadata endpoint) and reserved ones are
+    refused.
+    """
+    parsed = urlparse(url)
+    if parsed.scheme not in ('http', 'https') or not parsed.hostname:
+        return "callback_url must be an http or https URL"
+    host = parsed.hostname.lower()
+    if callback_allowed_hosts:
+        return None if host in callback_allowed_hosts else f"callback_url host {host} is not allowed"
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, parsed.port or None, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError, ValueError):
+        return f"callback_url host {host} does not resolve"
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split('%')[0])
+        if not ip.is_global or ip.is_multicast:
+            return f"callback_url host {host} is not a public address"
+    return None
+
+
+def post_callback(url, payload, timeout=callback_timeout_seconds, max_attempts=callback_max_attempts):
+    """
+    POST payload as JSON to url, retrying failed deliveries with exponential
+    backoff. Returns True once the receiver answers with a 2xx status. The
+    url is checked again before every attempt, since its host may resolve
+    differently than when the job was submitted, and redirects are not
+    followed.
+    """
+    body = json.dumps(payload).encode('utf-8')
+    for attempt in range(1, max_attempts + 1):
+        error = callback_url_error(url)
+        if error is not None:
+            print(f"Callback to {url} refused: {error}")
+            return False
+        request = urllib.request.Request(url, data=body, method='POST', headers={'Content-Type': 'application/json'})
+        try:
+            with _opener.open(request, timeout=timeout) as response:
+                if 200 <= response.status < 300:
+                    return True
+                print(f"Callback to {url} answered {response.status} (attempt {attempt}/{max_attempts})")
+        except Exception as e:
+            print(f"Callback to {url} failed (attempt {attempt}/{max_attempts}): {e}")
+        if attempt < max_attempts:
+            time.sleep(2 ** (attempt - 1))
+    return False
+
+
+def notify_job_completed(job_state, job_id):
+    """
+    Fire the callback registered for job_id, if any. Call this only from the
+    stage whose complete_branch returned True, so it fires once per job.
+    Delivery failures are logged and never fail the stage.
+    """
+    try:
+        callback_url = job_state.get_callback_url(job_id)
+        if callback_url:
+            delivered = post_callback(callback_url, {"job_id": job_id, "status": EXTRACTION_COMPLETED})
+            print(f"Completion callback for job {job_id} {'delivered' if delivered else 'not delivered'}")
+    except Exception as e:
+        print(f"Error sending completion callback for job {job_id}: {e}")
@@ -0,0 +1,170 @@
+import os
+import json
+import hashlib
+import threading
+import concurrent.futures
+from collections import OrderedDict
+from langchain.embeddings import CacheBackedEmbeddings
+from langchain.storage import LocalFileStore
+from langchain_core.embeddings import Embeddings
+from langchain_core.stores import ByteStore
+
+
+class S3ByteStore(ByteStore):
+    """
+    LangChain byte store backed by one S3 object per key, so cached vectors are
+    shared by every Lambda container and survive across jobs.
+    """
+
+    def __init__(self, s3_client, bucket_name, prefix, max_workers=16):
+        self.s3_client = s3_client
+        self.bucket_name = bucket_name
+        self.prefix = prefix
+        self.max_workers = max_workers
+
+    def _get(self, key):
+        try:
+            response = self.s3_client.get_object(Bucket=self.bucket_name, Key=f"{self.prefix}{key}")
+        except self.s3_client.exceptions.NoSuchKey:
+            return None
+        return response['Body'].read()
+
+    def _put(self, key_value):
+        key, value = key_value
+        self.s3_client.put_object(Bucket=self.bucket_name, Key=f"{self.prefix}{key}", Body=value)
+
+    def mget(self, keys):
+        if not keys:
+            return []
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(keys), self.max_workers)) as executor:
+            return list(executor.map(self._get, keys))
+
+    def mset(self, key_value_pairs):
+        key_value_pairs = list(key_value_pairs)
+        if not key_value_pairs:
+            return
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(key_value_pairs), self.max_workers)) as executor:
+            list(executor.map(self._put, key_value_pairs))
+
+    def mdelete(self, keys):
+        keys = list(keys)
+        for start in range(0, len(keys), 1000):
+            self.s3_client.delete_objects(
+                Bucket=self.bucket_name,
+                Delete={'Objects': [{'Key': f"{self.prefix}{key}"} for key in keys[start:start + 1000]]},
+            )
+
+    def yield_keys(self, prefix=None):
+        paginator = self.s3_client.get_paginator('list_objects_v2')
+        for page in paginator.paginate(Bucket=self.bucket_name, Prefix=f"{self.prefix}{prefix or ''}"):
+            for obj in page.get('Contents', []):
+                yield obj['Key'][len(self.prefix):]
+
+
+class QueryCachedEmbeddings(Embeddings):
+    """
+    Embeddings wrapper that caches query vectors keyed by the query text.
+
+    Lookups hit an in-process LRU first, which survives warm invocations, and
+    then the optional byte store shared across containers. warm() resolves a
+    whole set of queries up front and embeds every miss in a single batched
+    embed_documents call. Document embedding is passed straight through.
+    """
+
+    def __init__(self, underlying_embeddings, store, namespace, max_memory_entries=1024):
+        self.underlying_embeddings = underlying_embeddings
+        self.store = store
+        self.namespace = namespace
+        self.max_memory_entries = max_memory_entries
+        self.memory = OrderedDict()
+        self.lock = threading.Lock()
+
+    def _key(self, text):
+        return f"{self.namespace}{hashlib.sha256(text.encode('utf-8')).hexdigest()}"
+
+    def _remember(self, key, vector):
+        with self.lock:
+            self.memory[key] = vector
+            self.memory.move_to_end(key)
+            while len(self.memory) > self.max_memory_entries:
+                self.memory.popitem(last=False)
+
+    def _recall(self, key):
+        with self.lock:
+            vector = self.memory.get(key)
+            if vector is not None:
+                self.memory.move_to_end(key)
+            return vector
+
+    def warm(self, texts):
+        """
+        Make sure every text has a cached vector, embedding all misses at once.
+        """
+        missing = {}
+        for text in texts:
+            key = self._key(text)
+            if self._recall(key) is None:
+                missing[key] = text
+        if not missing:
+            return
+
+        if self.store is not None:
+            for key, value in zip(missing, self.store.mget(list(missing))):
+                if value is not None:
+                    self._remember(key, json.loads(value))
+            missing = {key: text for key, text in missing.items() if self._recall(key) is None}
+            if not missing:
+                return
+
+        vectors = self.underlying_embeddings.embed_documents(list(missing.values()))
+        for key, vector in zip(missing, vectors):
+            self._remember(key, vector)
+        if self.store is not None:
+            self.store.mset([(key, json.dumps(vector).encode('utf-8')) for key, vector in zip(missing, vectors)])
+        print(f"Embedded {len(missing)} uncached queries")
+
+    def embed_query(self, text):
+        key = self._key(text)
+        vector = self._recall(key)
+        if vector is None:
+            self.warm([text])
+            vector = self._recall(key)
+        return vector
+
+    def embed_documents(self, texts):
+        return self.underlying_embeddings.embed_documents(texts)
+
+
+def _store_from_env(s3_client):
+    backend_name = os.getenv('EMBEDDING_CACHE_BACKEND', 'none').lower()
+    if backend_name == 's3':
+        return S3ByteStore(
+            s3_client,
+            os.getenv('EMBEDDING_CACHE_BUCKET', 'konze-processing-bucket'),
+            os.getenv('EMBEDDING_CACHE_PREFIX', 'embedding-cache/'),
+        )
+    if backend_name == 'local':
+        return LocalFileStore(os.getenv('EMBEDDING_CACHE_DIR', '/tmp/embedding-cache'))
+    return None
+
+
+def embedding_cache_from_env(s3_client, underlying_embeddings, model_id):
+    """
+    Wrap the embedding model in a cache keyed by (model id, chunk text hash).
+    EMBEDDING_CACHE_BACKEND selects "s3", "local" or "none"; with "none" the
+    model is returned unchanged.
+    """
+    store = _store_from_env(s3_client)
+    if store is None:
+        return underlying_embeddings
+
+    # The namespace prefixes every key, so vectors from different models never mix
+    return CacheBackedEmbeddings.from_bytes_store(underlying_embeddings, store, namespace=f"{model_id}/")
+
+
+def query_cache_from_env(s3_client, underlying_embeddings, model_id):
+    """
+    Wrap the embedding model in a query-vector cache keyed by (model id, query
+    text hash). With EMBEDDING_CACHE_BACKEND "none" the cache is in-process only.
+    """
+    return QueryCachedEmbeddings(underlying_embeddings, _store_from_env(s3_client), f"{model_id}/query/")
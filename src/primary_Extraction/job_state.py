@@ -0,0 +1,356 @@
+"""
+Job status storage shared by every stage of the pipeline.
+
+The status strings are the ones the stages have always written ("In
+Progress", "Vector Generated", "Extraction completed"), plus "Submission
+failed" for batch jobs that could not be queued. Backends:
+
+    dynamodb  one item per job with conditional updates, a timestamp per
+              stage and TTL expiry
+    memory    in-process stand-in with the same semantics, for local runs
+    ssm       the legacy one-parameter-per-job layout
+
+create_many returns the job ids whose records could not be written.
+Only backends with batch_writes set write them in bulk.
+
+A job is "Extraction completed" only once every branch in
+REQUIRED_BRANCHES has called complete_branch; exactly one of those calls,
+the last, returns True.
+
+JOB_STATE_BACKEND selects the backend; job_state_from_env builds it.
+"""
+import os
+import threading
+import time
+import boto3
+from botocore.exceptions import ClientError
+
+IN_PROGRESS = "In Progress"
+VECTOR_GENERATED = "Vector Generated"
+EXTRACTION_COMPLETED = "Extraction completed"
+SUBMISSION_FAILED = "Submission failed"
+
+REQUIRED_BRANCHES = ("primary", "secondary")
+
+
+class InMemoryJobStateStore:
+
+    batch_writes = True
+
+    def __init__(self, ttl_seconds=None):
+        self.ttl_seconds = ttl_seconds
+        self.items = {}
+        self.lock = threading.Lock()
+
+    def _live(self, job_id, now):
+        item = self.items.get(job_id)
+        if item is not None and item.get("expires_at") and item["expires_at"] <= now:
+            del self.items[job_id]
+            return None
+        return item
+
+    def create(self, job_id, status, stage="request", callback_url=None):
+        now = time.time()
+        with self.lock:
+            if self._live(job_id, now) is not None:
+                return False
+            self.items[job_id] = {
+                "job_id": job_id,
+                "status": status,
+                "updated_at": now,
+                "timestamps": {stage: now},
+                "expires_at": now + self.ttl_seconds if self.ttl_seconds else None,
+                "callback_url": callback_url,
+            }
+            return True
+
+    def create_many(self, job_ids, status, stage="request", callback_url=None):
+        return [job_id for job_id in job_ids if not self.create(job_id, status, stage, callback_url)]
+
+    def get_callback_url(self, job_id):
+        with self.lock:
+            item = self._live(job_id, time.time())
+            return None if item is None else item["callback_url"]
+
+    def set_status(self, job_id, status, stage, expected=None):
+        now = time.time()
+        with self.lock:
+            item = self._live(job_id, now)
+            if item is None or (expected is not None and item["status"] not in expected):
+                return False
+            item["status"] = status
+            item["updated_at"] = now
+            item["timestamps"][stage] = now
+            return True
+
+    def complete_branch(self, job_id, branch, required=REQUIRED_BRANCHES):
+        now = time.time()
+        with self.lock:
+            item = self._live(job_id, now)
+            if item is None:
+                return False
+            item.setdefault("completed_branches", set()).add(branch)
+            item["timestamps"][f"{branch}_extraction"] = now
+            item["updated_at"] = now
+            if item["status"] == EXTRACTION_COMPLETED or not set(required) <= item["completed_branches"]:
+                return False
+            item["status"] = EXTRACTION_COMPLETED
+            return True
+
+    def get(self, job_id):
+        with self.lock:
+            item = self._live(job_id, time.time())
+            if item is None:
+                return None
+            return {
+                **item,
+                "timestamps": dict(item["timestamps"]),
+                "completed_branches": sorted(item.get("completed_branches", ())),
+            }
+
+
+class DynamoDBJobStateStore:
+    """
+    Item layout: job_id (hash key), status, updated_at, <stage>_at for every
+    stage that reported, and expires_at as the table's TTL attribute.
+    """
+
+    batch_writes = True
+
+    def __init__(self, dynamodb_client, table_name, ttl_seconds=None):
+        self.client = dynamodb_client
+        self.table_name = table_name
+        self.ttl_seconds = ttl_seconds
+
+    def _conditional(self, request):
+        try:
+            request()
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                return False
+            raise
+        return True
+
+    def _new_item(self, job_id, status, stage, callback_url):
+        now = time.time()
+        item = {
+            'job_id': {'S': job_id},
+            'status': {'S': status},
+            'updated_at': {'N': f"{now:.3f}"},
+            f'{stage}_at': {'N': f"{now:.3f}"},
+        }
+        if self.ttl_seconds:
+            item['expires_at'] = {'N': str(int(now + self.ttl_seconds))}
+        if callback_url:
+            item['callback_url'] = {'S': callback_url}
+        return item
+
+    def create(self, job_id, status, stage="request", callback_url=None):
+        return self._conditional(lambda: self.client.put_item(
+            TableName=self.table_name,
+            Item=self._new_item(job_id, status, stage, callback_url),
+            ConditionExpression='attribute_not_exists(job_id)',
+        ))
+
+    def create_many(self, job_ids, status, stage="request", callback_url=None, max_attempts=5):
+        """
+        Create records for freshly generated job ids with BatchWriteItem, 25
+        items per request. Batch writes cannot be conditional, so job_ids must
+        not already exist. Unprocessed items are retried with backoff; the
+        job ids still unwritten after max_attempts are returned.
+        """
+        requests = [{'PutRequest': {'Item': self._new_item(job_id, status, stage, callback_url)}} for job_id in job_ids]
+        unwritten = []
+        for start in range(0, len(requests), 25):
+            pending = requests[start:start + 25]
+            for attempt in range(1, max_attempts + 1):
+                try:
+                    response = self.client.batch_write_item(RequestItems={self.table_name: pending})
+                    pending = response.get('UnprocessedItems', {}).get(self.table_name, [])
+                except Exception as e:
+                    print(f"Writing {len(pending)} job records failed (attempt {attempt}/{max_attempts}): {e}")
+                if not pending or attempt == max_attempts:
+                    break
+                time.sleep(0.1 * 2 ** attempt)
+            if pending:
+                print(f"{len(pending)} job records were not written after {max_attempts} attempts")
+                unwritten.extend(request['PutRequest']['Item']['job_id']['S'] for request in pending)
+        return unwritten
+
+    def set_status(self, job_id, status, stage, expected=None):
+        now = f"{time.time():.3f}"
+        values = {':status': {'S': status}, ':now': {'N': now}}
+        condition = 'attribute_exists(job_id)'
+        if expected is not None:
+            placeholders = []
+            for index, expected_status in enumerate(expected):
+                values[f':expected{index}'] = {'S': expected_status}
+                placeholders.append(f':expected{index}')
+            condition += f" AND #status IN ({', '.join(placeholders)})"
+        return self._conditional(lambda: self.client.update_item(
+            TableName=self.table_name,
+            Key={'job_id': {'S': job_id}},
+            UpdateExpression='SET #status = :status, updated_at = :now, #stage_at = :now',
+            ConditionExpression=condition,
+            ExpressionAttributeNames={'#status': 'status', '#stage_at': f'{stage}_at'},
+            ExpressionAttributeValues=values,
+        ))
+
+    def complete_branch(self, job_id, branch, required=REQUIRED_BRANCHES):
+        now = f"{time.time():.3f}"
+        try:
+            # ADD to a string set is atomic, so concurrent branches never lose each other's entry
+            response = self.client.update_item(
+                TableName=self.table_name,
+                Key={'job_id': {'S': job_id}},
+                UpdateExpression='ADD completed_branches :branch SET updated_at = :now, #stage_at = :now',
+                ConditionExpression='attribute_exists(job_id)',
+                ExpressionAttributeNames={'#stage_at': f'{branch}_extraction_at'},
+                ExpressionAttributeValues={':branch': {'SS': [branch]}, ':now': {'N': now}},
+                ReturnValues='ALL_NEW',
+            )
+        except ClientError as e:
+            if e.response.get('Error', {}).get('Code') == 'ConditionalCheckFailedException':
+                return False
+            raise
+        if not set(required) <= set(response['Attributes']['completed_branches']['SS']):
+            return False
+        # Only one caller can flip the status, so only one sees True
+        return self._conditional(lambda: self.client.update_item(
+            TableName=self.table_name,
+            Key={'job_id': {'S': job_id}},
+            UpdateExpression='SET #status = :completed',
+            ConditionExpression='#status <> :completed',
+            ExpressionAttributeNames={'#status': 'status'},
+            ExpressionAttributeValues={':completed': {'S': EXTRACTION_COMPLETED}},
+        ))
+
+    def get_callback_url(self, job_id):
+        response = self.client.get_item(
+            TableName=self.table_name,
+            Key={'job_id': {'S': job_id}},
+            ProjectionExpression='callback_url',
+        )
+        return response.get('Item', {}).get('callback_url', {}).get('S')
+
+    def get(self, job_id):
+        response = self.client.get_item(
+            TableName=self.table_name,
+            Key={'job_id': {'S': job_id}},
+            ConsistentRead=True,
+        )
+        item = response.get('Item')
+        # TTL deletion runs in the background, so expired items can still be returned for a while
+        if item is None or ('expires_at' in item and float(item['expires_at']['N']) <= time.time()):
+            return None
+        return {
+            "job_id": job_id,
+            "status": item['status']['S'],
+            "completed_branches": sorted(item.get('completed_branches', {}).get('SS', [])),
+            "updated_at": float(item['updated_at']['N']),
+            "timestamps": {
+                name[:-len('_at')]: float(value['N'])
+                for name, value in item.items()
+                if name.endswith('_at') and name not in ('updated_at', 'expires_at')
+            },
+        }
+
+
+class SsmJobStateStore:
+    """
+    Legacy layout: one String parameter per job holding only the status.
+    SSM has no conditional writes, so expected is checked with a read first
+    and is best effort; stage timestamps and TTL are not kept.
+
+    Everything else lives in the parameter's version history, so a job never
+    costs more than its one parameter. Every write says what it was in the
+    version's description: "request:<callback_url>" for the first version,
+    "stage:<stage>", "branch:<branch>" and "completed:<branch>". Versions are
+    numbered in write order, so the branch whose "branch:" version is the
+    first one by which every required branch has written its own is the one
+    that completes the job.
+    """
+
+    # One PutParameter per job; a large batch would run into SSM's throughput limit
+    batch_writes = False
+
+    def __init__(self, ssm_client):
+        self.client = ssm_client
+
+    def _put(self, job_id, status, description):
+        response = self.client.put_parameter(Name=job_id, Value=status, Description=description, Type='String', Overwrite=True)
+        return response['Version']
+
+    def _history(self, job_id):
+        versions = []
+        for page in self.client.get_paginator('get_parameter_history').paginate(Name=job_id):
+            versions.extend(page['Parameters'])
+        return sorted(versions, key=lambda version: version['Version'])
+
+    def create(self, job_id, status, stage="request", callback_url=None):
+        self._put(job_id, status, f"{stage}:{callback_url or ''}")
+        return True
+
+    def create_many(self, job_ids, status, stage="request", callback_url=None):
+        # SSM has no batch write
+        unwritten = []
+        for job_id in job_ids:
+            try:
+                self.create(job_id, status, stage, callback_url)
+            except Exception as e:
+                print(f"Writing job record {job_id} failed: {e}")
+                unwritten.append(job_id)
+        return unwritten
+
+    def get_callback_url(self, job_id):
+        try:
+            history = self._history(job_id)
+        except self.client.exceptions.ParameterNotFound:
+            return None
+        return history[0].get('Description', '').partition(':')[2] or None
+
+    def set_status(self, job_id, status, stage, expected=None):
+        if expected is not None:
+            current = self.get(job_id)
+            if current is None or current["status"] not in expected:
+                return False
+        self._put(job_id, status, f"stage:{stage}")
+        return True
+
+    def complete_branch(self, job_id, branch, required=REQUIRED_BRANCHES):
+        current = self.get(job_id)
+        if current is None:
+            return False
+        version = self._put(job_id, current["status"], f"branch:{branch}")
+        completed = set()
+        for entry in self._history(job_id):
+            kind, _, name = entry.get('Description', '').partition(':')
+            if kind == 'branch':
+                completed.add(name)
+            if set(required) <= completed:
+                # Also restores the status if a late duplicate's write above overwrote it
+                self._put(job_id, EXTRACTION_COMPLETED, f"completed:{branch}")
+                return entry['Version'] == version
+        return False
+
+    def get(self, job_id):
+        try:
+            response = self.client.get_parameter(Name=job_id)
+        except self.client.exceptions.ParameterNotFound:
+            return None
+        return {"job_id": job_id, "status": response['Parameter']['Value'], "timestamps": {}, "completed_branches": []}
+
+
+def job_state_from_env():
+    """
+    Build the store selected by JOB_STATE_BACKEND ("ssm", "dynamodb" or
+    "memory"). JOB_STATE_TABLE names the DynamoDB table and
+    JOB_STATE_TTL_SECONDS sets how long job records are kept.
+    """
+    backend_name = os.getenv('JOB_STATE_BACKEND', 'ssm').lower()
+    ttl_seconds = int(os.getenv('JOB_STATE_TTL_SECONDS', '604800')) or None
+    if backend_name == 'dynamodb':
+        return DynamoDBJobStateStore(boto3.client('dynamodb'), os.getenv('JOB_STATE_TABLE', 'konze-job-state'), ttl_seconds)
+    if backend_name == 'memory':
+        return InMemoryJobStateStore(ttl_seconds)
+    return SsmJobStateStore(boto3.client('ssm'))
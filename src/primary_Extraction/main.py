@@ -7,7 +7,6 @@ import tempfile
 from botocore.config import Config
 import requests
 import io
-from langchain.embeddings import BedrockEmbeddings
 from langchain.indexes import VectorstoreIndexCreator
 from langchain.vectorstores import FAISS
 from langchain_core.prompts import ChatPromptTemplate
@@ -17,6 +16,14 @@ from langchain_community.chat_models import BedrockChat
 import concurrent.futures
 from langchain.chains import RetrievalQA
 from langchain_core.prompts import ChatPromptTemplate
+from bedrock_embeddings import batched_embeddings_from_env
+from embedding_cache import query_cache_from_env
+from chunk_store import CHUNK_STORE_EXTENSIONS, load_chunk_store
+from rate_limit import rate_limited_from_env, BOTOCORE_NO_RETRIES
+from job_state import job_state_from_env
+from stage_queue import consume
+from completion_callback import notify_job_completed
+from final_response import write_final_response_safely
 
 
 prompt_template = ChatPromptTemplate.from_template("""Please fill in the missing details in the following information::
@@ -41,18 +48,31 @@ Question: {input}""")
 
 
 s3 = boto3.client('s3')
-ssm_client = boto3.client('ssm')
+job_state = job_state_from_env()
 
 
-bedrock_runtime = boto3.client( 
-        service_name="bedrock-runtime",
-        region_name="ap-south-1",
-    )
+# Maximum number of template chains in flight against Bedrock at once
+max_in_flight = int(os.getenv('EXTRACTION_MAX_CONCURRENCY', '4'))
+# "mmap" reads the pickle-free chunk store instead of index.faiss/index.pkl
+index_format = os.getenv('INDEX_FORMAT', 'pickle').lower()
 
-embeddings = BedrockEmbeddings(
-        model_id="cohere.embed-english-v3",
-        client=bedrock_runtime,
+# Bedrock calls take a token from the shared per-model limiter; the proxy is their only retry layer
+bedrock_runtime = rate_limited_from_env(
+    boto3.client(
+        service_name="bedrock-runtime",
         region_name="ap-south-1",
+        config=BOTOCORE_NO_RETRIES,
+    ),
+    'bedrock',
+)
+
+embedding_model_id = "cohere.embed-english-v3"
+
+# Query vectors are cached by query text, in process and in the shared embedding cache
+embeddings = query_cache_from_env(
+        s3,
+        batched_embeddings_from_env(bedrock_runtime, embedding_model_id),
+        embedding_model_id,
     )
 
 index_creator = VectorstoreIndexCreator(
@@ -254,6 +274,15 @@ def clear_directory_files(directory):
             os.remove(file_path)
             print(f"Deleted file: {file_path}")
             
+def download_chunk_store(bucket_name, s3_folder, s3_index_name, local_dir):
+    """
+    Download a chunk store written by the embedding stage into local_dir as
+    index "index" and open it without unpickling anything.
+    """
+    for extension in CHUNK_STORE_EXTENSIONS:
+        s3.download_file(bucket_name, f"{s3_folder}/{s3_index_name}.{extension}", os.path.join(local_dir, f"index.{extension}"))
+    return load_chunk_store(local_dir, embeddings)
+
 def file_exists_in_s3(bucket, key):
         try:
             s3.head_object(Bucket=bucket, Key=key)
@@ -261,7 +290,7 @@ def file_exists_in_s3(bucket, key):
         except s3.exceptions.ClientError:
             return False
             
-def lambda_handler(event, context):
+def process_job(event, context):
     bucket_name = "konze-processing-bucket"
     job_id = event['job_id']
     student = event['student']
@@ -277,19 +306,24 @@ def lambda_handler(event, context):
     clear_directory_files(local_dir_transcript)
     os.makedirs(local_dir_transcript, exist_ok=True)
 
-    # Download files from S3
-    s3.download_file(bucket_name, f"{job_id}/embeddings/primary/index.faiss", f"/tmp/{job_id}/primaryextract/index.faiss")
-    s3.download_file(bucket_name, f"{job_id}/embeddings/primary/index.pkl", f"/tmp/{job_id}/primaryextract/index.pkl")
-    
-    # Check and download transcript files if they exist
-    if file_exists_in_s3(bucket_name, f"{job_id}/embeddings/primary/transcript_index.faiss"):
-        s3.download_file(bucket_name, f"{job_id}/embeddings/primary/transcript_index.faiss", f"/tmp/{job_id}/primaryextract/transcript/index.faiss")
-    
-    if file_exists_in_s3(bucket_name, f"{job_id}/embeddings/primary/transcript_index.pkl"):
-        s3.download_file(bucket_name, f"{job_id}/embeddings/primary/transcript_index.pkl", f"/tmp/{job_id}/primaryextract/transcript/index.pkl")
-        faiss_index_transcript = FAISS.load_local(f"/tmp/{job_id}/primaryextract/transcript/", embeddings, allow_dangerous_deserialization=True)
+    if index_format == 'mmap':
+        faiss_index = download_chunk_store(bucket_name, f"{job_id}/embeddings/primary", "index", local_dir)
+        if file_exists_in_s3(bucket_name, f"{job_id}/embeddings/primary/transcript_index.json"):
+            faiss_index_transcript = download_chunk_store(bucket_name, f"{job_id}/embeddings/primary", "transcript_index", local_dir_transcript)
+    else:
+        # Download files from S3
+        s3.download_file(bucket_name, f"{job_id}/embeddings/primary/index.faiss", f"/tmp/{job_id}/primaryextract/index.faiss")
+        s3.download_file(bucket_name, f"{job_id}/embeddings/primary/index.pkl", f"/tmp/{job_id}/primaryextract/index.pkl")
         
-    faiss_index = FAISS.load_local(f"/tmp/{job_id}/primaryextract/", embeddings, allow_dangerous_deserialization=True)
+        # Check and download transcript files if they exist
+        if file_exists_in_s3(bucket_name, f"{job_id}/embeddings/primary/transcript_index.faiss"):
+            s3.download_file(bucket_name, f"{job_id}/embeddings/primary/transcript_index.faiss", f"/tmp/{job_id}/primaryextract/transcript/index.faiss")
+        
+        if file_exists_in_s3(bucket_name, f"{job_id}/embeddings/primary/transcript_index.pkl"):
+            s3.download_file(bucket_name, f"{job_id}/embeddings/primary/transcript_index.pkl", f"/tmp/{job_id}/primaryextract/transcript/index.pkl")
+            faiss_index_transcript = FAISS.load_local(f"/tmp/{job_id}/primaryextract/transcript/", embeddings, allow_dangerous_deserialization=True)
+            
+        faiss_index = FAISS.load_local(f"/tmp/{job_id}/primaryextract/", embeddings, allow_dangerous_deserialization=True)
     # faiss_index_transcript = FAISS.load_local(f"/tmp/{job_id}/primaryextract/transcript/", embeddings, allow_dangerous_deserialization=True)
     
     date_formate = "IMPORTANT: write all date relevant information in yyyy-mm-dd formate"
@@ -346,17 +380,31 @@ def lambda_handler(event, context):
         prompt7, prompt8, prompt9
     ]
     
+    document_chain = create_stuff_documents_chain(llm,prompt_template)
+
+    queries = []
     for idx, template in enumerate(templates):
         prompt = prompts[idx]
-        document_chain = create_stuff_documents_chain(llm,prompt_template)
+        data_json_str = json.dumps(template, indent=2)
+        queries.append(f"Understand and fill the answer for this {data_json_str}.and follow this instruction{prompt}.{date_formate}.IMPORTANT : Do not return anything extra than the JSON at the start or the ending of JSON , even if you dont find the answer then return JSON as it is without anything extra keywords")
+
+    # Resolve every query vector up front: cache hits cost nothing and all misses go to Bedrock in one batch
+    embeddings.warm(queries)
+
+    def run_template(idx):
         if idx == 4:
             retriever = faiss_index_transcript.as_retriever(search_kwargs={"k":18})
         else :
             retriever = faiss_index.as_retriever(search_kwargs={"k":18})
         retrieval_chain = create_retrieval_chain(retriever, document_chain)
-        data_json_str = json.dumps(template, indent=2)
-        response1 = retrieval_chain.invoke({"input": f"Understand and fill the answer for this {data_json_str}.and follow this instruction{prompt}.{date_formate}.IMPORTANT : Do not return anything extra than the JSON at the start or the ending of JSON , even if you dont find the answer then return JSON as it is without anything extra keywords"})
-        data = response1["answer"]
+        response1 = retrieval_chain.invoke({"input": queries[idx]})
+        return response1["answer"]
+
+    # Fan the template chains out in parallel; map() keeps results in template order
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_in_flight, len(templates))) as executor:
+        answers = list(executor.map(run_template, range(len(templates))))
+
+    for idx, data in enumerate(answers):
         # print("data",data)
         
         if isinstance(data, str):
@@ -393,13 +441,11 @@ def lambda_handler(event, context):
     # Upload final response to S3
     upload_final_response_to_s3(local_file_path, bucket_name, job_id)
 
-    # Update status in SSM Parameter Store
-    ssm_client.put_parameter(
-        Name=job_id,
-        Value="Extraction completed",
-        Type='String',
-        Overwrite=True,
-    )
+    # Record this branch; the job only becomes "Extraction completed" once both branches are done
+    if job_state.complete_branch(job_id, "primary"):
+        print(f"Job {job_id} completed")
+        write_final_response_safely(s3, job_id)
+        notify_job_completed(job_state, job_id)
 
     clear_directory_files(local_dir)
     clear_directory_files(local_dir_transcript)
@@ -415,3 +461,9 @@ def lambda_handler(event, context):
         },
         "body": json.dumps(responses),
     }
+
+def lambda_handler(event, context):
+    # Payloads arrive in batches from the stage queue, or as a single direct invoke
+    if 'Records' in event:
+        return consume(event['Records'], process_job, context)
+    return process_job(event, context)
@@ -0,0 +1,67 @@
+import os
+import json
+import time
+import concurrent.futures
+from langchain_core.embeddings import Embeddings
+
+
+class BatchedBedrockEmbeddings(Embeddings):
+    """
+    Drop-in replacement for BedrockEmbeddings with Cohere embed v3 that packs
+    texts into batches of up to 96 per invoke_model call and runs several
+    batches at once.
+
+    Rate limiting and retries are left to client, the RateLimitedClient
+    around bedrock-runtime. Texts are preprocessed and sent with input_type
+    "search_document" exactly like BedrockEmbeddings does, so the vectors are
+    interchangeable with those it produces.
+    """
+
+    def __init__(self, client, model_id="cohere.embed-english-v3", batch_size=96, max_concurrency=4):
+        self.client = client
+        self.model_id = model_id
+        self.batch_size = batch_size
+        self.max_concurrency = max_concurrency
+
+    def _invoke(self, texts):
+        body = json.dumps({
+            "texts": [text.replace(os.linesep, " ") for text in texts],
+            "input_type": "search_document",
+        })
+        response = self.client.invoke_model(
+            body=body,
+            modelId=self.model_id,
+            accept="application/json",
+            contentType="application/json",
+        )
+        return json.loads(response['body'].read())['embeddings']
+
+    def embed_documents(self, texts):
+        if not texts:
+            return []
+        batches = [texts[start:start + self.batch_size] for start in range(0, len(texts), self.batch_size)]
+
+        start_time = time.perf_counter()
+        with concurrent.futures.ThreadPoolExecutor(max_workers=min(len(batches), self.max_concurrency)) as executor:
+            results = list(executor.map(self._invoke, batches))
+        elapsed = time.perf_counter() - start_time
+
+        print(f"Embedded {len(texts)} texts in {len(batches)} batches in {elapsed:.2f}s ({len(texts) / max(elapsed, 1e-9):.1f} texts/s)")
+        return [vector for batch in results for vector in batch]
+
+    def embed_query(self, text):
+        return self._invoke([text])[0]
+
+
+def batched_embeddings_from_env(client, model_id):
+    """
+    Build the batched embeddings client from EMBEDDING_BATCH_SIZE and
+    EMBEDDING_MAX_CONCURRENCY. The request rate is set on the client, by
+    RATE_LIMIT_BEDROCK_PER_SECOND.
+    """
+    return BatchedBedrockEmbeddings(
+        client,
+        model_id=model_id,
+        batch_size=int(os.getenv('EMBEDDING_BATCH_SIZE', '96')),
+        max_concurrency=int(os.getenv('EMBEDDING_MAX_CONCURRENCY', '4')),
+    )
@@ -2,31 +2,38 @@ import boto3
 import os
 import json
 import concurrent.futures
-from langchain.embeddings import BedrockEmbeddings
 from langchain.vectorstores import FAISS
 from langchain.document_loaders import TextLoader, PyPDFLoader
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_community.document_loaders import DirectoryLoader
+from chunk_store import save_chunk_store
+from bedrock_embeddings import batched_embeddings_from_env
+from rate_limit import rate_limited_from_env, BOTOCORE_NO_RETRIES
+from stage_queue import stage_queue_from_env, consume
+from job_state import job_state_from_env, IN_PROGRESS, VECTOR_GENERATED
 
 # Clients
 s3 = boto3.client('s3')
-ssm_client = boto3.client('ssm')
-lambda_client = boto3.client('lambda')
+job_state = job_state_from_env()
 
-third_lambda_arn = os.getenv('SECONDARY_EXTRACTION_FUNCTION_ARN')
-print("@", third_lambda_arn)
+extraction_queue = stage_queue_from_env(os.getenv('SECONDARY_EXTRACTION_QUEUE_URL'), os.getenv('SECONDARY_EXTRACTION_FUNCTION_ARN'))
 
-bedrock_runtime = boto3.client(
-    service_name="bedrock-runtime",
-    region_name="ap-south-1",
-)
+# "mmap" also writes the pickle-free chunk store read by the extraction stage
+index_format = os.getenv('INDEX_FORMAT', 'pickle').lower()
 
-embeddings = BedrockEmbeddings(
-    model_id="cohere.embed-english-v3",
-    client=bedrock_runtime,
-    region_name="ap-south-1",
+# Bedrock calls take a token from the shared per-model limiter; the proxy is their only retry layer
+bedrock_runtime = rate_limited_from_env(
+    boto3.client(
+        service_name="bedrock-runtime",
+        region_name="ap-south-1",
+        config=BOTOCORE_NO_RETRIES,
+    ),
+    'bedrock',
 )
 
+# Packs chunks into batched Bedrock calls instead of one request per chunk
+embeddings = batched_embeddings_from_env(bedrock_runtime, "cohere.embed-english-v3")
+
 def custom_loader(file_path):
     """
     Custom loader to handle different file types
@@ -77,6 +84,14 @@ def process_single_file(file_path, embeddings):
         print(f"Error processing {file_path}: {e}")
         return []
     
+def upload_chunk_store(vector, local_folder, index_name, bucket_name, s3_folder):
+    """
+    Write the vector store in the mmap-friendly chunk store format next to the
+    pickle pair and upload it to the same S3 folder.
+    """
+    for extension, path in save_chunk_store(vector, local_folder, index_name).items():
+        s3.upload_file(path, bucket_name, f"{s3_folder}/{index_name}.{extension}")
+
 def clear_directory_files(directory):
     # Check if the directory exists
     if not os.path.exists(directory):
@@ -99,7 +114,7 @@ def clear_directory_files(directory):
             os.remove(file_path)
             print(f"Deleted file: {file_path}")
             
-def lambda_handler(event, context):
+def process_job(event, context):
     # print("1", event)
     job_id = event['job_id']
     print("job_id",job_id)
@@ -151,15 +166,13 @@ def lambda_handler(event, context):
         # Upload embeddings to S3
         s3.upload_file(faiss_path, bucket_name, f"{job_id}/embeddings/secondary/index.faiss")
         s3.upload_file(pickle_path, bucket_name, f"{job_id}/embeddings/secondary/index.pkl")
+        if index_format == 'mmap':
+            upload_chunk_store(vector, f"/tmp/{job_id}/secondembed/", "index", bucket_name, f"{job_id}/embeddings/secondary")
         print(f"Uploaded embeddings")
 
-        # Set job status in SSM
-        ssm_client.put_parameter(
-            Name=job_id,
-            Value="Vector Generated",
-            Type='String',
-            Overwrite=True
-        )
+        # Set job status; never moves a job back once extraction has completed
+        if not job_state.set_status(job_id, VECTOR_GENERATED, stage="secondary_embeddings", expected=(IN_PROGRESS, VECTOR_GENERATED)):
+            print(f"Job {job_id} status not set to {VECTOR_GENERATED}, it is missing or already further along")
         
         os.makedirs(local_dir, exist_ok=True)
 
@@ -168,7 +181,7 @@ def lambda_handler(event, context):
             "job_id": job_id ,
             "student": student
         }
-        invoke_secondary_lambda_async(payload)
+        extraction_queue.send(payload)
 
         return {
             "statusCode": 200,
@@ -186,10 +199,8 @@ def lambda_handler(event, context):
             "body": json.dumps("No documents found or processed."),
         }
 
-def invoke_secondary_lambda_async(payload):
-    response = lambda_client.invoke(
-        FunctionName=third_lambda_arn,
-        InvocationType='Event',  # Asynchronous invocation
-        Payload=json.dumps(payload)
-    )
-    return response
+def lambda_handler(event, context):
+    # Payloads arrive in batches from the stage queue, or as a single direct invoke
+    if 'Records' in event:
+        return consume(event['Records'], process_job, context)
+    return process_job(event, context)
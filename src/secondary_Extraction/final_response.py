@@ -0,0 +1,71 @@
+"""
+The combined result of a job, [primary_response, secondary_response], as
+served by Response_api.
+
+The stage that completes the job assembles it once into
+<job_id>/output/final_response.json as compact JSON, so polls read a single
+object instead of fetching and re-serializing both branch responses.
+"""
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+OUTPUT_BUCKET = "konze-processing-bucket"
+
+
+def final_response_key(job_id):
+    return f"{job_id}/output/final_response.json"
+
+
+BRANCH_RESPONSE_KEYS = ("{job_id}/output/primary_response.json", "{job_id}/output/secondary_response.json")
+
+
+def _read_response(s3_client, bucket_name, key):
+    try:
+        return s3_client.get_object(Bucket=bucket_name, Key=key)['Body'].read()
+    except s3_client.exceptions.NoSuchKey:
+        print(f"Response file not ready: {key}")
+        return None
+
+
+def assemble_final_response(s3_client, job_id, bucket_name=OUTPUT_BUCKET):
+    """
+    Read both branch responses, concurrently, and return [primary, secondary]
+    as compact JSON bytes, or None while either of them is missing.
+    """
+    keys = [key.format(job_id=job_id) for key in BRANCH_RESPONSE_KEYS]
+    with ThreadPoolExecutor(max_workers=len(keys)) as executor:
+        bodies = list(executor.map(lambda key: _read_response(s3_client, bucket_name, key), keys))
+    if any(body is None for body in bodies):
+        return None
+    final_templates = [json.loads(body) for body in bodies]
+    return json.dumps(final_templates, separators=(',', ':')).encode('utf-8')
+
+
+def write_final_response(s3_client, job_id, bucket_name=OUTPUT_BUCKET):
+    """
+    Assemble the final response and store it under final_response_key.
+    Returns the bytes written, or None if a branch response is not there yet.
+    """
+    body = assemble_final_response(s3_client, job_id, bucket_name)
+    if body is None:
+        return None
+    s3_client.put_object(
+        Bucket=bucket_name,
+        Key=final_response_key(job_id),
+        Body=body,
+        ContentType='application/json',
+    )
+    print(f"Wrote final response ({len(body)} bytes) to s3://{bucket_name}/{final_response_key(job_id)}")
+    return body
+
+
+def write_final_response_safely(s3_client, job_id):
+    """
+    write_final_response for the completing stage. Failures are logged and
+    never fail the stage: Response_api assembles the result itself when the
+    object is missing.
+    """
+    try:
+        write_final_response(s3_client, job_id)
+    except Exception as e:
+        print(f"Error writing final response for job {job_id}: {e}")
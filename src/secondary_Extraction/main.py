@@ -15,8 +15,15 @@ from langchain.chains.combine_documents import create_stuff_documents_chain
 from langchain.chains import create_retrieval_chain
 from langchain_community.chat_models import BedrockChat
 import concurrent.futures
+import time
+from chunk_store import CHUNK_STORE_EXTENSIONS, load_chunk_store
 from langchain.chains import RetrievalQA
 from langchain_core.prompts import ChatPromptTemplate
+from rate_limit import rate_limited_from_env, BOTOCORE_NO_RETRIES
+from job_state import job_state_from_env
+from stage_queue import consume
+from completion_callback import notify_job_completed
+from final_response import write_final_response_safely
 
 
 # prompt_template = ChatPromptTemplate.from_template("""Please fill in the missing details in the following information::
@@ -48,13 +55,23 @@ Question: {input}""")
 
 
 s3 = boto3.client('s3')
-ssm_client = boto3.client('ssm')
+job_state = job_state_from_env()
 
+# Maximum number of template chains in flight against Bedrock at once
+max_in_flight = int(os.getenv('EXTRACTION_MAX_CONCURRENCY', '4'))
+# "mmap" reads the pickle-free chunk store instead of index.faiss/index.pkl
+index_format = os.getenv('INDEX_FORMAT', 'pickle').lower()
 
-bedrock_runtime = boto3.client( 
+
+# Bedrock calls take a token from the shared per-model limiter; the proxy is their only retry layer
+bedrock_runtime = rate_limited_from_env(
+    boto3.client(
         service_name="bedrock-runtime",
         region_name="ap-south-1",
-    )
+        config=BOTOCORE_NO_RETRIES,
+    ),
+    'bedrock',
+)
 
 embeddings = BedrockEmbeddings(
         model_id="cohere.embed-english-v3",
@@ -62,6 +79,7 @@ embeddings = BedrockEmbeddings(
         region_name="ap-south-1",
     )
 
+
 index_creator = VectorstoreIndexCreator(
         vectorstore_cls=FAISS,
         embedding=embeddings,
@@ -233,6 +251,15 @@ def upload_final_response_to_s3(local_file_path, bucket_name, job_id):
     except Exception as e:
         print(f"Error uploading to S3: {e}")
         
+def download_chunk_store(bucket_name, s3_folder, s3_index_name, local_dir):
+    """
+    Download a chunk store written by the embedding stage into local_dir as
+    index "index" and open it without unpickling anything.
+    """
+    for extension in CHUNK_STORE_EXTENSIONS:
+        s3.download_file(bucket_name, f"{s3_folder}/{s3_index_name}.{extension}", os.path.join(local_dir, f"index.{extension}"))
+    return load_chunk_store(local_dir, embeddings)
+
 def clear_directory_files(directory):
     # Check if the directory exists
     if not os.path.exists(directory):
@@ -255,7 +282,7 @@ def clear_directory_files(directory):
             os.remove(file_path)
             print(f"Deleted file: {file_path}")
             
-def lambda_handler(event, context):
+def process_job(event, context):
     bucket_name = "konze-processing-bucket"
     job_id = event['job_id']
     student = event['student']
@@ -268,10 +295,13 @@ def lambda_handler(event, context):
     os.makedirs(local_dir, exist_ok=True)
 
     # Download files from S3
-    s3.download_file(bucket_name, f"{job_id}/embeddings/secondary/index.faiss", f"/tmp/{job_id}/secondextract/index.faiss")
-    s3.download_file(bucket_name, f"{job_id}/embeddings/secondary/index.pkl", f"/tmp/{job_id}/secondextract/index.pkl")
+    if index_format == 'mmap':
+        faiss_index = download_chunk_store(bucket_name, f"{job_id}/embeddings/secondary", "index", local_dir)
+    else:
+        s3.download_file(bucket_name, f"{job_id}/embeddings/secondary/index.faiss", f"/tmp/{job_id}/secondextract/index.faiss")
+        s3.download_file(bucket_name, f"{job_id}/embeddings/secondary/index.pkl", f"/tmp/{job_id}/secondextract/index.pkl")
     
-    faiss_index = FAISS.load_local(f"/tmp/{job_id}/secondextract", embeddings, allow_dangerous_deserialization=True)
+        faiss_index = FAISS.load_local(f"/tmp/{job_id}/secondextract", embeddings, allow_dangerous_deserialization=True)
     
     date_formate = "IMPORTANT: write all date relevant information in yyyy-mm-dd formate"
     Strict_note = "IMPORTANT: If no document found then return the json with blank space only and no extra words in the start or the ending of the JSON keys"
@@ -329,15 +359,27 @@ INSTRUCTIONS:
         prompt7, prompt8
     ]
     
-    for idx, template in enumerate(templates):
+    # The chain and retriever are identical for every template, build them once
+    document_chain = create_stuff_documents_chain(llm,prompt_template)
+    retriever = faiss_index.as_retriever(search_kwargs={"k":18})
+    retrieval_chain = create_retrieval_chain(retriever, document_chain)
+
+    def run_template(idx):
         # print("%",template)
+        template = templates[idx]
         prompt = prompts[idx]
-        document_chain = create_stuff_documents_chain(llm,prompt_template)
-        retriever = faiss_index.as_retriever(search_kwargs={"k":18})
-        retrieval_chain = create_retrieval_chain(retriever, document_chain)
+        start = time.perf_counter()
         data_json_str = json.dumps(template, indent=2)
         response1 = retrieval_chain.invoke({"input": f"Understand and fill the answer for this {data_json_str}.and follow this instruction{prompt}.{date_formate}.Do not return anything extra than the JSON at the start or the ending of JSON , even if you dont find the answer then return JSON as it is without anything extra.striclty do no attach any extra keywords to the given JSON"})
-        data = response1["answer"]
+        elapsed = time.perf_counter() - start
+        print(f"Template {idx + 1} ({', '.join(template)}) took {elapsed:.2f}s")
+        return response1["answer"]
+
+    # Fan the template chains out in parallel; map() keeps results in template order
+    with concurrent.futures.ThreadPoolExecutor(max_workers=min(max_in_flight, len(templates))) as executor:
+        answers = list(executor.map(run_template, range(len(templates))))
+
+    for idx, data in enumerate(answers):
         
         if isinstance(data, str):
             try:
@@ -371,13 +413,11 @@ INSTRUCTIONS:
     # Upload final response to S3
     upload_final_response_to_s3(local_file_path, bucket_name, job_id)
 
-    # Update status in SSM Parameter Store
-    ssm_client.put_parameter(
-        Name=job_id,
-        Value="Extraction completed",
-        Type='String',
-        Overwrite=True,
-    )
+    # Record this branch; the job only becomes "Extraction completed" once both branches are done
+    if job_state.complete_branch(job_id, "secondary"):
+        print(f"Job {job_id} completed")
+        write_final_response_safely(s3, job_id)
+        notify_job_completed(job_state, job_id)
 
     clear_directory_files(local_dir)
 
@@ -392,3 +432,9 @@ INSTRUCTIONS:
         },
         "body": json.dumps(responses),
     }
+
+def lambda_handler(event, context):
+    # Payloads arrive in batches from the stage queue, or as a single direct invoke
+    if 'Records' in event:
+        return consume(event['Records'], process_job, context)
+    return process_job(event, context)
@@ -0,0 +1,32 @@
+"""
+Helpers for loading the Lambda functions under src/ in tests.
+
+Every function directory is its own deployment package with a main.py and
+copies of the shared helper modules, so only one of them can be importable
+at a time. load_function swaps sys.path and drops the modules of the
+previously loaded function before importing the requested one.
+"""
+import importlib
+import os
+import sys
+
+SRC_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'src')
+
+os.environ.setdefault('AWS_DEFAULT_REGION', 'us-east-1')
+os.environ.setdefault('AWS_ACCESS_KEY_ID', 'testing')
+os.environ.setdefault('AWS_SECRET_ACCESS_KEY', 'testing')
+
+
+def load_function(function_dir, module_name='main', **environ):
+    """
+    Import module_name from src/<function_dir> with the given environment
+    variables set, and return the module.
+    """
+    for name, module in list(sys.modules.items()):
+        module_file = getattr(module, '__file__', None) or ''
+        if module_file.startswith(SRC_DIR):
+            del sys.modules[name]
+    sys.path[:] = [path for path in sys.path if not path.startswith(SRC_DIR)]
+    sys.path.insert(0, os.path.join(SRC_DIR, function_dir))
+    os.environ.update({key: str(value) for key, value in environ.items()})
+    return importlib.import_module(module_name)
@@ -0,0 +1,72 @@
+import pytest
+from conftest import load_function
+
+pytest.importorskip('faiss')
+pytest.importorskip('langchain_community')
+
+from langchain_core.embeddings import Embeddings  # noqa: E402
+
+TEXTS = [
+    "The student attended every lecture of the autumn term.",
+    "Final grade for mathematics: A, awarded in June.",
+    "The transcript lists physics, chemistry and biology.",
+    "Recommendation letter from the head of the science department.",
+    "Passport copy with an expiry date in 2031.",
+]
+
+
+class LetterEmbeddings(Embeddings):
+    """Counts letters a-z, so similar texts get similar vectors without a model."""
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        letters = [0.0] * 26
+        for character in text.lower():
+            if 'a' <= character <= 'z':
+                letters[ord(character) - ord('a')] += 1.0
+        return letters
+
+
+def results(vector, query):
+    return [(doc.page_content, doc.metadata, round(float(score), 4)) for doc, score in vector.similarity_search_with_score(query, k=3)]
+
+
+@pytest.mark.parametrize('distance_strategy', ['EUCLIDEAN_DISTANCE', 'MAX_INNER_PRODUCT'])
+def test_saved_store_loads_and_searches_like_the_original(tmp_path, distance_strategy):
+    chunk_store = load_function('primary_Extraction', 'chunk_store')
+    embeddings = LetterEmbeddings()
+    vector = chunk_store.FAISS.from_texts(
+        TEXTS, embeddings, metadatas=[{"page": page} for page in range(len(TEXTS))],
+        distance_strategy=chunk_store.DistanceStrategy[distance_strategy],
+    )
+    paths = chunk_store.save_chunk_store(vector, str(tmp_path))
+    assert sorted(paths) == sorted(chunk_store.CHUNK_STORE_EXTENSIONS)
+
+    loaded = chunk_store.load_chunk_store(str(tmp_path), embeddings)
+    assert loaded.index.ntotal == len(TEXTS)
+    for query in ("mathematics grade", "science recommendation", "passport"):
+        assert results(loaded, query) == results(vector, query)
+
+
+def test_empty_store_round_trips(tmp_path):
+    chunk_store = load_function('primary_Extraction', 'chunk_store')
+    embeddings = LetterEmbeddings()
+    vector = chunk_store.FAISS.from_texts(TEXTS[:1], embeddings)
+    vector.delete(list(vector.index_to_docstore_id.values()))
+    chunk_store.save_chunk_store(vector, str(tmp_path))
+    assert chunk_store.load_chunk_store(str(tmp_path), embeddings).similarity_search("grade") == []
+
+
+def test_legacy_faiss_pickle_converts_to_the_same_search_results(tmp_path):
+    chunk_store = load_function('primary_Extraction', 'chunk_store')
+    embeddings = LetterEmbeddings()
+    legacy = chunk_store.FAISS.from_texts(TEXTS, embeddings, metadatas=[{"source": f"doc{index}.pdf"} for index in range(len(TEXTS))])
+    legacy.save_local(str(tmp_path), index_name="transcript_index")
+
+    chunk_store.convert_faiss_pickle(str(tmp_path), embeddings, index_name="transcript_index")
+
+    converted = chunk_store.load_chunk_store(str(tmp_path), embeddings, index_name="transcript_index")
+    for query in ("biology transcript", "autumn lectures", "expiry date"):
+        assert results(converted, query) == results(legacy, query)
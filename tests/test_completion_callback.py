@@ -0,0 +1,62 @@
+import json
+import socket
+import pytest
+from conftest import load_function
+
+ADDRESSES = {
+    "hooks.example.com": "93.184.216.34",
+    "metadata.example.com": "169.254.169.254",
+    "intranet.example.com": "10.1.2.3",
+    "localhost": "127.0.0.1",
+    "mapped.example.com": "::ffff:127.0.0.1",
+}
+
+
+@pytest.fixture
+def completion_callback(monkeypatch):
+    module = load_function('Konzeprimary', 'completion_callback')
+
+    def getaddrinfo(host, port, *args, **kwargs):
+        if host not in ADDRESSES:
+            raise socket.gaierror("unknown host")
+        family = socket.AF_INET6 if ':' in ADDRESSES[host] else socket.AF_INET
+        return [(family, socket.SOCK_STREAM, 6, '', (ADDRESSES[host], port or 443))]
+
+    monkeypatch.setattr(module.socket, 'getaddrinfo', getaddrinfo)
+    return module
+
+
+@pytest.mark.parametrize("url", [
+    "http://metadata.example.com/latest/meta-data/",
+    "https://intranet.example.com/hook",
+    "http://localhost:8080/hook",
+    "http://127.0.0.1/hook",
+    "http://[::1]/hook",
+    "http://mapped.example.com/hook",
+    "http://unknown.example.com/hook",
+    "ftp://hooks.example.com/hook",
+    "https:///hook",
+])
+def test_non_public_callback_urls_are_refused(completion_callback, url):
+    assert completion_callback.callback_url_error(url) is not None
+
+
+def test_public_callback_url_is_accepted(completion_callback):
+    assert completion_callback.callback_url_error("https://hooks.example.com/konze?x=1") is None
+
+
+def test_allowlist_overrides_resolution(completion_callback, monkeypatch):
+    monkeypatch.setattr(completion_callback, 'callback_allowed_hosts', {"intranet.example.com"})
+    assert completion_callback.callback_url_error("https://intranet.example.com/hook") is None
+    assert completion_callback.callback_url_error("https://hooks.example.com/hook") is not None
+
+
+def test_post_callback_rechecks_the_url(completion_callback, monkeypatch):
+    monkeypatch.setattr(completion_callback._opener, 'open', lambda *args, **kwargs: pytest.fail("callback was sent"))
+    assert not completion_callback.post_callback("http://metadata.example.com/", {"job_id": "job-1"})
+
+
+def test_request_api_rejects_private_callback_urls(monkeypatch):
+    main = load_function('Request_api', JOB_STATE_BACKEND='memory', STAGE_QUEUE_BACKEND='memory')
+    response = main.lambda_handler({'body': json.dumps({'link': 'https://bucket.s3.amazonaws.com/a', 'callback_url': 'http://169.254.169.254/'})}, None)
+    assert response['statusCode'] == 400
@@ -0,0 +1,50 @@
+import boto3
+from moto import mock_aws
+from conftest import load_function
+
+
+@mock_aws
+def test_ssm_store_keeps_one_parameter_per_job():
+    job_state = load_function('Konzeprimary', 'job_state')
+    ssm = boto3.client('ssm')
+    store = job_state.SsmJobStateStore(ssm)
+    store.create("job-1", job_state.IN_PROGRESS, callback_url="https://example.com/hook?a=1")
+    assert store.set_status("job-1", job_state.VECTOR_GENERATED, "primary_embeddings", expected=(job_state.IN_PROGRESS,))
+    assert not store.set_status("job-1", job_state.IN_PROGRESS, "primary_embeddings", expected=(job_state.IN_PROGRESS,))
+
+    assert not store.complete_branch("job-1", "secondary")
+    assert store.get("job-1")["status"] == job_state.VECTOR_GENERATED
+    assert store.complete_branch("job-1", "primary")
+    # A redelivered branch does not complete the job a second time
+    assert not store.complete_branch("job-1", "secondary")
+
+    assert store.get("job-1")["status"] == job_state.EXTRACTION_COMPLETED
+    assert store.get_callback_url("job-1") == "https://example.com/hook?a=1"
+    assert [parameter['Name'] for parameter in ssm.describe_parameters()['Parameters']] == ["job-1"]
+
+
+@mock_aws
+def test_ssm_store_without_callback():
+    job_state = load_function('Konzeprimary', 'job_state')
+    store = job_state.SsmJobStateStore(boto3.client('ssm'))
+    store.create("job-2", job_state.IN_PROGRESS)
+    assert store.get_callback_url("job-2") is None
+    assert store.get_callback_url("missing") is None
+    assert not store.complete_branch("missing", "primary")
+
+
+class FlakyDynamoDB:
+    """Never writes the items of job-1 and job-26."""
+
+    def batch_write_item(self, RequestItems):
+        (table_name, requests), = RequestItems.items()
+        unprocessed = [request for request in requests if request['PutRequest']['Item']['job_id']['S'] in ("job-1", "job-26")]
+        return {'UnprocessedItems': {table_name: unprocessed}}
+
+
+def test_dynamodb_create_many_returns_unwritten_jobs(monkeypatch):
+    job_state = load_function('Konzeprimary', 'job_state')
+    monkeypatch.setattr(job_state.time, 'sleep', lambda seconds: None)
+    store = job_state.DynamoDBJobStateStore(FlakyDynamoDB(), 'jobs')
+    job_ids = [f"job-{index}" for index in range(30)]
+    assert store.create_many(job_ids, job_state.IN_PROGRESS) == ["job-1", "job-26"]
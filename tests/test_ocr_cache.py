@@ -0,0 +1,55 @@
+import os
+from datetime import datetime, timedelta
+import boto3
+import pytest
+from moto import mock_aws
+from conftest import load_function
+
+
+@mock_aws
+def test_s3_cache_deletes_expired_entries_on_read(monkeypatch):
+    ocr_cache = load_function('Konzeprimary', 'ocr_cache')
+    s3 = boto3.client('s3')
+    s3.create_bucket(Bucket='konze-cache')
+    cache = ocr_cache.S3OcrCache(s3, 'konze-cache', 'ocr-cache/', ttl_seconds=3600)
+    key = ocr_cache.page_key(b"page")
+    cache.put(key, "page text")
+    assert cache.get(key) == "page text"
+
+    class Later(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return datetime.now(tz) + timedelta(hours=2)
+
+    monkeypatch.setattr(ocr_cache, 'datetime', Later)
+    assert cache.get(key) is None
+    assert s3.list_objects_v2(Bucket='konze-cache', Prefix='ocr-cache/')['KeyCount'] == 0
+
+
+def test_local_cache_evicts_oldest_entries_without_walking_the_directory(monkeypatch, tmp_path):
+    ocr_cache = load_function('Konzeprimary', 'ocr_cache')
+    cache = ocr_cache.LocalOcrCache(str(tmp_path), max_bytes=250)
+    monkeypatch.setattr(ocr_cache.os, 'walk', lambda *args, **kwargs: pytest.fail("put walked the cache directory"))
+    for index in range(4):
+        cache.put(f"key{index}", "x" * 100)
+
+    assert [cache.get(f"key{index}") is not None for index in range(4)] == [False, False, True, True]
+    assert cache.total_bytes == 200
+    # Rewriting an entry replaces its size instead of adding to it
+    cache.put("key3", "x" * 50)
+    assert cache.total_bytes == 150
+
+
+def test_local_cache_indexes_existing_entries_once(tmp_path):
+    ocr_cache = load_function('Konzeprimary', 'ocr_cache')
+    first = ocr_cache.LocalOcrCache(str(tmp_path), max_bytes=1000)
+    first.put("old", "x" * 100)
+    first.put("new", "x" * 100)
+    os.utime(first._path("old"), (1000, 1000))
+
+    second = ocr_cache.LocalOcrCache(str(tmp_path), max_bytes=150)
+    assert second.total_bytes == 200
+    second.put("newest", "x" * 50)
+    assert second.get("old") is None
+    assert second.get("new") is not None
+    assert second.total_bytes == 150
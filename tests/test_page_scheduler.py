@@ -0,0 +1,131 @@
+import io
+import threading
+import time
+import boto3
+import fitz
+import pytest
+from moto import mock_aws
+from conftest import load_function
+
+
+class StubEngine:
+    name = "stub"
+
+    def page_text(self, img_bytes):
+        return f"text of {len(img_bytes)} bytes", self.name
+
+
+def scanned_pdf(page_total):
+    """A PDF whose pages have no text layer, so every page is rendered for OCR."""
+    document = fitz.open()
+    for _ in range(page_total):
+        document.new_page().draw_rect(fitz.Rect(50, 50, 200, 200), fill=(0, 0, 0))
+    return document.tobytes()
+
+
+@pytest.fixture
+def konzeprimary():
+    return load_function('Konzeprimary', OCR_CACHE_BACKEND='none', JOB_STATE_BACKEND='memory',
+                         STAGE_QUEUE_BACKEND='memory', ASYNC_TEXTRACT_MIN_PAGES=0)
+
+
+def run_with_timeout(scheduler, pdf_files, timeout=10):
+    results = []
+    runner = threading.Thread(target=lambda: results.extend(scheduler.run(pdf_files)), daemon=True)
+    runner.start()
+    runner.join(timeout)
+    assert not runner.is_alive(), "scheduler did not finish"
+    return {path: (text, error) for path, text, _, error in results}
+
+
+def test_failing_page_fails_only_its_document(konzeprimary, monkeypatch):
+    render_page_image = konzeprimary.render_page_image
+
+    def render_or_fail(page):
+        if page.number == 1 and page.parent.page_count == 3:
+            raise RuntimeError("render failed")
+        return render_page_image(page)
+
+    monkeypatch.setattr(konzeprimary, "render_page_image", render_or_fail)
+    scheduler = konzeprimary.PageScheduler(StubEngine(), max_workers=2, max_queued_pages=1)
+    results = run_with_timeout(scheduler, [
+        ("bad.pdf", scanned_pdf(3), None),
+        ("good.pdf", scanned_pdf(2), None),
+    ])
+
+    assert isinstance(results["bad.pdf"][1], RuntimeError)
+    assert results["good.pdf"][1] is None
+    assert results["good.pdf"][0].count("text of") == 2
+
+
+def test_unreadable_pdf_is_reported(konzeprimary):
+    scheduler = konzeprimary.PageScheduler(StubEngine(), max_workers=1)
+    results = run_with_timeout(scheduler, [("broken.pdf", b"not a pdf", None)])
+    assert results["broken.pdf"][1] is not None
+
+
+def test_failing_ocr_call_fails_only_its_document(konzeprimary):
+    class FailingEngine(StubEngine):
+        def page_text(self, img_bytes):
+            raise RuntimeError("OCR failed")
+
+    scheduler = konzeprimary.PageScheduler(FailingEngine(), max_workers=2)
+    results = run_with_timeout(scheduler, [("bad.pdf", scanned_pdf(2), None)])
+    assert isinstance(results["bad.pdf"][1], RuntimeError)
+
+
+class StubPdfBucket:
+    """Lists its PDFs in the given order; reading a PDF takes delays[name] seconds."""
+
+    def __init__(self, pdfs, delays):
+        self.pdfs = pdfs
+        self.delays = delays
+
+    def get_paginator(self, operation):
+        pdfs = self.pdfs
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                yield {'Contents': [{'Key': f"{Prefix}{name}", 'Size': len(data)} for name, data in pdfs.items()]}
+        return Paginator()
+
+    def get_object(self, Bucket, Key):
+        name = Key.rsplit('/', 1)[1]
+        time.sleep(self.delays.get(name, 0))
+        return {'Body': io.BytesIO(self.pdfs[name])}
+
+
+def test_largest_pdf_is_processed_first_even_when_it_arrives_last(konzeprimary, monkeypatch):
+    pdfs = {"small1.pdf": scanned_pdf(1), "small2.pdf": scanned_pdf(1), "large.pdf": scanned_pdf(6)}
+    monkeypatch.setattr(konzeprimary, "in_memory_mode", True)
+    monkeypatch.setattr(konzeprimary, "s3_client", StubPdfBucket(pdfs, {"large.pdf": 0.3}))
+
+    scheduler = konzeprimary.PageScheduler(StubEngine(), max_workers=1, max_queued_pages=1)
+    order = []
+    runner = threading.Thread(target=lambda: order.extend(
+        path for path, _, _, _ in scheduler.run(konzeprimary.pdf_sources("bucket", "student/primary", "/tmp/unused"))
+    ), daemon=True)
+    runner.start()
+    runner.join(10)
+    assert order == ["large.pdf", "small1.pdf", "small2.pdf"]
+
+
+@pytest.mark.parametrize("in_memory", [False, True])
+def test_pdf_sources_stay_inside_the_student_folder(konzeprimary, monkeypatch, tmp_path, in_memory):
+    with mock_aws():
+        s3 = boto3.client('s3')
+        s3.create_bucket(Bucket='students')
+        for key in ("John/primary/a.pdf", "John/secondary/b.pdf", "John/primary/notes.txt",
+                    "John/primary/nested/c.pdf", "Johnny/primary/x.pdf", "Johnny/secondary/y.pdf"):
+            s3.put_object(Bucket='students', Key=key, Body=b"%PDF-")
+        fetched = []
+        s3.meta.events.register('before-parameter-build.s3.GetObject', lambda params, **kwargs: fetched.append(params['Key']))
+        monkeypatch.setattr(konzeprimary, "s3_client", s3)
+        monkeypatch.setattr(konzeprimary, "in_memory_mode", in_memory)
+
+        sources = list(konzeprimary.pdf_sources('students', 'John', str(tmp_path), ("primary", "secondary")))
+
+    assert sorted(s3_key for _, _, s3_key in sources) == ["John/primary/a.pdf", "John/secondary/b.pdf"]
+    assert sorted(fetched) == ["John/primary/a.pdf", "John/secondary/b.pdf"]
+    if not in_memory:
+        assert all(path.startswith(str(tmp_path) + "/") for path, _, _ in sources)
@@ -0,0 +1,72 @@
+import pytest
+from botocore.exceptions import ClientError
+from conftest import load_function
+
+
+def client_error(code, status=400):
+    return ClientError({'Error': {'Code': code}, 'ResponseMetadata': {'HTTPStatusCode': status}}, 'DetectDocumentText')
+
+
+class StubTextract:
+    """Raises the queued errors in turn, then answers with one LINE."""
+
+    class meta:
+        method_to_api_mapping = {'detect_document_text': 'DetectDocumentText'}
+
+    def __init__(self, errors):
+        self.errors = list(errors)
+        self.calls = 0
+
+    def detect_document_text(self, Document):
+        self.calls += 1
+        if self.errors:
+            raise self.errors.pop(0)
+        return {'Blocks': [{'BlockType': 'LINE', 'Text': 'textract'}]}
+
+
+class StubEngine:
+    name = "stub"
+
+    def page_text(self, img_bytes):
+        return "fallback", self.name
+
+
+def rate_limit_module(monkeypatch):
+    monkeypatch.setenv('RATE_LIMIT_BACKOFF_SECONDS', '0')
+    monkeypatch.setenv('RATE_LIMIT_MAX_ATTEMPTS', '5')
+    return load_function('Konzeprimary', 'rate_limit')
+
+
+def test_proxy_retries_throttles_and_transient_errors(monkeypatch):
+    rate_limit = rate_limit_module(monkeypatch)
+    stub = StubTextract([client_error('ThrottlingException'), client_error('InternalServerError', 500)])
+    client = rate_limit.rate_limited_from_env(stub, 'textract')
+    assert client.detect_document_text(Document={'Bytes': b''})['Blocks'][0]['Text'] == 'textract'
+    assert stub.calls == 3
+
+
+def test_proxy_does_not_retry_client_errors(monkeypatch):
+    rate_limit = rate_limit_module(monkeypatch)
+    stub = StubTextract([client_error('InvalidParameterException')])
+    client = rate_limit.rate_limited_from_env(stub, 'textract')
+    with pytest.raises(ClientError):
+        client.detect_document_text(Document={'Bytes': b''})
+    assert stub.calls == 1
+
+
+def test_failover_engine_falls_back_on_the_first_throttle(monkeypatch):
+    rate_limit = rate_limit_module(monkeypatch)
+    ocr_engine = load_function('Konzeprimary', 'ocr_engine')
+    stub = StubTextract([client_error('ThrottlingException')])
+    client = rate_limit.rate_limited_from_env(stub, 'textract')
+    engine = ocr_engine.FailoverEngine(ocr_engine.TextractEngine(client.with_max_attempts(1)), StubEngine())
+    assert engine.page_text(b'') == ("fallback", "stub")
+    assert stub.calls == 1
+    assert engine.failovers == 1
+
+
+def test_throttling_predicate_sees_wrapped_errors(monkeypatch):
+    rate_limit = rate_limit_module(monkeypatch)
+    assert rate_limit.is_throttling_error(client_error('ThrottlingException'))
+    assert rate_limit.is_throttling_error(ValueError("Error raised by bedrock service: ThrottlingException"))
+    assert not rate_limit.is_throttling_error(client_error('ValidationException'))
@@ -0,0 +1,60 @@
+import json
+from conftest import load_function
+
+
+def request_api(job_state_backend='memory'):
+    return load_function(
+        'Request_api',
+        JOB_STATE_BACKEND=job_state_backend,
+        STAGE_QUEUE_BACKEND='memory',
+        PRIMARY_INTAKE_QUEUE_URL='primary-intake',
+        SECONDARY_INTAKE_QUEUE_URL='secondary-intake',
+    )
+
+
+class FailingQueue:
+    """Reports the payloads at the given indexes as unsent."""
+
+    def __init__(self, unsent):
+        self.unsent = unsent
+        self.sent = []
+
+    def send_many(self, payloads):
+        self.sent.extend(payload for index, payload in enumerate(payloads) if index not in self.unsent)
+        return self.unsent
+
+    def depth(self):
+        return None
+
+
+def submit(main, links):
+    response = main.lambda_handler({'body': json.dumps({'links': links})}, None)
+    return response['statusCode'], json.loads(response['body'])
+
+
+def test_batch_reports_jobs_that_could_not_be_queued():
+    main = request_api()
+    main.secondary_queue = FailingQueue([1])
+    links = [f"https://bucket.s3.amazonaws.com/folder{index}" for index in range(3)]
+    status, body = submit(main, links)
+    assert status == 200
+    assert len(body['job_ids']) == 3
+    assert body['failed'] == [{"link": links[1], "job_id": body['job_ids'][1], "error": "job could not be queued"}]
+    assert main.job_state.get(body['job_ids'][1])['status'] == main.SUBMISSION_FAILED
+    assert main.job_state.get(body['job_ids'][0])['status'] == main.IN_PROGRESS
+    assert main.primary_queue.depth() == 3
+
+
+def test_batch_skips_jobs_whose_record_was_not_written(monkeypatch):
+    main = request_api()
+    monkeypatch.setattr(main.job_state, 'create_many', lambda job_ids, *args, **kwargs: job_ids[:1])
+    main.primary_queue = FailingQueue([])
+    status, body = submit(main, ["https://bucket.s3.amazonaws.com/a", "https://bucket.s3.amazonaws.com/b"])
+    assert [failure['error'] for failure in body['failed']] == ["job record could not be written"]
+    assert [payload['job_id'] for payload in main.primary_queue.sent] == body['job_ids'][1:]
+
+
+def test_batch_needs_a_batch_capable_job_state_backend():
+    main = request_api('ssm')
+    status, body = submit(main, ["https://bucket.s3.amazonaws.com/a"])
+    assert status == 400
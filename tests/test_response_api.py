@@ -0,0 +1,49 @@
+import json
+import pytest
+from moto import mock_aws
+from conftest import load_function
+
+
+@pytest.fixture
+def response_api():
+    with mock_aws():
+        main = load_function('Response_api', JOB_STATE_BACKEND='memory')
+        main.s3_client.create_bucket(Bucket=main.OUTPUT_BUCKET)
+        main.s3_client.put_object(Bucket=main.OUTPUT_BUCKET, Key=main.final_response_key("job-1"), Body=b'[{"a":1},{"b":2}]')
+        main.job_state.create("job-1", main.EXTRACTION_COMPLETED)
+        yield main
+
+
+def get(main, job_id, headers=None, query=None):
+    return main.lambda_handler({
+        'httpMethod': 'GET',
+        'pathParameters': {'job_id': job_id},
+        'queryStringParameters': query,
+        'headers': headers,
+    }, None)
+
+
+def post(main, body, headers=None):
+    return main.lambda_handler({'httpMethod': 'POST', 'body': json.dumps(body), 'headers': headers}, None)
+
+
+def test_get_answers_304_for_a_matching_etag(response_api):
+    response = get(response_api, "job-1")
+    assert response['statusCode'] == 200
+    assert json.loads(response['body']) == [{"a": 1}, {"b": 2}]
+    etag = response['headers']['ETag']
+    assert get(response_api, "job-1", headers={'If-None-Match': etag})['statusCode'] == 304
+    assert get(response_api, "job-1", headers={'If-None-Match': '"other"'})['statusCode'] == 200
+
+
+def test_post_never_answers_304(response_api):
+    etag = get(response_api, "job-1")['headers']['ETag']
+    response = post(response_api, {"job_id": "job-1"}, headers={'If-None-Match': etag})
+    assert response['statusCode'] == 200
+    assert json.loads(response['body']) == [{"a": 1}, {"b": 2}]
+
+
+def test_get_reads_options_from_the_query_string(response_api):
+    response = get(response_api, "job-1", query={'pretty': 'true'})
+    assert response['body'] == json.dumps([{"a": 1}, {"b": 2}], indent=4)
+    assert get(response_api, "missing", query={'wait_seconds': '0'})['statusCode'] == 500
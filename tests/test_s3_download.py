@@ -0,0 +1,46 @@
+import io
+import threading
+import time
+from conftest import load_function
+
+
+class StubS3:
+    """Lists objects of the given sizes and tracks how many bytes are being read at once."""
+
+    def __init__(self, sizes):
+        self.sizes = sizes
+        self.lock = threading.Lock()
+        self.reading = 0
+        self.snapshots = []
+
+    def get_paginator(self, operation):
+        sizes = self.sizes
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix):
+                yield {'Contents': [{'Key': f"{Prefix}{key}", 'Size': size} for key, size in sizes.items()]}
+        return Paginator()
+
+    def get_object(self, Bucket, Key):
+        size = self.sizes[Key.rsplit('/', 1)[1]]
+        with self.lock:
+            self.reading += size
+            self.snapshots.append(self.reading)
+        time.sleep(0.01)
+        with self.lock:
+            self.reading -= size
+        return {'Body': io.BytesIO(b"x" * size)}
+
+
+def test_read_files_from_s3_bounds_bytes_in_flight():
+    s3_download = load_function('Konzeprimary', 's3_download')
+    sizes = {f"doc{index}.pdf": 400 for index in range(20)}
+    sizes["huge.pdf"] = 5000
+    client = StubS3(sizes)
+
+    results = dict(s3_download.read_files_from_s3(client, 'bucket', 'folder', max_workers=8, max_bytes_in_flight=1000))
+
+    assert {key: len(data) for key, data in results.items()} == sizes
+    # Reads stay within the budget, except the oversized object, which is read on its own
+    assert all(reading <= 1000 or reading == 5000 for reading in client.snapshots)
+    assert max(client.snapshots) > 400  # Still reads in parallel
@@ -0,0 +1,57 @@
+import boto3
+from moto import mock_aws
+from conftest import load_function
+
+
+class Context:
+    """Lambda context whose remaining time drops by step_ms every time it is read."""
+
+    def __init__(self, remaining_ms, step_ms):
+        self.remaining_ms = remaining_ms
+        self.step_ms = step_ms
+
+    def get_remaining_time_in_millis(self):
+        remaining = self.remaining_ms
+        self.remaining_ms -= self.step_ms
+        return remaining
+
+
+def test_skipped_records_are_requeued_without_a_receive():
+    stage_queue = load_function('Konzeprimary', 'stage_queue')
+    queue = stage_queue.InMemoryStageQueue(max_receive_count=1)
+    queue.send_many([{"job_id": index} for index in range(3)])
+    handled = []
+    records = queue.receive(3)
+    # Time for the first record only
+    result = stage_queue.consume(records, lambda payload, context: handled.append(payload), Context(40000, 20000), source=queue)
+    assert result == {"batchItemFailures": []}
+    for record in records:
+        queue.delete(record['messageId'])
+    queue.drain(lambda payload, context: handled.append(payload))
+    assert handled == [{"job_id": 0}, {"job_id": 1}, {"job_id": 2}]
+    assert queue.dead_letters == []
+
+
+def test_failed_records_are_reported():
+    stage_queue = load_function('Konzeprimary', 'stage_queue')
+
+    def handler(payload, context):
+        if payload["job_id"] == 1:
+            raise RuntimeError("boom")
+
+    records = [{'messageId': str(index), 'body': f'{{"job_id": {index}}}'} for index in range(3)]
+    assert stage_queue.consume(records, handler) == {"batchItemFailures": [{"itemIdentifier": "1"}]}
+
+
+@mock_aws
+def test_skipped_sqs_records_go_back_to_their_queue():
+    stage_queue = load_function('Konzeprimary', 'stage_queue')
+    sqs = boto3.client('sqs')
+    queue_url = sqs.create_queue(QueueName='konze-stage')['QueueUrl']
+    queue_arn = sqs.get_queue_attributes(QueueUrl=queue_url, AttributeNames=['QueueArn'])['Attributes']['QueueArn']
+    records = [{'messageId': 'm1', 'body': '{"job_id": 1}', 'eventSourceARN': queue_arn}]
+    result = stage_queue.consume(records, lambda payload, context: None, Context(1000, 0))
+    assert result == {"batchItemFailures": []}
+    messages = sqs.receive_message(QueueUrl=queue_url, AttributeNames=['ApproximateReceiveCount'])['Messages']
+    assert [message['Body'] for message in messages] == ['{"job_id": 1}']
+    assert messages[0]['Attributes']['ApproximateReceiveCount'] == '1'
@@ -0,0 +1,100 @@
+import time
+import boto3
+import fitz
+import pytest
+from moto import mock_aws
+from moto.textract.models import TextractBackend, TextractJobStatus
+from conftest import load_function
+
+
+def line(text, page):
+    return {'BlockType': 'LINE', 'Text': text, 'Page': page}
+
+
+@pytest.fixture
+def textract(monkeypatch):
+    monkeypatch.setattr(TextractBackend, 'JOB_STATUS', TextractJobStatus.succeeded)
+    monkeypatch.setattr(TextractBackend, 'BLOCKS', [])
+    with mock_aws():
+        yield boto3.client('textract')
+
+
+@pytest.fixture
+def textract_async():
+    return load_function('Konzeprimary', 'textract_async')
+
+
+def test_page_texts_are_reassembled_in_page_order(textract, textract_async, monkeypatch):
+    monkeypatch.setattr(TextractBackend, 'BLOCKS', [
+        line("second page", 2), {'BlockType': 'WORD', 'Text': 'ignored', 'Page': 1},
+        line("first page", 1), line("continued", 1),
+    ])
+    page_texts = textract_async.detect_document_text_async(textract, 'bucket', 'doc.pdf', 3, poll_seconds=0.01)
+    assert page_texts == ["first page continued", "second page", ""]
+
+
+def test_failed_job_raises(textract, textract_async, monkeypatch):
+    monkeypatch.setattr(TextractBackend, 'JOB_STATUS', TextractJobStatus.failed)
+    with pytest.raises(textract_async.AsyncTextractError):
+        textract_async.detect_document_text_async(textract, 'bucket', 'doc.pdf', 1, poll_seconds=0.01)
+
+
+def test_unfinished_job_times_out(textract, textract_async, monkeypatch):
+    monkeypatch.setattr(TextractBackend, 'JOB_STATUS', TextractJobStatus.in_progress)
+    start_time = time.monotonic()
+    with pytest.raises(textract_async.AsyncTextractError):
+        textract_async.detect_document_text_async(textract, 'bucket', 'doc.pdf', 1, poll_seconds=0.01, timeout_seconds=0.1)
+    assert time.monotonic() - start_time < 1
+
+
+def test_no_job_is_started_without_time_to_wait(textract_async):
+    class NoStart:
+        def start_document_text_detection(self, **kwargs):
+            raise AssertionError("job started")
+
+    with pytest.raises(textract_async.AsyncTextractError):
+        textract_async.detect_document_text_async(NoStart(), 'bucket', 'doc.pdf', 1, poll_seconds=5, timeout_seconds=2)
+
+
+def test_result_pages_are_followed(textract_async):
+    class Paged:
+        def get_document_text_detection(self, JobId, NextToken=None):
+            return {'Blocks': [line("from page two of the results", 1)]}
+
+    first_response = {'Blocks': [line("first", 1)], 'NextToken': 'more'}
+    assert textract_async.collect_page_texts(Paged(), 'job', first_response, 1) == ["first from page two of the results"]
+
+
+def scanned_pdf(page_total):
+    document = fitz.open()
+    for _ in range(page_total):
+        document.new_page().draw_rect(fitz.Rect(50, 50, 200, 200), fill=(0, 0, 0))
+    return document.tobytes()
+
+
+def test_scheduler_sends_long_documents_to_async_textract(textract, monkeypatch):
+    monkeypatch.setattr(TextractBackend, 'BLOCKS', [line("page one", 1), line("page three", 3)])
+    konzeprimary = load_function('Konzeprimary', OCR_CACHE_BACKEND='none', JOB_STATE_BACKEND='memory',
+                                 STAGE_QUEUE_BACKEND='memory', OCR_ENGINE='textract',
+                                 ASYNC_TEXTRACT_MIN_PAGES=3, ASYNC_TEXTRACT_POLL_SECONDS=0.01)
+    scheduler = konzeprimary.PageScheduler(konzeprimary.ocr_engine, 2, source_bucket='bucket',
+                                           deadline=time.monotonic() + 10)
+    results = list(scheduler.run([("long.pdf", scanned_pdf(3), "folder/long.pdf")]))
+
+    [(path, text, page_counts, error)] = results
+    assert error is None
+    assert text == "page one  page three "
+    assert page_counts == {"text_layer": 0, "textract": 3}
+
+
+def test_scheduler_fails_document_past_deadline(textract, monkeypatch):
+    monkeypatch.setattr(TextractBackend, 'JOB_STATUS', TextractJobStatus.in_progress)
+    konzeprimary = load_function('Konzeprimary', OCR_CACHE_BACKEND='none', JOB_STATE_BACKEND='memory',
+                                 STAGE_QUEUE_BACKEND='memory', OCR_ENGINE='textract',
+                                 ASYNC_TEXTRACT_MIN_PAGES=3, ASYNC_TEXTRACT_POLL_SECONDS=0.01)
+    scheduler = konzeprimary.PageScheduler(konzeprimary.ocr_engine, 2, source_bucket='bucket',
+                                           deadline=time.monotonic() + 0.2)
+    start_time = time.monotonic()
+    [(_, _, _, error)] = list(scheduler.run([("long.pdf", scanned_pdf(3), "folder/long.pdf")]))
+    assert isinstance(error, Exception)
+    assert time.monotonic() - start_time < 2